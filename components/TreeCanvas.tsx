@@ -1,5 +1,5 @@
 ﻿"use client";
-import React, { useState, useCallback, useEffect, useMemo } from "react";
+import React, { useState, useCallback, useEffect, useLayoutEffect, useMemo, useRef } from "react";
 import { useApp } from "@/lib/AppContext";
 
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -9,13 +9,22 @@ import { useApp } from "@/lib/AppContext";
 const RAW = require("@/scripts/pic_layers_report.json") as {
   original_size: { width: number; height: number };
   layers: LayerEntry[];
+  atlases?: AtlasSheet[]; // written by scripts/pack_atlas.py
+  hit_index?: HitIndex;   // written by scripts/hit_index.py
 };
+interface PyramidLevel { src: string; scale: number; width: number; height: number; }
+interface AtlasSheet { src: string; width: number; height: number; }
+interface AtlasRect { index: number; x: number; y: number; w: number; h: number; }
+// Zone label raster over the viewBox: cell x cell units, RLE of uint16 LE (value, length)
+interface HitIndex { cell: number; cols: number; rows: number; zones: string[]; rle: string; }
 interface LayerEntry {
   id: string; source: string;
   x: number; y: number; width: number; height: number;
   rotation?: number; flipX?: boolean;
   zIndex: number; opacity: number;
   isSliced?: boolean; sliceType?: string; origH?: number; origY?: number;
+  pyramid?: PyramidLevel[]; // 1x, 1/2, 1/4, 1/8 written by scripts/crop_layers.py
+  atlas?: AtlasRect;        // region of RAW.atlases[index] holding this layer
 }
 
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -64,6 +73,15 @@ function levelFor(prog:number):number{
 //  IMAGE LAYER HELPERS
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 function imgSrc(source:string){ return `/pic_layers/layer_${source}`; }
+// Smallest pyramid level that still has >= 1 image px per device px at pxPerUnit
+// (device px per viewBox unit); full-size PNG when the layer has no pyramid.
+function layerSrc(l:LayerEntry,pxPerUnit:number){
+  const full=l.pyramid?.find(p=>p.scale===1);
+  if(!full) return imgSrc(l.source);
+  const need=pxPerUnit*l.width/full.width;
+  const fit=[...l.pyramid!].sort((a,b)=>a.scale-b.scale).find(p=>p.scale>=need)??full;
+  return `/pic_layers/${fit.src}`;
+}
 function layerTransform(l:LayerEntry, renderY:number, renderH:number){
   const cx=l.x+l.width/2, cy=renderY+renderH/2;
   const parts:string[]=[];
@@ -83,6 +101,29 @@ function classifyLayer(l:LayerEntry):{type:"bg"|"env"|"branch";group?:string;lev
 // Group A â†’ piano, Group B â†’ assistant, C/D/E â†’ decorative (health score)
 const GROUP_ZONE:{[g:string]:ZoneId|null}={A:"piano",B:"assistant",C:null,D:null,E:null};
 
+// Decode RAW.hit_index once: cell value 0 = no zone, k = zones[k-1]
+function decodeHitIndex(h:HitIndex):Uint8Array{
+  const bin=atob(h.rle);
+  const cells=new Uint8Array(h.cols*h.rows);
+  let p=0;
+  for(let i=0;i+3<bin.length;i+=4){
+    const v=bin.charCodeAt(i)|bin.charCodeAt(i+1)<<8;
+    const n=bin.charCodeAt(i+2)|bin.charCodeAt(i+3)<<8;
+    cells.fill(v,p,p+n);p+=n;
+  }
+  return cells;
+}
+const HIT=RAW.hit_index;
+const HIT_CELLS=HIT?decodeHitIndex(HIT):null;
+// viewBox point -> zone, O(1)
+function zoneAt(x:number,y:number):ZoneId|null{
+  if(!HIT||!HIT_CELLS) return null;
+  const c=Math.floor(x/HIT.cell), r=Math.floor(y/HIT.cell);
+  if(c<0||r<0||c>=HIT.cols||r>=HIT.rows) return null;
+  const k=HIT_CELLS[r*HIT.cols+c];
+  return k?HIT.zones[k-1] as ZoneId:null;
+}
+
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 //  NEW TREE LAYOUT CONSTANTS  (viewBox 5120 Ã— 3365)
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -376,14 +417,30 @@ function FlowerTip({cx,cy,prog}:{cx:number;cy:number;prog:number}){
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 //  SINGLE IMAGE LAYER RENDERER
 // â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-function LayerImg({l,extraStyle,clipId}:{l:LayerEntry;extraStyle?:React.CSSProperties;clipId?:string}){
+function LayerImg({l,pxPerUnit,extraStyle,clipId}:{l:LayerEntry;pxPerUnit:number;extraStyle?:React.CSSProperties;clipId?:string}){
   const isSliced=l.isSliced===true;
   const renderY=isSliced&&l.sliceType==="bottom"?(l.origY??l.y):l.y;
   const renderH=isSliced?(l.origH??l.height):l.height;
   const tr=layerTransform(l,renderY,renderH);
+  const sheet=l.atlas&&RAW.atlases?.[l.atlas.index];
+  if(l.atlas&&sheet){
+    // Atlas layer: a nested <svg> whose viewBox is the packed rect crops the sheet
+    const a=l.atlas;
+    return(
+      <g transform={tr||undefined} clipPath={clipId?`url(#${clipId})`:undefined}>
+        <g opacity={l.opacity} style={extraStyle}>
+          <svg x={l.x} y={renderY} width={l.width} height={renderH}
+            viewBox={`${a.x} ${a.y} ${a.w} ${a.h}`} preserveAspectRatio="none">
+            <image href={`/pic_layers/${sheet.src}`} width={sheet.width} height={sheet.height}/>
+          </svg>
+        </g>
+      </g>
+    );
+  }
+  if(!pxPerUnit) return null; // SVG not measured yet: no request for a guessed level
   return(
     <g transform={tr||undefined} clipPath={clipId?`url(#${clipId})`:undefined}>
-      <image href={imgSrc(l.source)} x={l.x} y={renderY}
+      <image href={layerSrc(l,pxPerUnit)} x={l.x} y={renderY}
         width={l.width} height={renderH}
         preserveAspectRatio="none" opacity={l.opacity}
         style={extraStyle}/>
@@ -400,6 +457,27 @@ export default function TreeCanvas(){
   const [fullPanel,setFullPanel]=useState<ZoneId|null>(null);
   const [hovered,  setHovered]  =useState<ZoneId|null>(null);
 
+  // Device px per viewBox unit, for picking pyramid levels. 0 until the SVG has
+  // been measured; pyramid images are not rendered before that, and the layout
+  // effect re-renders before paint, so each layer is requested once at the
+  // right level. Then follows the rendered SVG size.
+  const svgRef=useRef<SVGSVGElement>(null);
+  const [pxPerUnit,setPxPerUnit]=useState(0);
+  useLayoutEffect(()=>{
+    const el=svgRef.current;
+    if(!el) return;
+    const measure=()=>{
+      const r=el.getBoundingClientRect();
+      // preserveAspectRatio "meet" -> the smaller ratio wins; never step back down
+      const next=Math.min(r.width/VW,r.height/VH)*(window.devicePixelRatio||1);
+      setPxPerUnit(p=>Math.max(p,next));
+    };
+    measure();
+    const ro=new ResizeObserver(measure);
+    ro.observe(el);
+    return()=>ro.disconnect();
+  },[]);
+
   useEffect(()=>{
     const fn=(e:MouseEvent)=>{if(popup&&!(e.target as Element).closest("[data-popup]"))setPopup(null);};
     document.addEventListener("mousedown",fn);
@@ -410,6 +488,13 @@ export default function TreeCanvas(){
     e.stopPropagation();setPopup(p=>p?.zone===zone?null:{zone,sx:e.clientX,sy:e.clientY});setFullPanel(null);
   },[]);
   const openFull=useCallback((zone:ZoneId)=>{setFullPanel(zone);setPopup(null);},[]);
+  // Pointer -> viewBox units -> zone from the hit index
+  const zoneOf=useCallback((e:React.MouseEvent)=>{
+    const m=svgRef.current?.getScreenCTM();
+    if(!m) return null;
+    const p=new DOMPoint(e.clientX,e.clientY).matrixTransform(m.inverse());
+    return zoneAt(p.x,p.y);
+  },[]);
 
   const gp=(id:string)=>app.getTeamProgress(id);
   const gs=(id:string)=>app.getTeamStats(id);
@@ -491,7 +576,7 @@ export default function TreeCanvas(){
       </div>
 
       {/* â”€â”€ SVG CANVAS â”€â”€ */}
-      <svg viewBox={`0 0 ${VW} ${VH}`} preserveAspectRatio="xMidYMid meet"
+      <svg ref={svgRef} viewBox={`0 0 ${VW} ${VH}`} preserveAspectRatio="xMidYMid meet"
         className="w-full h-full" style={{display:"block"}}>
 
         <defs>
@@ -525,7 +610,7 @@ export default function TreeCanvas(){
         </defs>
 
         {/* â”€â”€ 1. BACKGROUND (layer_15) â€” no interaction â”€â”€ */}
-        {bgLayer&&<image href={imgSrc(bgLayer.source)} x="0" y="0" width={VW} height={VH} preserveAspectRatio="none"/>}
+        {bgLayer&&pxPerUnit>0&&<image href={layerSrc(bgLayer,pxPerUnit)} x="0" y="0" width={VW} height={VH} preserveAspectRatio="none"/>}
 
         {/* â”€â”€ 2. WIND LINES near mkt cloud (Rule VIII) â”€â”€ */}
         {WIND_LINES.map((wl,i)=>(
@@ -550,7 +635,7 @@ export default function TreeCanvas(){
             const isSlicedClip=isSliced?`clip-${sid}`:undefined;
             return(
               <g key={l.id} className={extraClass}>
-                <LayerImg l={l} extraStyle={{filter,transition:"filter 0.25s"}} clipId={isSlicedClip}/>
+                <LayerImg l={l} pxPerUnit={pxPerUnit} extraStyle={{filter,transition:"filter 0.25s"}} clipId={isSlicedClip}/>
               </g>
             );
           })}
@@ -571,7 +656,7 @@ export default function TreeCanvas(){
             const zone=GROUP_ZONE[grp];
             const filter=zone?zF(zone):"none";
             return(
-              <LayerImg key={l.id} l={l} extraStyle={{filter,transition:"filter 0.25s"}}/>
+              <LayerImg key={l.id} l={l} pxPerUnit={pxPerUnit} extraStyle={{filter,transition:"filter 0.25s"}}/>
             );
           })}
         </g>
@@ -591,6 +676,13 @@ export default function TreeCanvas(){
         ))}
 
         {/* â”€â”€ 7. TRANSPARENT INTERACTIVE ZONES (click targets) â”€â”€ */}
+        {HIT_CELLS?(
+          // one rect; pointer -> zone from the precomputed hit index
+          <rect x={0} y={0} width={VW} height={VH} fill="transparent"
+            style={{cursor:hovered?"pointer":"default"}}
+            onMouseMove={e=>setHovered(zoneOf(e))} onMouseLeave={()=>setHovered(null)}
+            onClick={e=>{const z=zoneOf(e);if(z)openZone(z,e);}}/>
+        ):(<>
         {/* mkt: upper-left area over layer_2 */}
         <rect x={0} y={0} width={900} height={850} fill="transparent" style={{cursor:"pointer"}}
           onMouseEnter={()=>setHovered("mkt")} onMouseLeave={()=>setHovered(null)}
@@ -623,6 +715,7 @@ export default function TreeCanvas(){
         <rect x={1650} y={0} width={930} height={750} fill="transparent" style={{cursor:"pointer"}}
           onMouseEnter={()=>setHovered("assistant")} onMouseLeave={()=>setHovered(null)}
           onClick={e=>openZone("assistant",e)}/>
+        </>)}
 
         {/* â”€â”€ 8. CANOPY BADGES (Rule V â€” permanent label, expands on hover) â”€â”€ */}
         <CanopyBadge cx={PIANO_CX} cy={PIANO_CY} icon="ðŸŽ¹" title="Piano"
@@ -1,150 +1,597 @@
+"""
+align_sift.py
+Căn chỉnh các layer 2..15 vào ảnh nền 1.png bằng SIFT + FLANN (hoặc một
+backend feature nhị phân nhanh hơn, xem --backend).
+
+Chạy: python align_sift.py [--workers N] [--no-cache] [--mode single|pyramid]
+                           [--backend sift-flann] [--compare] [--profile release]
+  Descriptor của ảnh nền (mọi scale của --mode × mọi backend của --compare)
+  được tính một lần trong process chính rồi chia sẻ cho các worker; mỗi
+  layer được căn chỉnh song song trong một process riêng (mặc định
+  min(4, số CPU) vì mỗi worker giữ một layer RGBA full-res + ảnh nền xám
+  full-res; 1 = chạy tuần tự). Báo cáo luôn được ghi theo thứ tự layer.
+  Keypoint/descriptor được cache trong scripts/.cache/features (theo hash nội
+  dung file + scale + tham số SIFT), nên chỉ layer nào thay đổi mới phải
+  trích xuất lại.
+
+  --mode single   : (mặc định) SIFT ở SCALE (1/4), chỉ đổi translation về
+                    full-res — vị trí layer như các lần chạy trước.
+  --mode pyramid  : (opt-in) ước lượng ở COARSE_SCALE (1/8, ít keypoint hơn;
+                    không đủ match thì lùi về SCALE), rồi tinh chỉnh bằng ECC
+                    trong vài cửa sổ full-res quanh vị trí dự đoán và fit lại
+                    transform (similarity) từ các điểm đó → sub-pixel.
+  Mỗi entry của report có "align": số match/inlier và residual_px = sai số
+  RMS (px full-res) của transform cuối trên các điểm tương ứng dùng để fit.
+  Layer chỉ được warp vào cửa sổ đích tính từ bbox alpha và M (không cấp
+  phát canvas cỡ ảnh nền, không quét findNonZero cả canvas).
+
+  --backend : detector + matcher dùng để ước lượng transform (BACKENDS):
+      sift-flann  SIFT + FLANN KD-tree (như trước)
+      orb-lsh     ORB + FLANN LSH          orb-bf    ORB + brute-force Hamming
+      akaze-lsh   AKAZE + FLANN LSH        akaze-bf  AKAZE + brute-force Hamming
+    ORB/AKAZE là descriptor nhị phân, chạy hoàn toàn trên CPU.  Backend nào
+    bản OpenCV không có (AKAZE trên OpenCV 5 không contrib) thì bị bỏ qua.
+  --compare : chạy thêm mọi backend khác trên từng layer (chỉ ước lượng, không
+    lưu ảnh).  Report có "backends": thời gian, số layer căn được, tỉ lệ
+    inlier và residual của từng backend, để chọn backend nhanh nhất vẫn đủ tin.
+  --profile : cách nén PNG đầu ra (encode.py: fast | release | palette); mỗi
+    worker tự encode layer của nó nên việc nén đã chạy song song theo process.
+"""
 import cv2
 import numpy as np
 import os
+import sys
 import json
+import time
+import argparse
+from concurrent.futures import ProcessPoolExecutor
 from PIL import Image as PILImage
 
+from bbox import mask_bbox
+from encode import DEFAULT_PROFILE, PROFILES, save_png
+from feature_cache import FeatureCache
+from paths import path
+
 # For massive image sizes
 PILImage.MAX_IMAGE_PIXELS = None
 
-base_dir = r"D:\CRM WEB\PIC-TREE"
-out_dir = r"d:\CRM WEB\team-progress-tracker\public\pic_aligned"
-report_dir = r"d:\CRM WEB\team-progress-tracker\scripts"
-
-os.makedirs(out_dir, exist_ok=True)
-
-# 1. Load reference image
-ref_path = os.path.join(base_dir, "1.png")
-print("Loading reference image...")
-ref_img = cv2.imread(ref_path)
-if ref_img is None:
-    print(f"Cannot load {ref_path}")
-    exit()
-
-h_full, w_full = ref_img.shape[:2]
+base_dir = path("pic_tree", r"D:\CRM WEB\PIC-TREE")
+out_dir = path("pic_aligned", r"d:\CRM WEB\team-progress-tracker\public\pic_aligned")
+report_dir = path("report_dir", r"d:\CRM WEB\team-progress-tracker\scripts")
 
 # Scale down for faster feature matching
 SCALE = 0.25
-ref_small = cv2.resize(ref_img, (0, 0), fx=SCALE, fy=SCALE, interpolation=cv2.INTER_AREA)
-ref_gray_small = cv2.cvtColor(ref_small, cv2.COLOR_BGR2GRAY)
-
-print("Extracting SIFT features from reference...")
-sift = cv2.SIFT_create()
-kp_ref, des_ref = sift.detectAndCompute(ref_gray_small, None)
+MODES = ("single", "pyramid")
+COARSE_SCALE = 0.125     # pyramid: first estimate
+REFINE_WINDOW = 256      # pyramid: full-res ECC window size (px)
+REFINE_WINDOWS = 6       # ... and how many, picked by texture inside the alpha
+REFINE_MARGIN = 48       # ref px around the predicted window (coarse error budget)
+ECC_MIN_CC = 0.6         # windows whose ECC correlation is lower are dropped
+ECC_CRITERIA = (cv2.TERM_CRITERIA_COUNT | cv2.TERM_CRITERIA_EPS, 60, 1e-4)
+LAYER_IDS = range(2, 16)
+# cv2.SIFT_create defaults, spelled out so they are part of the cache key
+SIFT_PARAMS = dict(nfeatures=0, nOctaveLayers=3, contrastThreshold=0.04,
+                   edgeThreshold=10, sigma=1.6)
+# ORB keeps only nfeatures keypoints: raised from 500 for canvas-sized layers
+ORB_PARAMS = dict(nfeatures=5000, scaleFactor=1.2, nlevels=8, edgeThreshold=31,
+                  fastThreshold=20)
+AKAZE_PARAMS = dict(threshold=0.001, nOctaves=4, nOctaveLayers=4)
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "features")
 
 FLANN_INDEX_KDTREE = 1
 index_params = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
 search_params = dict(checks=50)
-flann = cv2.FlannBasedMatcher(index_params, search_params)
+FLANN_INDEX_LSH = 6
+lsh_index_params = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12,
+                        multi_probe_level=1)
 
-report = {
-    "original_size": {"width": w_full, "height": h_full},
-    "viewBox": f"0 0 {w_full} {h_full}",
-    "layers": []
+# constructor is None when this OpenCV build lacks it (AKAZE left the main
+# module in OpenCV 5 builds without contrib)
+DETECTORS = {
+    "sift":  (cv2.SIFT_create, SIFT_PARAMS),
+    "orb":   (cv2.ORB_create, ORB_PARAMS),
+    "akaze": (getattr(cv2, "AKAZE_create", None), AKAZE_PARAMS),
+}
+MATCHERS = {
+    "flann": lambda: cv2.FlannBasedMatcher(index_params, search_params),
+    "lsh":   lambda: cv2.FlannBasedMatcher(lsh_index_params, search_params),
+    "bf":    lambda: cv2.BFMatcher(cv2.NORM_HAMMING),
+}
+# backend → (detector, matcher)
+BACKENDS = {
+    "sift-flann": ("sift", "flann"),
+    "orb-lsh":    ("orb", "lsh"),
+    "orb-bf":     ("orb", "bf"),
+    "akaze-lsh":  ("akaze", "lsh"),
+    "akaze-bf":   ("akaze", "bf"),
 }
+DEFAULT_BACKEND = "sift-flann"
+AVAILABLE_BACKENDS = [b for b, (d, _) in BACKENDS.items() if DETECTORS[d][0] is not None]
+
+
+def feature_cache(enabled=True, scale=SCALE, detector="sift"):
+    # SIFT keeps its original key so existing cache entries stay valid
+    return FeatureCache(CACHE_DIR, {"scale": scale, detector: DETECTORS[detector][1]}) if enabled else None
+
+
+def create_detector(detector="sift"):
+    create, params = DETECTORS[detector]
+    return create(**params)
+
+
+def detect(det, gray, mask=None):
+    """detectAndCompute → ((N, 2) float32 points, descriptors or None)."""
+    kp, des = det.detectAndCompute(gray, mask)
+    return np.float32([k.pt for k in kp]).reshape(-1, 2), des
+
+
+def extract_reference(ref_path, cache=None, scale=SCALE, detector="sift"):
+    """Features of the reference at `scale` → (w_full, h_full, ref_pts, des_ref).
+
+    Keypoints are returned as a plain (N, 2) float32 array so they can be
+    shipped to worker processes (cv2.KeyPoint does not pickle).  On a cache
+    hit the reference is not even decoded.
+    """
+    if not os.path.exists(ref_path):
+        return None
+    hit = cache.load(ref_path) if cache else None
+    if hit is not None:
+        h_full, w_full = (int(v) for v in hit["shape"][:2])
+        return w_full, h_full, hit["pts"], hit["des"]
+    ref_img = cv2.imread(ref_path)
+    if ref_img is None:
+        return None
+    h_full, w_full = ref_img.shape[:2]
+    ref_small = cv2.resize(ref_img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    ref_gray_small = cv2.cvtColor(ref_small, cv2.COLOR_BGR2GRAY)
+    ref_pts, des_ref = detect(create_detector(detector), ref_gray_small)
+    if cache:
+        cache.save(ref_path, pts=ref_pts, des=des_ref, shape=np.array(ref_img.shape))
+    return w_full, h_full, ref_pts, des_ref
+
+
+def layer_features(layer_path, layer_img, scale=SCALE, detector="sift"):
+    """Points/descriptors of a layer at `scale`, inside its alpha mask (cached)."""
+    cache = worker_cache(scale, detector)
+    hit = cache.load(layer_path) if cache else None
+    if hit is not None:
+        return hit["pts"], (hit["des"] if len(hit["des"]) else None)
+
+    layer_small = cv2.resize(layer_img, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
 
-for i in range(2, 16):
-    layer_name = f"{i}.png"
-    layer_path = os.path.join(base_dir, layer_name)
-    if not os.path.exists(layer_path):
-        continue
-        
-    print(f"\n[{layer_name}] Aligning...")
-    # Read with alpha
-    layer_img = cv2.imread(layer_path, cv2.IMREAD_UNCHANGED)
-    if layer_img is None:
-        print(f"  Cannot load {layer_path}")
-        continue
-        
-    layer_small = cv2.resize(layer_img, (0, 0), fx=SCALE, fy=SCALE, interpolation=cv2.INTER_AREA)
-    
     if layer_small.shape[2] == 4:
         bgr_small = layer_small[:, :, :3]
         alpha_small = layer_small[:, :, 3]
     else:
         bgr_small = layer_small
         alpha_small = np.ones(bgr_small.shape[:2], dtype=np.uint8) * 255
-        
+
     _, mask_small = cv2.threshold(alpha_small, 10, 255, cv2.THRESH_BINARY)
     gray_small = cv2.cvtColor(bgr_small, cv2.COLOR_BGR2GRAY)
-    
-    kp_layer, des_layer = sift.detectAndCompute(gray_small, mask_small)
-    print(f"  Found {len(kp_layer)} keypoints.")
-    
-    if des_layer is None or len(des_layer) < 10:
-        print(f"  Not enough features in {layer_name}")
-        continue
-        
-    matches = flann.knnMatch(des_layer, des_ref, k=2)
-    
+
+    pts, des = detect(worker_detector(detector), gray_small, mask_small)
+    if cache:
+        cache.save(layer_path, pts=pts,
+                   des=des if des is not None else np.zeros((0, 0), np.uint8))
+    return pts, des
+
+
+# ── Worker state (set once per process by init_worker) ───────────────────────
+_ref = {}
+
+def mode_scales(mode):
+    """Feature scales locate() may use, in the order it tries them."""
+    return (COARSE_SCALE, SCALE) if mode == "pyramid" else (SCALE,)
+
+def reference(ref_path, mode="single", use_cache=True, backends=(DEFAULT_BACKEND,)):
+    """init_worker() args up to the mode: (ref_path, w_full, h_full, refs), refs =
+    {(scale, detector): (ref_pts, des_ref)} for every scale of `mode` and every
+    detector of `backends` — extracted once here, in the parent, so workers
+    never run (or cache) the reference extraction themselves."""
+    refs, size = {}, None
+    for detector in dict.fromkeys(BACKENDS[b][0] for b in backends):
+        for scale in mode_scales(mode):
+            ref = extract_reference(ref_path, feature_cache(use_cache, scale, detector), scale, detector)
+            if ref is None:
+                return None
+            size = ref[:2]
+            refs[(scale, detector)] = ref[2:]
+    return (ref_path, *size, refs)
+
+def init_worker(ref_path, w_full, h_full, refs, mode="single", use_cache=True, threads=None,
+                backends=(DEFAULT_BACKEND,), profile=DEFAULT_PROFILE):
+    """backends[0] places the layers; any others are only timed (--compare)."""
+    if threads is not None:
+        cv2.setNumThreads(threads)   # avoid oversubscribing cores across workers
+    _ref.clear()
+    _ref.update(ref_path=ref_path, w_full=w_full, h_full=h_full, mode=mode, profile=profile,
+                refs=refs, use_cache=use_cache,
+                backends=tuple(backends), caches={}, detectors={}, matchers={})
+
+
+def worker_cache(scale, detector):
+    key = (scale, detector)
+    if key not in _ref["caches"]:
+        _ref["caches"][key] = feature_cache(_ref["use_cache"], scale, detector)
+    return _ref["caches"][key]
+
+
+def worker_detector(detector):
+    if detector not in _ref["detectors"]:
+        _ref["detectors"][detector] = create_detector(detector)
+    return _ref["detectors"][detector]
+
+
+def worker_matcher(matcher):
+    if matcher not in _ref["matchers"]:
+        _ref["matchers"][matcher] = MATCHERS[matcher]()
+    return _ref["matchers"][matcher]
+
+
+def ref_features(scale, detector="sift"):
+    """(ref_pts, des_ref) at `scale`, as shipped by reference() → init_worker()."""
+    return _ref["refs"][(scale, detector)]
+
+
+def ref_gray():
+    """Full-res grayscale reference, read once per process (pyramid refinement)."""
+    if "gray" not in _ref:
+        _ref["gray"] = cv2.imread(_ref["ref_path"], cv2.IMREAD_GRAYSCALE)
+    return _ref["gray"]
+
+
+def estimate(pts_layer, des_layer, scale, log, backend=DEFAULT_BACKEND):
+    """Match layer features against the reference at `scale` → (full-res M,
+    stats) or (None, None).  The RANSAC inliers give the residual."""
+    detector, matcher = BACKENDS[backend]
+    ref_pts, des_ref = ref_features(scale, detector)
+    if des_ref is None or not len(des_ref):
+        log.append(f"  No reference features.")
+        return None, None
+    matches = worker_matcher(matcher).knnMatch(des_layer, des_ref, k=2)
+
     good_matches = []
     for m in matches:
         if len(m) == 2:
             m1, m2 = m
             if m1.distance < 0.75 * m2.distance:
                 good_matches.append(m1)
-                
-    print(f"  Good matches: {len(good_matches)}")
-    
-    if len(good_matches) > 10:
-        src_pts = np.float32([kp_layer[m.queryIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-        dst_pts = np.float32([kp_ref[m.trainIdx].pt for m in good_matches]).reshape(-1, 1, 2)
-        
-        M_small, inliers = cv2.estimateAffinePartial2D(src_pts, dst_pts, cv2.RANSAC)
-        
-        if M_small is not None:
-            # Reconstruct the scale correctly:
-            # In scaling by SCALE (e.g. 0.25):
-            # p_small = SCALE * p_full
-            # q_small = SCALE * q_full
-            # M_small maps p_small -> q_small
-            # q_small = A_small * p_small + t_small
-            # SCALE * q_full = A_small * (SCALE * p_full) + t_small
-            # q_full = A_small * p_full + t_small / SCALE
-            # So the rotation/scaling block A remains the SAME!
-            # Only translation t needs dividing by SCALE!
-            M = M_small.copy()
-            M[0, 2] = M[0, 2] / SCALE
-            M[1, 2] = M[1, 2] / SCALE
-            
-            print(f"  Transform matrix full scale:\n{M}")
-            
-            # Warp full image
-            aligned = cv2.warpAffine(layer_img, M, (w_full, h_full), borderMode=cv2.BORDER_CONSTANT, borderValue=(0,0,0,0))
-            
-            # Crop to bounding box
-            aligned_alpha = aligned[:, :, 3]
-            coords = cv2.findNonZero(aligned_alpha)
-            if coords is not None:
-                x, y, w_crop, h_crop = cv2.boundingRect(coords)
-                cropped = aligned[y:y+h_crop, x:x+w_crop]
-                
-                out_name = f"aligned_{i}.png"
-                out_path = os.path.join(out_dir, out_name)
-                
-                # Use PIL for saving
-                cropped_rgba = cv2.cvtColor(cropped, cv2.COLOR_BGRA2RGBA)
-                rgb_img = PILImage.fromarray(cropped_rgba)
-                rgb_img.save(out_path, optimize=True)
-                
-                report["layers"].append({
-                    "id": out_name,
-                    "x": int(x),
-                    "y": int(y),
-                    "width": int(w_crop),
-                    "height": int(h_crop),
-                    "source": layer_name
-                })
-                print(f"  ✅ Saved {out_name} (x:{x}, y:{y}, w:{w_crop}, h:{h_crop})")
-            else:
-                print(f"  Failed: Warped alpha channel is empty.")
-        else:
-            print(f"  Failed to find affine transform.")
-    else:
-        print(f"  Less than 10 good matches.")
 
-report_path = os.path.join(report_dir, "pic_aligned_report.json")
-with open(report_path, "w", encoding="utf-8") as f:
-    json.dump(report, f, indent=2, ensure_ascii=False)
+    log.append(f"  Good matches: {len(good_matches)}")
+
+    if len(good_matches) <= 10:
+        log.append(f"  Less than 10 good matches.")
+        return None, None
+
+    src_pts = pts_layer[[m.queryIdx for m in good_matches]].reshape(-1, 1, 2)
+    dst_pts = ref_pts[[m.trainIdx for m in good_matches]].reshape(-1, 1, 2)
+
+    M_small, inliers = cv2.estimateAffinePartial2D(src_pts, dst_pts, cv2.RANSAC)
+
+    if M_small is None:
+        log.append(f"  Failed to find affine transform.")
+        return None, None
+
+    # Reconstruct the scale correctly:
+    # In scaling by scale (e.g. 0.25):
+    # p_small = scale * p_full
+    # q_small = scale * q_full
+    # M_small maps p_small -> q_small
+    # q_small = A_small * p_small + t_small
+    # scale * q_full = A_small * (scale * p_full) + t_small
+    # q_full = A_small * p_full + t_small / scale
+    # So the rotation/scaling block A remains the SAME!
+    # Only translation t needs dividing by scale!
+    M = M_small.copy()
+    M[0, 2] = M[0, 2] / scale
+    M[1, 2] = M[1, 2] / scale
+
+    inl = inliers.ravel().astype(bool)
+    stats = {"scale": scale, "matches": len(good_matches), "inliers": int(inl.sum()),
+             "inlier_ratio": round(float(inl.mean()), 3),
+             "residual_px": round(rms_error(M, src_pts[inl] / scale, dst_pts[inl] / scale), 3)}
+    return M, stats
+
+
+def rms_error(M, src, dst):
+    """RMS distance between M·src and dst (full-res px)."""
+    src, dst = src.reshape(-1, 2), dst.reshape(-1, 2)
+    if not len(src):
+        return float("nan")
+    pred = src @ M[:, :2].T + M[:, 2]
+    return float(np.sqrt(np.mean(np.sum((pred - dst) ** 2, axis=1))))
+
+
+# ── Windowed warp ────────────────────────────────────────────────────────────
+def transform_box(M, box):
+    """Axis-aligned bounds (float x0, y0, x1, y1) of box's corners under M."""
+    x0, y0, x1, y1 = box
+    corners = np.float64([[x0, y0], [x1, y0], [x0, y1], [x1, y1]])
+    pts = corners @ M[:, :2].T + M[:, 2]
+    return (*pts.min(axis=0), *pts.max(axis=0))
+
+
+def dest_window(M, box, w_full, h_full):
+    """Integer reference window (x0, y0, x1, y1) that can receive any pixel of
+    the source box under M, clipped to the reference; None if off-canvas.
+
+    Pixel centres of box span [x0, x1 - 1]; bilinear sampling reaches one
+    more pixel on every side, so the box grows by 1 before it is mapped."""
+    x0, y0, x1, y1 = box
+    fx0, fy0, fx1, fy1 = transform_box(M, (x0 - 1, y0 - 1, x1, y1))
+    wx0, wy0 = max(0, int(np.floor(fx0))), max(0, int(np.floor(fy0)))
+    wx1, wy1 = min(w_full, int(np.ceil(fx1)) + 1), min(h_full, int(np.ceil(fy1)) + 1)
+    if wx1 <= wx0 or wy1 <= wy0:
+        return None
+    return wx0, wy0, wx1, wy1
+
+
+def warp_into(img, M, window, flags=cv2.INTER_LINEAR):
+    """cv2.warpAffine of img straight into the reference window (x0, y0, x1, y1):
+    same pixels as a full-canvas warp cropped to the window."""
+    x0, y0, x1, y1 = window
+    T = M.copy()
+    T[:, 2] -= (x0, y0)
+    return cv2.warpAffine(img, T, (x1 - x0, y1 - y0), flags=flags,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=(0, 0, 0, 0))
+
+
+# ── Pyramid refinement ───────────────────────────────────────────────────────
+def pick_windows(layer_img, n=REFINE_WINDOWS, size=REFINE_WINDOW):
+    """Top-left corners (layer px) of the n most textured size×size cells
+    that lie (mostly) inside the layer's alpha."""
+    f = COARSE_SCALE
+    small = cv2.resize(layer_img, (0, 0), fx=f, fy=f, interpolation=cv2.INTER_AREA)
+    gray = cv2.cvtColor(small[:, :, :3], cv2.COLOR_BGR2GRAY).astype(np.float32)
+    alpha = small[:, :, 3] > 10 if small.shape[2] == 4 else np.ones(gray.shape, bool)
+    grad = np.abs(cv2.Sobel(gray, cv2.CV_32F, 1, 0)) + np.abs(cv2.Sobel(gray, cv2.CV_32F, 0, 1))
+    c = max(1, round(size * f))
+    cells = []
+    for y in range(0, gray.shape[0] - c + 1, c):
+        for x in range(0, gray.shape[1] - c + 1, c):
+            cover = alpha[y:y + c, x:x + c].mean()
+            if cover >= 0.5:
+                cells.append((cover * grad[y:y + c, x:x + c].mean(), round(x / f), round(y / f)))
+    cells.sort(reverse=True)
+    return [(x, y) for _, x, y in cells[:n]]
+
+
+def ecc_window(layer_img, M0, x, y, size=REFINE_WINDOW, margin=REFINE_MARGIN):
+    """Refine one window with ECC (translation) against the full-res reference
+    → (layer point, reference point) correspondence, or None."""
+    ref = ref_gray()
+    px0, py0, px1, py1 = transform_box(M0, (x, y, x + size, y + size))
+    x0 = int(max(0, np.floor(px0) - margin))
+    y0 = int(max(0, np.floor(py0) - margin))
+    x1 = int(min(ref.shape[1], np.ceil(px1) + margin))
+    y1 = int(min(ref.shape[0], np.ceil(py1) + margin))
+    if x1 - x0 < size // 2 or y1 - y0 < size // 2:
+        return None
+    # warp the layer straight into the reference crop
+    warped = warp_into(layer_img, M0, (x0, y0, x1, y1))
+    mask = (warped[:, :, 3] > 10).astype(np.uint8) if warped.shape[2] == 4 else None
+    moving = cv2.cvtColor(warped[:, :, :3], cv2.COLOR_BGR2GRAY).astype(np.float32)
+    template = ref[y0:y1, x0:x1].astype(np.float32)
+    warp = np.eye(2, 3, dtype=np.float32)
+    try:
+        cc, warp = cv2.findTransformECC(template, moving, warp, cv2.MOTION_TRANSLATION,
+                                        ECC_CRITERIA, mask, 5)
+    except cv2.error:
+        return None
+    if cc < ECC_MIN_CC:
+        return None
+    # moving(p + t) ≈ template(p): the reference at crop centre c shows the
+    # layer pixel that M0 put at c + t
+    c = np.float64([(x1 - x0) / 2, (y1 - y0) / 2])
+    q = c + (x0, y0)
+    A = np.vstack([M0, [0, 0, 1]])
+    p = (np.linalg.inv(A) @ np.append(q + warp[:, 2], 1))[:2]
+    return p, q
+
+
+def refine(layer_img, M0, log):
+    """ECC in full-res windows → (refined M, stats); falls back to M0."""
+    pairs = [r for x, y in pick_windows(layer_img)
+             if (r := ecc_window(layer_img, M0, x, y)) is not None]
+    stats = {"windows": len(pairs)}
+    if not pairs:
+        log.append("  Refinement: no ECC window converged, keeping the coarse estimate.")
+        return M0, stats
+    P = np.float64([p for p, _ in pairs])
+    Q = np.float64([q for _, q in pairs])
+    M = None
+    if len(pairs) >= 3:
+        M, _ = cv2.estimateAffinePartial2D(P.reshape(-1, 1, 2), Q.reshape(-1, 1, 2),
+                                           cv2.RANSAC, ransacReprojThreshold=2.0)
+    if M is None:                       # too few windows: only correct the translation
+        M = M0.copy()
+        M[:, 2] += (Q - (P @ M0[:, :2].T + M0[:, 2])).mean(axis=0)
+    stats["refine_shift_px"] = round(float(np.linalg.norm(
+        Q - (P @ M0[:, :2].T + M0[:, 2]), axis=1).mean()), 3)
+    if len(pairs) >= 3:                 # fewer points fit exactly: keep the RANSAC residual
+        stats["residual_px"] = round(rms_error(M, P, Q), 3)
+    log.append(f"  Refinement: {len(pairs)} ECC window(s), coarse off by "
+               f"{stats['refine_shift_px']} px, residual {stats.get('residual_px', '-')} px")
+    return M, stats
+
+
+def locate(layer_path, layer_img, backend, log):
+    """Feature-based transform of one layer with one backend → (M or None,
+    stats incl. time_s).  Pyramid mode tries COARSE_SCALE first and the
+    regular scale only if that fails."""
+    t0 = time.perf_counter()
+    detector = BACKENDS[backend][0]
+    M = stats = None
+    for scale in mode_scales(_ref["mode"]):
+        pts_layer, des_layer = layer_features(layer_path, layer_img, scale, detector)
+        log.append(f"  Found {len(pts_layer)} keypoints (scale {scale}, {backend}).")
+        if des_layer is None or len(des_layer) < 10:
+            log.append(f"  Not enough features in {os.path.basename(layer_path)}")
+            continue
+        M, stats = estimate(pts_layer, des_layer, scale, log, backend)
+        if M is not None:
+            break
+    stats = {"backend": backend, "mode": _ref["mode"], "ok": M is not None,
+             "time_s": round(time.perf_counter() - t0, 3), **(stats or {})}
+    return M, stats
+
+
+def align_layer(i):
+    """Align layer i.png onto the reference → (report entry or None, log lines,
+    {backend: stats} of every backend tried on it)."""
+    log = []
+    layer_name = f"{i}.png"
+    layer_path = os.path.join(base_dir, layer_name)
+    log.append(f"\n[{layer_name}] Aligning...")
+    # Read with alpha
+    layer_img = cv2.imread(layer_path, cv2.IMREAD_UNCHANGED)
+    if layer_img is None:
+        log.append(f"  Cannot load {layer_path}")
+        return None, log, {}
+
+    backend, *others = _ref["backends"]
+    M, stats = locate(layer_path, layer_img, backend, log)
+    timings = {backend: stats}
+    for b in others:               # --compare: estimate only, logged separately
+        timings[b] = locate(layer_path, layer_img, b, [])[1]
+        log.append(f"  [{b}] " + ", ".join(f"{k}={v}" for k, v in timings[b].items()
+                                           if k in ("time_s", "inliers", "inlier_ratio", "residual_px")))
+    if M is None:
+        return None, log, timings
+    if _ref["mode"] == "pyramid":
+        M, refined = refine(layer_img, M, log)
+        stats = {**stats, **refined}
+
+    log.append(f"  Transform matrix full scale:\n{M}")
+
+    # Warp only into the window the layer's alpha bbox lands on
+    h_img, w_img = layer_img.shape[:2]
+    src_box = mask_bbox(layer_img[:, :, 3] > 0) if layer_img.shape[2] == 4 else (0, 0, w_img, h_img)
+    window = src_box and dest_window(M, src_box, _ref["w_full"], _ref["h_full"])
+    aligned = warp_into(layer_img, M, window) if window else None
+
+    # Trim to the exact bounding box (a layer-sized scan, not the canvas)
+    tight = aligned is not None and mask_bbox(aligned[:, :, 3] > 0)
+    if not tight:
+        log.append(f"  Failed: Warped alpha channel is empty.")
+        return None, log, timings
+
+    bx0, by0, bx1, by1 = tight
+    cropped = aligned[by0:by1, bx0:bx1]
+    x, y = window[0] + bx0, window[1] + by0
+    w_crop, h_crop = bx1 - bx0, by1 - by0
+
+    out_name = f"aligned_{i}.png"
+    out_path = os.path.join(out_dir, out_name)
+
+    # Use PIL for saving
+    cropped_rgba = cv2.cvtColor(cropped, cv2.COLOR_BGRA2RGBA)
+    rgb_img = PILImage.fromarray(cropped_rgba)
+    save_png(rgb_img, out_path, _ref["profile"])
+
+    log.append(f"  ✅ Saved {out_name} (x:{x}, y:{y}, w:{w_crop}, h:{h_crop})")
+    entry = {
+        "id": out_name,
+        "x": int(x),
+        "y": int(y),
+        "width": int(w_crop),
+        "height": int(h_crop),
+        "source": layer_name,
+        "align": stats,
+    }
+    return entry, log, timings
+
+
+def aligned_layers(ref, layer_ids, workers, mode="single", use_cache=True,
+                   backends=(DEFAULT_BACKEND,), profile=DEFAULT_PROFILE):
+    """Yield align_layer() results in layer order, in-process or from a pool."""
+    if workers == 1:
+        init_worker(*ref, mode, use_cache, None, backends, profile)
+        yield from map(align_layer, layer_ids)
+        return
+    # Each worker gets every reference descriptor set once, via the initializer
+    with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                             initargs=(*ref, mode, use_cache, 1, backends, profile)) as pool:
+        yield from pool.map(align_layer, layer_ids)
+
+
+def backend_summary(per_layer):
+    """{backend: {layer: stats}} → report "backends" block with totals."""
+    out = {}
+    for b, layers in per_layer.items():
+        ok = [st for st in layers.values() if st.get("ok")]
+        out[b] = {
+            "time_s": round(sum(st["time_s"] for st in layers.values()), 3),
+            "aligned": f"{len(ok)}/{len(layers)}",
+            "mean_inlier_ratio": round(float(np.mean([st["inlier_ratio"] for st in ok])), 3) if ok else None,
+            "max_residual_px": max((st["residual_px"] for st in ok), default=None),
+            "layers": layers,
+        }
+    return out
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                    help="processes aligning layers in parallel (1 = sequential); each holds a "
+                         "full-res layer + reference, so raise it only with memory to spare")
+    ap.add_argument("--no-cache", action="store_true",
+                    help="ignore and don't write the feature cache")
+    ap.add_argument("--mode", choices=MODES, default="single",
+                    help="single (default): features at SCALE only; pyramid (opt-in): 1/8 estimate "
+                         "+ full-res ECC refinement; places layers differently and is slower at 2K")
+    ap.add_argument("--backend", choices=AVAILABLE_BACKENDS, default=DEFAULT_BACKEND,
+                    help="feature detector + matcher used to place the layers")
+    ap.add_argument("--compare", action="store_true",
+                    help="also time every other backend on each layer (report \"backends\")")
+    ap.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                    help="PNG compression profile of the aligned layers (encode.py)")
+    args = ap.parse_args()
+    backends = [args.backend] + ([b for b in AVAILABLE_BACKENDS if b != args.backend]
+                                 if args.compare else [])
+
+    os.makedirs(out_dir, exist_ok=True)
+
+    # 1. Load reference image
+    ref_path = os.path.join(base_dir, "1.png")
+    print(f"Loading reference image + extracting {', '.join(backends)} features...")
+    ref = reference(ref_path, args.mode, not args.no_cache, backends)
+    if ref is None:
+        print(f"Cannot load {ref_path}")
+        return 1
+    w_full, h_full = ref[1:3]
+
+    layer_ids = [i for i in LAYER_IDS if os.path.exists(os.path.join(base_dir, f"{i}.png"))]
+    workers = max(1, min(args.workers, len(layer_ids)))
+
+    report = {
+        "original_size": {"width": w_full, "height": h_full},
+        "viewBox": f"0 0 {w_full} {h_full}",
+        "layers": []
+    }
+    per_backend = {b: {} for b in backends}
+    # map() yields in submission order → deterministic log + report order
+    for i, (entry, log, timings) in zip(layer_ids, aligned_layers(
+            ref, layer_ids, workers, args.mode, not args.no_cache, backends, args.profile)):
+        print("\n".join(log))
+        if entry is not None:
+            report["layers"].append(entry)
+        for b, st in timings.items():
+            per_backend[b][f"{i}.png"] = st
+    report["backends"] = backend_summary(per_backend)
+
+    print("\nBackend          time_s  aligned  inlier_ratio  max_residual_px")
+    for b, sm in report["backends"].items():
+        print(f"  {b:14s} {sm['time_s']:7.2f}  {sm['aligned']:>7s}  {sm['mean_inlier_ratio']!s:>12s}"
+              f"  {sm['max_residual_px']!s:>15s}")
+
+    report_path = os.path.join(report_dir, "pic_aligned_report.json")
+    with open(report_path, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print("\n🎉 Tất cả hoàn thành! Tọa độ ghép lưu tại:", report_path)
+    return 0
+
 
-print("\n🎉 Tất cả hoàn thành! Tọa độ ghép lưu tại:", report_path)
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+"""
+bbox.py
+Bounding boxes of non-transparent / non-zero pixels, shared by the scripts.
+
+alpha_bbox() only ever touches the alpha band of a PIL image and walks it in
+strips from each edge inwards, stopping at the first strip that contains a
+pixel:
+
+    top    — row bands downward        bottom — row bands upward
+    left   — column strips rightward   right  — column strips leftward
+                                          (both only within [top, bottom])
+
+so the work is proportional to the transparent margins, not the frame, and
+no RGBA array is ever materialised.  All boxes are PIL-style (x0, y0, x1, y1)
+with exclusive x1/y1, ready for Image.crop().
+"""
+import numpy as np
+
+DEFAULT_STRIP = 64
+
+
+def alpha_channel(img):
+    """Alpha band of a PIL image as an "L" image, or None if it is opaque."""
+    if "A" in img.getbands():
+        return img.getchannel("A")
+    if "transparency" in img.info:
+        return img.convert("RGBA").getchannel("A")
+    return None
+
+
+def _first_hit(alpha, boxes, axis, threshold):
+    """Scan `boxes` in order; return (box, index within it) of the first hit."""
+    for box in boxes:
+        hit = np.asarray(alpha.crop(box)).max(axis=axis) > threshold
+        if hit.any():
+            return box, hit
+    return None, None
+
+
+def alpha_bbox(img, threshold=0, strip=DEFAULT_STRIP):
+    """bbox of pixels with alpha > threshold, or None if there are none."""
+    W, H = img.size
+    alpha = alpha_channel(img)
+    if alpha is None:
+        return (0, 0, W, H)
+
+    down = [(0, y, W, min(H, y + strip)) for y in range(0, H, strip)]
+    box, hit = _first_hit(alpha, down, 1, threshold)
+    if box is None:
+        return None
+    y0 = box[1] + int(np.argmax(hit))
+
+    up = [(0, max(y0, y - strip), W, y) for y in range(H, y0, -strip)]
+    box, hit = _first_hit(alpha, up, 1, threshold)
+    y1 = box[1] + len(hit) - int(np.argmax(hit[::-1]))
+
+    right = [(x, y0, min(W, x + strip), y1) for x in range(0, W, strip)]
+    box, hit = _first_hit(alpha, right, 0, threshold)
+    x0 = box[0] + int(np.argmax(hit))
+
+    left = [(max(x0, x - strip), y0, x, y1) for x in range(W, x0, -strip)]
+    box, hit = _first_hit(alpha, left, 0, threshold)
+    x1 = box[0] + len(hit) - int(np.argmax(hit[::-1]))
+    return (x0, y0, x1, y1)
+
+
+def mask_bbox(mask):
+    """bbox of True pixels in a 2-D bool array, or None if it is empty."""
+    rows = mask.any(axis=1)
+    if not rows.any():
+        return None
+    y0 = int(np.argmax(rows))
+    y1 = len(rows) - int(np.argmax(rows[::-1]))
+    cols = mask[y0:y1].any(axis=0)
+    x0 = int(np.argmax(cols))
+    x1 = len(cols) - int(np.argmax(cols[::-1]))
+    return (x0, y0, x1, y1)
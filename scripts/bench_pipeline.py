@@ -0,0 +1,355 @@
+"""
+bench_pipeline.py
+Đo thời gian + bộ nhớ (peak RSS) của các bước xử lý ảnh trên ảnh cây tổng hợp,
+không cần ảnh thật trong D:\\CRM WEB\\...
+
+Chạy: python bench_pipeline.py [--sizes 2048 5120 10240] [--cases hsv mask ...]
+                               [--repeat 3] [--json out.json]
+                               [--baseline old.json] [--tolerance 0.2]
+  Mỗi (case, size) chạy trong một process riêng (spawn), nên peak RSS của case
+  này không lẫn với case khác:
+      peak   = RSS cao nhất (gồm cả ảnh đầu vào)
+      delta  = peak sau − peak trước khi chạy ≈ bộ nhớ làm việc của bước đó
+               (Linux reset peak sau setup; nơi khác delta = 0 khi bước đó
+               dùng ít hơn phần setup đã giải phóng)
+  --json ghi kết quả; --baseline so sánh với một lần chạy trước và trả mã 1
+  nếu có case chậm hơn quá --tolerance (mặc định 20%).
+  Case nào lỗi được ghi "failed" (kèm lỗi) trong bảng / JSON và các case sau
+  vẫn chạy tiếp; cuối cùng script trả mã 1.  Case align* cần ảnh rộng ít nhất
+  MIN_WIDTH (800 px: nhỏ hơn thì SIFT ở 1/4 không đủ 10 match) — width nhỏ
+  hơn được ghi "skipped".
+
+Các case:
+  hsv         rgba_to_hsv() cả ảnh                          (hsv_engine.py)
+  mask        nhãn "refined" theo dải + LayerStats          (layer_rules.py, segment.py)
+  keep_blobs  giữ 2 blob lớn nhất của mask canopy            (blobs.py)
+  morphology  close 50px + dilate 25px như split_layers.py   (morphology.py, exact;
+              morph_separable: octagon xấp xỉ, nhanh hơn nhưng lệch ở góc)
+  bbox        alpha_bbox() của một layer trong suốt quanh tán (bbox.py)
+  align       SIFT + FLANN + warp một layer bị dịch         (align_sift.py, single;
+              align_pyramid: ước lượng 1/8 + ECC full-res)
+  hitbox      mask_polygons() + polygons_path() của canopy   (hitbox.py, như refine_layers.py)
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import tempfile
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+from PIL import Image, ImageDraw
+
+Image.MAX_IMAGE_PIXELS = None
+
+ASPECT = 3365 / 5120          # viewBox của TreeCanvas
+DEFAULT_SIZES = (2048, 5120, 10240)
+LAYER_SHIFT = (37, 23)        # (dx, dy) của layer dùng cho case align
+MIN_WIDTH = {"align": 800, "align_pyramid": 800}   # 600 px: chỉ 5 good match
+
+
+# ── Synthetic input ──────────────────────────────────────────────────────────
+def make_tree(width, seed=0):
+    """RGBA tree-crm-like image: sky, clouds, canopy, trunk, roots, grass."""
+    W, H = width, round(width * ASPECT)
+    s = W / 1200                                 # drawn at 1200 px, scaled up
+    rng = np.random.default_rng(seed)
+    img = Image.new("RGBA", (W, H), (170, 210, 240, 255))
+    d = ImageDraw.Draw(img)
+
+    def ell(cx, cy, rx, ry, col):
+        d.ellipse([cx * s - rx * s, cy * s - ry * s, cx * s + rx * s, cy * s + ry * s], fill=col)
+
+    for y in range(0, H, max(1, H // 256)):    # sky gradient
+        t = y / H
+        d.line([(0, y), (W, y)], fill=(int(150 + 50 * t), int(200 + 25 * t), 240, 255),
+               width=max(1, H // 256))
+    ell(250, 120, 150, 70, (250, 250, 252, 255))              # left cloud
+    ell(900, 100, 170, 70, (140, 160, 190, 255))              # right (rain) cloud
+    ell(600, 250, 260, 200, (40, 140, 50, 255))               # canopy
+    d.rectangle([560 * s, 380 * s, 640 * s, 620 * s], fill=(90, 60, 30, 255))   # trunk
+    d.rectangle([0, 620 * s, W, H], fill=(30, 80, 25, 255))                     # grass
+    for k in range(8):                                                          # roots
+        d.line([(600 * s, 600 * s), ((300 + k * 80) * s, 780 * s)],
+               fill=(70, 45, 20, 255), width=max(1, int(9 * s)))
+    # leaves + bark marks: texture for SIFT, blobs for keep_blobs
+    for _ in range(int(1500 * s)):
+        a, r = rng.uniform(0, 2 * np.pi), np.sqrt(rng.uniform()) * 0.95
+        g = int(rng.integers(90, 190))
+        ell(600 + 260 * r * np.cos(a), 250 + 200 * r * np.sin(a),
+            rng.uniform(3, 12), rng.uniform(3, 12), (int(rng.integers(20, 70)), g, 40, 255))
+    for _ in range(int(300 * s)):
+        x, y = rng.uniform(565, 635), rng.uniform(385, 615)
+        ell(x, y, rng.uniform(1, 4), rng.uniform(3, 10), (60, 40, 20, 255))
+
+    # ±7 noise on the colour channels, band by band (no int64 frame copy)
+    arr = np.array(img)
+    for y0 in range(0, H, 512):
+        band = arr[y0:y0 + 512, :, :3]
+        band ^= rng.integers(0, 8, band.shape, dtype=np.uint8)
+    return Image.fromarray(arr)
+
+
+def make_inputs(width, tmp):
+    """Write the tree (1.png), a shifted canopy layer (2.png) and the tree's
+    canopy mask (canopy.npy) for one size, so the cases' setup stays light."""
+    d = os.path.join(tmp, str(width))
+    os.makedirs(os.path.join(d, "out"), exist_ok=True)
+    tree = make_tree(width)
+    tree.save(os.path.join(d, "1.png"), compress_level=1)
+
+    # pic-tree style layer: full frame, transparent outside the canopy, shifted
+    W, H = tree.size
+    s = W / 1200
+    alpha = Image.new("L", tree.size, 0)
+    ImageDraw.Draw(alpha).ellipse([340 * s, 50 * s, 860 * s, 450 * s], fill=255)
+    layer = Image.new("RGBA", tree.size, (0, 0, 0, 0))
+    dx, dy = (round(v * s) for v in LAYER_SHIFT)
+    layer.paste(tree, (dx, dy), alpha)
+    layer.save(os.path.join(d, "2.png"), compress_level=1)
+
+    from layer_rules import compile_rules
+    rules = compile_rules("refined")
+    label = rules.label_rgb(np.asarray(tree), 0, H, W)
+    np.save(os.path.join(d, "canopy.npy"), rules.mask(label, "canopy").astype(np.uint8) * 255)
+    return d
+
+
+# ── Memory ───────────────────────────────────────────────────────────────────
+def _proc_status_mb(key):
+    """VmHWM / VmRSS from /proc/self/status in MB (Linux), or None."""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(key + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb():
+    """Peak resident set size of this process in MB, or None if unavailable.
+
+    Linux uses VmHWM rather than ru_maxrss: ru_maxrss survives exec, so a
+    spawned child would report the (large) parent's peak.
+    """
+    peak = _proc_status_mb("VmHWM")
+    if peak is not None:
+        return peak
+    try:
+        import resource
+        kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return kb / 2**20 if sys.platform == "darwin" else kb / 1024
+    except ImportError:
+        pass
+    try:
+        import psutil           # Windows: peak working set
+        return psutil.Process().memory_info().peak_wset / 2**20
+    except (ImportError, AttributeError):
+        return None
+
+
+def reset_peak_rss():
+    """Drop the setup's high-water mark where the OS allows it (Linux ≥ 4.0)."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+# ── Cases ────────────────────────────────────────────────────────────────────
+# Each setup_* gets the input dir and returns the zero-arg callable to time.
+def _canopy(d):
+    """0/255 uint8 canopy mask of the tree."""
+    return np.load(os.path.join(d, "canopy.npy"))
+
+
+def setup_hsv(d):
+    from hsv_engine import rgba_to_hsv
+    arr = np.asarray(Image.open(os.path.join(d, "1.png")).convert("RGBA"))
+    return lambda: rgba_to_hsv(arr)
+
+
+def setup_mask(d):
+    from layer_rules import compile_rules
+    from segment import LayerStats, iter_bands
+    rules = compile_rules("refined")
+    img = Image.open(os.path.join(d, "1.png"))
+    img.load()
+    W, H = img.size
+
+    def run():
+        stats = {name: LayerStats(H, W) for name in rules.names}
+        for y0, band in iter_bands(img):
+            label = rules.label_rgb(band, y0, H, W)
+            for name in rules.names:
+                stats[name].update(y0, rules.mask(label, name))
+        return stats
+    return run
+
+
+def setup_keep_blobs(d):
+    from blobs import keep_blobs
+    mask = _canopy(d)
+    return lambda: keep_blobs(mask, n=2, min_area=20000)
+
+
+def setup_morphology(d, strategy="exact"):
+    from morphology import morph
+    mask = _canopy(d)
+    return lambda: morph(morph(mask, "close", 50, strategy), "dilate", 25, strategy)
+
+
+def setup_bbox(d):
+    from bbox import alpha_bbox
+    layer = Image.open(os.path.join(d, "2.png"))
+    layer.load()
+    return lambda: alpha_bbox(layer)
+
+
+def setup_align(d, mode="single"):
+    import align_sift
+    align_sift.base_dir = d
+    align_sift.out_dir = os.path.join(d, "out")
+
+    def run():
+        ref = align_sift.reference(os.path.join(d, "1.png"), mode, use_cache=False)
+        align_sift.init_worker(*ref, mode, use_cache=False)
+        entry, log, _ = align_sift.align_layer(2)
+        if entry is None:
+            raise RuntimeError("alignment failed:\n" + "\n".join(log))
+        return entry
+    return run
+
+
+def setup_hitbox(d):
+    from hitbox import mask_polygons, polygons_path
+    mask = _canopy(d)
+    sx = 900 / mask.shape[1]
+    return lambda: polygons_path(mask_polygons(mask, sx))
+
+
+CASES = {
+    "hsv": setup_hsv,
+    "mask": setup_mask,
+    "keep_blobs": setup_keep_blobs,
+    "morphology": setup_morphology,
+    "morph_separable": partial(setup_morphology, strategy="separable"),
+    "bbox": setup_bbox,
+    "align": setup_align,
+    "align_pyramid": partial(setup_align, mode="pyramid"),
+    "hitbox": setup_hitbox,
+}
+
+
+def run_case(case, width, d, repeat):
+    """Runs in a fresh process → timing + memory of one (case, size)."""
+    fn = CASES[case](d)
+    reset_peak_rss()
+    before = peak_rss_mb()
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    peak = peak_rss_mb()
+    return {
+        "case": case,
+        "width": width,
+        "best_s": round(min(times), 4),
+        "mean_s": round(sum(times) / len(times), 4),
+        "peak_rss_mb": None if peak is None else round(peak, 1),
+        "delta_mb": None if peak is None else round(peak - before, 1),
+    }
+
+
+# ── Report ───────────────────────────────────────────────────────────────────
+def fmt_mb(v):
+    return "     n/a" if v is None else f"{v:8.1f}"
+
+
+def compare(results, baseline, tolerance):
+    """Print best-time ratios vs a previous --json run → list of regressions."""
+    old = {(r["case"], r["width"]): r for r in baseline["results"]}
+    slow = []
+    print(f"\n{'case':15s} {'width':>6s} {'old s':>8s} {'new s':>8s} {'ratio':>6s}")
+    for r in results:
+        o = old.get((r["case"], r["width"]))
+        if o is None or not o.get("best_s") or not r.get("best_s"):
+            continue
+        ratio = r["best_s"] / o["best_s"]
+        flag = ""
+        if ratio > 1 + tolerance:
+            flag = "  ← chậm hơn"
+            slow.append(r)
+        print(f"{r['case']:15s} {r['width']:6d} {o['best_s']:8.3f} {r['best_s']:8.3f} {ratio:6.2f}{flag}")
+    return slow
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=list(DEFAULT_SIZES),
+                    help="image widths in px (height follows the 5120x3365 aspect)")
+    ap.add_argument("--cases", nargs="+", choices=list(CASES), default=list(CASES))
+    ap.add_argument("--repeat", type=int, default=3)
+    ap.add_argument("--json", help="write results to this file")
+    ap.add_argument("--baseline", help="compare against a previous --json file")
+    ap.add_argument("--tolerance", type=float, default=0.2,
+                    help="allowed slowdown vs --baseline before failing (0.2 = 20%%)")
+    args = ap.parse_args()
+
+    results = []
+    spawn = mp.get_context("spawn")
+    with tempfile.TemporaryDirectory(prefix="bench_pipeline_") as tmp:
+        print(f"{'case':15s} {'width':>6s} {'best s':>8s} {'mean s':>8s} {'peak MB':>8s} {'delta MB':>8s}")
+        for width in args.sizes:
+            d = make_inputs(width, tmp)
+            for case in args.cases:
+                if width < MIN_WIDTH.get(case, 0):
+                    r = {"case": case, "width": width, "status": "skipped",
+                         "error": f"needs width >= {MIN_WIDTH[case]}"}
+                    results.append(r)
+                    print(f"{case:15s} {width:6d}  skipped: {r['error']}")
+                    continue
+                # fresh process per case: clean ru_maxrss, no warm caches from other cases
+                try:
+                    with ProcessPoolExecutor(max_workers=1, mp_context=spawn) as pool:
+                        r = pool.submit(run_case, case, width, d, args.repeat).result()
+                except Exception as e:
+                    r = {"case": case, "width": width, "status": "failed",
+                         "error": f"{type(e).__name__}: {e}"}
+                    results.append(r)
+                    print(f"{case:15s} {width:6d}  failed: {r['error'].splitlines()[-1]}")
+                    continue
+                r["status"] = "ok"
+                results.append(r)
+                print(f"{case:15s} {width:6d} {r['best_s']:8.3f} {r['mean_s']:8.3f} "
+                      f"{fmt_mb(r['peak_rss_mb'])} {fmt_mb(r['delta_mb'])}")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"repeat": args.repeat, "results": results}, f, indent=2)
+        print(f"\n✅ Kết quả lưu tại: {args.json}")
+
+    rc = 0
+    failed = [r for r in results if r["status"] == "failed"]
+    if failed:
+        print(f"\n❌ {len(failed)} case lỗi: "
+              + ", ".join(f"{r['case']}@{r['width']}" for r in failed))
+        rc = 1
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            slow = compare(results, json.load(f), args.tolerance)
+        if slow:
+            print(f"\n❌ {len(slow)} case chậm hơn baseline quá {args.tolerance:.0%}")
+            rc = 1
+    return rc
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,87 @@
+"""
+blend.py
+uint8 overlay kernels for the layer previews (split_layers.py, layer_tuner.py).
+
+Blending a pixel toward a solid colour only depends on the pixel's own 8-bit
+value, so each (colour, alpha) becomes a 256-entry per-channel LUT computed
+in 8.8 fixed point:
+
+    out = (v * (256 - a) + c * a + 128) >> 8,   a = round(alpha * 256)
+
+(±1 LSB vs the old float `v * (1 - alpha) + c * alpha` + truncation).
+Applying it is cv2.LUT on the mask's bounding box, written back in place
+through the mask — no int64 / float64 gathers, no full-frame temporaries.
+
+Several layers blended one after another are a composition of their LUTs,
+so a stack of N masks becomes a label map (bit k = mask k, N ≤ 8) plus a
+palette of 2^N composed LUTs, applied to the image in one gather:
+
+    labels = mask_labels([m1, m2, m3])
+    apply_labels(bgr, labels, stack_luts([lut(c1, .5), lut(c2, .5), lut(c3, .5)]))
+
+apply_labels() takes any uint8 label map + (n, 256, 3) palette of LUTs
+(label 0 = identity), so exclusive label maps work the same way.
+"""
+import cv2
+import numpy as np
+
+IDENTITY = np.repeat(np.arange(256, dtype=np.uint8)[:, None], 3, axis=1)
+
+
+def lut(color, alpha):
+    """(256, 3) uint8 LUT blending every channel value toward `color` (BGR) by alpha."""
+    a = int(round(alpha * 256))
+    v = np.arange(256, dtype=np.int32)[:, None]
+    c = np.asarray(color, dtype=np.int32)[None, :]
+    return ((v * (256 - a) + c * a + 128) >> 8).astype(np.uint8)
+
+
+def apply_lut(img, table):
+    """img (H, W, 3 uint8) through a (256, 3) LUT."""
+    return cv2.LUT(img, table.reshape(256, 1, 3))
+
+
+def tint_into(img, mask, table):
+    """Blend img in place with `table` where mask > 0; only the mask's bbox is touched.
+    Returns the number of blended pixels."""
+    m = mask > 0
+    ys, xs = np.flatnonzero(m.any(axis=1)), np.flatnonzero(m.any(axis=0))
+    if not len(ys):
+        return 0
+    y0, y1, x0, x1 = ys[0], ys[-1] + 1, xs[0], xs[-1] + 1
+    roi, mr = img[y0:y1, x0:x1], m[y0:y1, x0:x1]
+    np.copyto(roi, apply_lut(roi, table), where=mr[:, :, None])
+    return int(np.count_nonzero(mr))
+
+
+def stack_luts(tables):
+    """(2^N, 256, 3) palette: entry k = the tables whose bit is set in k, applied
+    in list order (first table first)."""
+    n = len(tables)
+    out = np.empty((1 << n, 256, 3), dtype=np.uint8)
+    out[0] = IDENTITY
+    for k in range(1, 1 << n):
+        top = k.bit_length() - 1            # last table applied
+        prev = out[k & ~(1 << top)]
+        out[k] = np.take_along_axis(tables[top], prev.astype(np.intp), axis=0)
+    return out
+
+
+def mask_labels(masks):
+    """uint8 label map with bit k set where masks[k] > 0 (at most 8 masks)."""
+    if len(masks) > 8:
+        raise ValueError("mask_labels: at most 8 masks fit a uint8 label map")
+    labels = np.zeros(masks[0].shape[:2], dtype=np.uint8)
+    for k, m in enumerate(masks):
+        labels[m > 0] |= np.uint8(1 << k)
+    return labels
+
+
+def apply_labels(img, labels, luts):
+    """In place: img[y, x, c] = luts[labels[y, x], img[y, x, c], c], one gather per channel."""
+    flat = np.ascontiguousarray(luts.transpose(2, 0, 1)).reshape(3, -1)   # (3, n*256)
+    base = labels.astype(np.uint16) << 8
+    for c in range(3):
+        idx = base | img[:, :, c]
+        img[:, :, c] = flat[c].take(idx)
+    return img
@@ -1,14 +1,53 @@
+"""
+check_sizes.py
+Kích thước / bit depth / color type / alpha của các layer PIC-TREE, chỉ đọc
+header PNG (png_meta.py) nên không decode ảnh nào.
+
+Chạy: python check_sizes.py [thư mục] [--workers 8]
+  Mặc định quét mọi *.png trong D:\\CRM WEB\\PIC-TREE song song; layer nào
+  khác kích thước 1.png (ảnh nền) được đánh dấu ✗ và script trả về mã 1.
+"""
 import os
-from PIL import Image
-
-base_dir = r"D:\CRM WEB\PIC-TREE"
-bg_path = os.path.join(base_dir, "1.png")
-bg_img = Image.open(bg_path)
-print(f"1.png size: {bg_img.size}")
-
-for num in range(2, 16):
-    layer_name = f"{num}.png"
-    layer_path = os.path.join(base_dir, layer_name)
-    if os.path.exists(layer_path):
-        img = Image.open(layer_path)
-        print(f"{layer_name} size: {img.size}")
+import sys
+import argparse
+
+from paths import path
+from png_meta import scan_dir, size_mismatches
+
+base_dir = path("pic_tree", r"D:\CRM WEB\PIC-TREE")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("directory", nargs="?", default=base_dir)
+    ap.add_argument("--workers", type=int, default=8, help="threads for the header reads")
+    args = ap.parse_args()
+
+    infos = scan_dir(args.directory, args.workers)
+    bg = next((i for i in infos if os.path.basename(i["path"]) == "1.png" and "error" not in i), None)
+    if bg is None:
+        print(f"Không tìm thấy 1.png hợp lệ trong {args.directory}")
+        return 1
+    bad = {i["path"] for i in size_mismatches(infos, bg)}
+
+    print(f"1.png size: ({bg['width']}, {bg['height']})\n")
+    for i in infos:
+        name = os.path.basename(i["path"])
+        if "error" in i:
+            print(f"  ✗ {name:10s} lỗi: {i['error']}")
+            continue
+        mark = "✗" if i["path"] in bad else "✓"
+        print(f"  {mark} {name:10s} {i['width']:5d}x{i['height']:<5d} "
+              f"{i['bit_depth']:2d}-bit {i['color_type']:10s} "
+              f"{'alpha' if i['alpha'] else 'no alpha'}")
+
+    errors = sum("error" in i for i in infos)
+    if bad or errors:
+        print(f"\n⚠ {len(bad)} layer khác kích thước 1.png, {errors} file lỗi")
+        return 1
+    print(f"\n✅ {len(infos)} file cùng kích thước {bg['width']}x{bg['height']}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
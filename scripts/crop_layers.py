@@ -1,67 +1,71 @@
+"""
+crop_layers.py
+Cắt 2.png..15.png theo bounding box alpha → public/pic_layers/layer_N.png
+và ghi tọa độ vào scripts/pic_layers_report.json.
+
+Chạy: python crop_layers.py [--incremental] [--no-pyramid] [--profile fast|release|palette]
+  Mỗi layer còn có pyramid: 1x là chính layer_N.png (lossless), 1/2, 1/4, 1/8
+  (AVIF nếu Pillow hỗ trợ, không thì WebP) trong public/pic_layers/pyramid/,
+  ghi vào entry "pyramid" của report để TreeCanvas chọn level nhỏ nhất vẫn đủ
+  nét.
+  --incremental: dựa vào scripts/pic_layers_manifest.json (hash nguồn, bbox,
+  hash output) để bỏ qua layer không đổi, xóa output của layer đã mất, và
+  chỉ vá các entry liên quan trong report (giữ nguyên x/y, zIndex, rotation...
+  đã chỉnh tay — x/y chỉ dịch theo độ lệch bbox mới).
+  --profile: cách nén PNG (encode.py), mặc định release; fast khi đang tinh
+  chỉnh.  PNG và pyramid được encode song song trên thread pool trong lúc
+  layer tiếp theo được crop.
+"""
 import os
+import sys
 import json
-import numpy as np
+import argparse
 from PIL import Image
 
+from bbox import alpha_bbox
+from encode import DEFAULT_PROFILE, PROFILES, Encoder
+from manifest import Manifest, file_hash
+from paths import path
+from png_meta import png_size
+from pyramid import build_pyramid, remove_pyramid, pyramid_intact
+
 # Tăng giới hạn kích thước ảnh cho hình ảnh cực lớn
 Image.MAX_IMAGE_PIXELS = None
 
-SRC_DIR = r"D:\CRM WEB\PIC-TREE"
-OUT_DIR = r"d:\CRM WEB\team-progress-tracker\public\pic_layers"
-REPORT_DIR = r"d:\CRM WEB\team-progress-tracker\scripts"
-
-os.makedirs(OUT_DIR, exist_ok=True)
-os.makedirs(REPORT_DIR, exist_ok=True)
-
-# 1.png là ảnh nền
-bg_path = os.path.join(SRC_DIR, "1.png")
-if not os.path.exists(bg_path):
-    print("Không tìm thấy 1.png")
-    exit(1)
+SRC_DIR = path("pic_tree", r"D:\CRM WEB\PIC-TREE")
+OUT_DIR = path("pic_layers", r"d:\CRM WEB\team-progress-tracker\public\pic_layers")
+REPORT_DIR = path("report_dir", r"d:\CRM WEB\team-progress-tracker\scripts")
 
-bg_img = Image.open(bg_path)
-W, H = bg_img.size
-print(f"Kích thước gốc: {W}x{H}\n")
+LAYER_IDS = range(2, 16)
+REPORT_PATH = os.path.join(REPORT_DIR, "pic_layers_report.json")
+MANIFEST_PATH = os.path.join(REPORT_DIR, "pic_layers_manifest.json")
 
-report = {
-    "original_size": {"width": W, "height": H},
-    "viewBox": f"0 0 {W} {H}",
-    "layers": []
-}
 
-for i in range(2, 16):
+def crop_layer(i, encoder, pyramid=True):
+    """Crop i.png to its non-transparent bbox and queue it (+ pyramid) on the
+    encoder → layer_info, or None."""
     layer_name = f"{i}.png"
-    layer_path = os.path.join(SRC_DIR, layer_name)
-    if not os.path.exists(layer_path):
-        continue
-        
-    img = Image.open(layer_path).convert("RGBA")
-    arr = np.array(img)
-    alpha = arr[:, :, 3]
-    
-    # Tìm bounding box của các pixel không trong suốt
-    rows = np.any(alpha > 0, axis=1)
-    cols = np.any(alpha > 0, axis=0)
-    
-    if not rows.any() or not cols.any():
+    img = Image.open(os.path.join(SRC_DIR, layer_name))
+
+    # Tìm bounding box của các pixel không trong suốt (chỉ đọc kênh alpha)
+    box = alpha_bbox(img)
+    if box is None:
         print(f"[{layer_name}] hoàn toàn trong suốt, bỏ qua.")
-        continue
-        
-    ymin, ymax = np.where(rows)[0][[0, -1]]
-    xmin, xmax = np.where(cols)[0][[0, -1]]
-    
+        return None
+    xmin, ymin, x_end, y_end = box
+
     # Crop
-    cropped = img.crop((xmin, ymin, xmax + 1, ymax + 1))
-    
+    cropped = img.crop(box).convert("RGBA")
+
     # Lưu
     out_name = f"layer_{i}.png"
     out_path = os.path.join(OUT_DIR, out_name)
-    cropped.save(out_path, optimize=True)
-    
-    w_crop = xmax - xmin + 1
-    h_crop = ymax - ymin + 1
-    
-    layer_info = {
+    encoder.save(cropped, out_path)
+
+    w_crop = x_end - xmin
+    h_crop = y_end - ymin
+    print(f"[{layer_name}] -> {out_name} | x:{xmin} y:{ymin} w:{w_crop} h:{h_crop}")
+    info = {
         "id": out_name,
         "x": int(xmin),
         "y": int(ymin),
@@ -69,12 +73,146 @@ for i in range(2, 16):
         "height": int(h_crop),
         "source": layer_name
     }
-    report["layers"].append(layer_info)
-    print(f"[{layer_name}] -> {out_name} | x:{xmin} y:{ymin} w:{w_crop} h:{h_crop}")
+    if pyramid:
+        info["pyramid"] = build_pyramid(cropped, OUT_DIR, f"layer_{i}", out_name, save=encoder.save)
+    return info
+
+
+def patch_report(layers, info, old):
+    """Apply a rebuilt crop to every report entry of its source.
+
+    Hand-tuned placement is kept: x/y only move by how much the crop origin
+    moved since the manifest's bbox, and width/height (origH of a slice) are
+    scaled by new/old crop size, so a hand-set stretch survives and an
+    unchanged crop size leaves them untouched.  Without a manifest entry the
+    old crop is unknown and the sizes stay as they are.
+    """
+    entries = [l for l in layers if l.get("source") == info["source"]]
+    if not entries:
+        layers.append(info)
+        return
+    dx = info["x"] - old["bbox"][0] if old else 0
+    dy = info["y"] - old["bbox"][1] if old else 0
+    sx = info["width"] / old["bbox"][2] if old and old["bbox"][2] else 1.0
+    sy = info["height"] / old["bbox"][3] if old and old["bbox"][3] else 1.0
+    for l in entries:
+        l["x"] += dx
+        l["y"] += dy
+        l.pop("atlas", None)            # stale until pack_atlas.py runs again
+        if "pyramid" in info:
+            l["pyramid"] = info["pyramid"]
+        else:
+            l.pop("pyramid", None)
+        if l.get("isSliced"):
+            if "origH" in l:
+                l["origH"] = round(l["origH"] * sy)
+            if "origY" in l:
+                l["origY"] += dy
+        else:
+            l["width"], l["height"] = round(l["width"] * sx), round(l["height"] * sy)
+
+
+def remove_layer(report, manifest, layer_name):
+    """Drop a vanished/empty source: its output file, report entries and manifest entry."""
+    old = manifest.drop(layer_name)
+    if old is None:
+        return
+    out_path = os.path.join(OUT_DIR, old["output"])
+    if os.path.exists(out_path):
+        os.remove(out_path)
+    remove_pyramid(OUT_DIR, old.get("pyramid"))
+    report["layers"] = [l for l in report["layers"] if l.get("source") != layer_name]
+    report.pop("hit_index", None)
+    print(f"[{layer_name}] không còn → đã xóa {old['output']}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--incremental", action="store_true",
+                    help="skip unchanged layers and patch the existing report")
+    ap.add_argument("--no-pyramid", action="store_true",
+                    help="only write layer_N.png, no downscaled WebP/AVIF levels")
+    ap.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                    help="PNG compression profile (encode.py)")
+    args = ap.parse_args()
+
+    os.makedirs(OUT_DIR, exist_ok=True)
+    os.makedirs(REPORT_DIR, exist_ok=True)
+
+    # 1.png là ảnh nền
+    bg_path = os.path.join(SRC_DIR, "1.png")
+    if not os.path.exists(bg_path):
+        print("Không tìm thấy 1.png")
+        return 1
+
+    W, H = png_size(bg_path)          # IHDR only, no decode
+    print(f"Kích thước gốc: {W}x{H}\n")
+
+    manifest = Manifest(MANIFEST_PATH)
+    report = {
+        "original_size": {"width": W, "height": H},
+        "viewBox": f"0 0 {W} {H}",
+        "layers": []
+    }
+    if args.incremental and os.path.exists(REPORT_PATH):
+        with open(REPORT_PATH, encoding="utf-8") as f:
+            report.update({k: v for k, v in json.load(f).items()
+                           if k not in ("original_size", "viewBox")})
+
+    seen = set()
+    built = []     # (layer_name, src_hash, info): manifest entries once the files are written
+    encoder = Encoder(args.profile)
+    for i in LAYER_IDS:
+        layer_name = f"{i}.png"
+        layer_path = os.path.join(SRC_DIR, layer_name)
+        if not os.path.exists(layer_path):
+            continue
+        seen.add(layer_name)
+
+        src_hash = file_hash(layer_path)
+        out_name = f"layer_{i}.png"
+        out_path = os.path.join(OUT_DIR, out_name)
+        if (args.incremental and manifest.up_to_date(layer_name, src_hash, out_path)
+                and (args.no_pyramid
+                     or pyramid_intact(OUT_DIR, manifest.get(layer_name).get("pyramid"), out_name))):
+            print(f"[{layer_name}] không đổi, bỏ qua.")
+            continue
+
+        old = manifest.get(layer_name)
+        info = crop_layer(i, encoder, pyramid=not args.no_pyramid)
+        if info is None:
+            if args.incremental:
+                remove_layer(report, manifest, layer_name)
+            continue
+
+        if old and "pyramid" not in info:
+            remove_pyramid(OUT_DIR, old.get("pyramid"))
+        built.append((layer_name, src_hash, info))
+        if args.incremental:
+            patch_report(report["layers"], info, old)
+            report.pop("hit_index", None)   # stale until hit_index.py runs again
+        else:
+            report["layers"].append(info)
+
+    encoder.close()
+    for layer_name, src_hash, info in built:
+        manifest.put(layer_name, source_hash=src_hash,
+                     bbox=[info["x"], info["y"], info["width"], info["height"]],
+                     output=info["id"], output_hash=file_hash(os.path.join(OUT_DIR, info["id"])),
+                     pyramid=info.get("pyramid"))
+
+    if args.incremental:
+        for layer_name in sorted(set(manifest.entries) - seen):
+            remove_layer(report, manifest, layer_name)
+
+    manifest.save()
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n✅ Hoàn thành! Đã lưu ảnh con tại: {OUT_DIR}")
+    print(f"✅ Báo cáo tọa độ lưu tại: {REPORT_PATH}")
+    return 0
 
-report_path = os.path.join(REPORT_DIR, "pic_layers_report.json")
-with open(report_path, "w", encoding="utf-8") as f:
-    json.dump(report, f, indent=2, ensure_ascii=False)
 
-print(f"\n✅ Hoàn thành! Đã lưu ảnh con tại: {OUT_DIR}")
-print(f"✅ Báo cáo tọa độ lưu tại: {report_path}")
+if __name__ == "__main__":
+    sys.exit(main())
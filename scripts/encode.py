@@ -0,0 +1,191 @@
+"""
+encode.py
+PNG encoding profiles + a thread-pool encoder (crop_layers.py, align_sift.py,
+pack_atlas.py).
+
+    fast     zlib level 1, no filter search — for tuning runs
+    release  optimize=True (zlib 9 + filter search) — what we ship, as before
+    palette  release, but layers with ≤ 256 distinct RGBA colours (flat art)
+             are written as an exact palette PNG (tRNS alpha); others as release
+
+The files keep their .png names either way, so the report ids, manifest
+and frontend paths don't depend on the profile.
+
+Encoder runs saves on a thread pool: Pillow drops the GIL inside zlib / the
+AVIF and WebP encoders, so encoding overlaps with the next crop or with the
+other saves.  At most `max_pending` images wait in memory; submit() blocks
+beyond that.
+
+    with Encoder("fast") as enc:
+        enc.save(img, "layer_2.png")                    # profile
+        enc.save(img, "layer_2@2.webp", quality=80)     # explicit save params
+    # leaving the block waits for every file and re-raises encode errors
+
+PngStream writes an 8-bit PNG one row band at a time (analyze_tree.py,
+refine_layers.py): rows are filtered and deflated as they arrive, so only
+the current band of the image is ever held in memory.
+
+    with PngStream("sky.png", W, H, "RGBA") as png:
+        for y0, band in bands:
+            png.write(band)                             # (rows, W, 4) uint8
+"""
+import os
+import zlib
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from PIL import Image
+
+PROFILES = {
+    "fast":    {"compress_level": 1},
+    "release": {"optimize": True},
+    "palette": {"optimize": True},
+}
+DEFAULT_PROFILE = "release"
+
+
+def to_palette(img):
+    """Exact "P" image + per-index alpha of an RGBA image with ≤ 256 colours,
+    or None when it has more."""
+    if img.getcolors(256) is None:
+        return None
+    px = np.asarray(img.convert("RGBA"))
+    key = px.view(np.uint32).reshape(px.shape[:2])
+    colors, idx = np.unique(key, return_inverse=True)
+    rgba = colors.view(np.uint8).reshape(-1, 4)
+    pal = Image.fromarray(idx.reshape(key.shape).astype(np.uint8), "P")
+    pal.putpalette(rgba[:, :3].tobytes())
+    return pal, bytes(rgba[:, 3])
+
+
+def save_png(img, path, profile=DEFAULT_PROFILE):
+    """Write img to path with a named profile."""
+    if profile == "palette":
+        res = to_palette(img)
+        if res is not None:
+            pal, alpha = res
+            pal.save(path, transparency=alpha, **PROFILES[profile])
+            return path
+    img.save(path, **PROFILES[profile])
+    return path
+
+
+class Encoder:
+    def __init__(self, profile=DEFAULT_PROFILE, workers=None, max_pending=None):
+        self.profile = profile
+        workers = workers or min(8, os.cpu_count() or 1)
+        self._pool = ThreadPoolExecutor(max_workers=workers)
+        self._slots = threading.BoundedSemaphore(max_pending or 2 * workers)
+        self._futures = []
+
+    def save(self, img, path, **params):
+        """Queue img → path: explicit Image.save params, or the PNG profile."""
+        self._slots.acquire()
+        job = (lambda: img.save(path, **params)) if params else (lambda: save_png(img, path, self.profile))
+        fut = self._pool.submit(job)
+        fut.add_done_callback(lambda _: self._slots.release())
+        self._futures.append(fut)
+        return fut
+
+    def wait(self):
+        """Block until everything queued so far is written; raise the first error."""
+        futures, self._futures = self._futures, []
+        for fut in futures:
+            fut.result()
+
+    def close(self):
+        try:
+            self.wait()
+        finally:
+            self._pool.shutdown()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+# ── Streaming PNG writer ─────────────────────────────────────────────────────
+PNG_SIG = b"\x89PNG\r\n\x1a\n"
+STREAM_MODES = {"L": (0, 1), "LA": (4, 2), "RGB": (2, 3), "RGBA": (6, 4)}   # colour type, bytes/px
+STREAM_LEVELS = {"fast": 1, "release": 9, "palette": 9}   # palette needs every colour up front
+FILTER_ROWS = 16        # rows per filter search; its int16 temporaries are ~30 B/px
+
+
+def _paeth(a, b, c):
+    p = a + b - c
+    pa, pb, pc = np.abs(p - a), np.abs(p - b), np.abs(p - c)
+    return np.where((pa <= pb) & (pa <= pc), a, np.where(pb <= pc, b, c))
+
+
+class PngStream:
+    """PNG written band by band.  Each row gets the filter (none, sub, up,
+    average, paeth) with the smallest sum of |signed bytes|, like libpng's
+    adaptive heuristic; "fast" skips the search and stores rows unfiltered."""
+
+    def __init__(self, path, width, height, mode="RGBA", profile=None, level=6):
+        ctype, self.bpp = STREAM_MODES[mode]
+        self.width, self.rows_left = width, height
+        self.adaptive = profile != "fast"
+        self._z = zlib.compressobj(STREAM_LEVELS[profile] if profile else level)
+        self._prev = np.zeros(width * self.bpp, dtype=np.int16)
+        self._f = open(path, "wb")
+        self._f.write(PNG_SIG)
+        self._chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, ctype, 0, 0, 0))
+
+    def _chunk(self, kind, data):
+        self._f.write(struct.pack(">I", len(data)) + kind + data)
+        self._f.write(struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF))
+
+    def _filter(self, raw):
+        n, L = raw.shape
+        out = np.empty((n, L + 1), dtype=np.uint8)
+        if not self.adaptive:
+            out[:, 0] = 0
+            out[:, 1:] = raw
+            return out
+        x = raw.astype(np.int16)
+        up = np.vstack([self._prev[None], x[:-1]])
+        left = np.zeros_like(x)
+        left[:, self.bpp:] = x[:, :-self.bpp]
+        upleft = np.zeros_like(x)
+        upleft[:, self.bpp:] = up[:, :-self.bpp]
+        cand = np.stack([x, x - left, x - up, x - ((left + up) >> 1),
+                         x - _paeth(left, up, upleft)]).astype(np.uint8)
+        score = np.minimum(cand, 256 - cand.astype(np.int16)).sum(axis=2, dtype=np.int64)
+        best = score.argmin(axis=0)
+        out[:, 0] = best
+        out[:, 1:] = cand[best, np.arange(n)]
+        self._prev = x[-1]
+        return out
+
+    def write(self, rows):
+        """Append (rows, width[, channels]) uint8 pixels below what's written."""
+        raw = np.ascontiguousarray(rows, dtype=np.uint8).reshape(len(rows), -1)
+        if raw.shape[1] != self.width * self.bpp or len(raw) > self.rows_left:
+            raise ValueError(f"band {rows.shape} doesn't fit a {self.width}-px row "
+                             f"with {self.rows_left} rows left")
+        self.rows_left -= len(raw)
+        for y in range(0, len(raw), FILTER_ROWS):
+            data = self._z.compress(self._filter(raw[y:y + FILTER_ROWS]).tobytes())
+            if data:
+                self._chunk(b"IDAT", data)
+
+    def close(self):
+        if self._f.closed:
+            return
+        try:
+            if self.rows_left:
+                raise ValueError(f"PNG closed with {self.rows_left} rows missing")
+            self._chunk(b"IDAT", self._z.flush())
+            self._chunk(b"IEND", b"")
+        finally:
+            self._f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
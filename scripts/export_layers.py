@@ -2,12 +2,19 @@
 Export 6 layer regions from tree-crm.png as individual PNG files.
 SVG viewBox 0 0 900 530  →  image 2150x1266 px
 Scale: sx = 2150/900 = 2.3889,  sy = 1266/530 = 2.3887
+
+Ảnh nguồn chỉ decode một lần.  Các hàm draw_* vẽ vào Shapes (ghi lại lệnh
+vẽ + bbox của từng hình); overlay chỉ được cấp phát bằng bbox đó và
+alpha_composite chỉ chạy trên cửa sổ ấy của bản sao ảnh gốc, nên chi phí
+tỉ lệ với diện tích vùng, không phải 7 lần cả khung.
 """
 from PIL import Image, ImageDraw
 import os, math
 
-SRC = r"D:\CRM WEB\team-progress-tracker\tree-crm.png"
-OUT = r"D:\CRM WEB\team-progress-tracker\scripts\layers_out"
+from paths import path
+
+SRC = path("export_src", r"D:\CRM WEB\team-progress-tracker\tree-crm.png")
+OUT = path("export_out", r"D:\CRM WEB\team-progress-tracker\scripts\layers_export")
 os.makedirs(OUT, exist_ok=True)
 
 img = Image.open(SRC).convert("RGBA")
@@ -26,18 +33,71 @@ def sr(x, y, w, h):      # SVG rect → pixel rect (x0,y0,x1,y1)
 # ── draw helper ───────────────────────────────────────────────────────────────
 ALPHA = 160   # overlay opacity
 
+class Shapes:
+    """Stand-in for ImageDraw.Draw: records the shapes and their dirty bbox,
+    then replays them into an overlay that only covers that bbox."""
+
+    def __init__(self):
+        self.ops = []
+        self.box = None
+
+    def _add(self, op, xy, box, kw):
+        self.ops.append((op, xy, kw))
+        b = self.box
+        self.box = box if b is None else (min(b[0], box[0]), min(b[1], box[1]),
+                                          max(b[2], box[2]), max(b[3], box[3]))
+
+    # box shapes: [x0, y0, x1, y1] with inclusive x1/y1, like ImageDraw
+    def ellipse(self, xy, **kw):
+        self._add("ellipse", tuple(xy), (xy[0], xy[1], xy[2] + 1, xy[3] + 1), kw)
+
+    def rectangle(self, xy, **kw):
+        self._add("rectangle", tuple(xy), (xy[0], xy[1], xy[2] + 1, xy[3] + 1), kw)
+
+    def rounded_rectangle(self, xy, **kw):
+        self._add("rounded_rectangle", tuple(xy), (xy[0], xy[1], xy[2] + 1, xy[3] + 1), kw)
+
+    def polygon(self, xy, **kw):
+        xs, ys = [p[0] for p in xy], [p[1] for p in xy]
+        self._add("polygon", list(xy), (min(xs), min(ys), max(xs) + 1, max(ys) + 1), kw)
+
+    def render(self, W, H):
+        """(overlay, (x0, y0)) covering the dirty bbox clipped to W×H, or None."""
+        if self.box is None:
+            return None
+        x0, y0 = max(0, self.box[0]), max(0, self.box[1])
+        x1, y1 = min(W, self.box[2]), min(H, self.box[3])
+        if x1 <= x0 or y1 <= y0:
+            return None
+        overlay = Image.new("RGBA", (x1 - x0, y1 - y0), (0, 0, 0, 0))
+        d = ImageDraw.Draw(overlay)
+        for op, xy, kw in self.ops:
+            if op == "polygon":
+                xy = [(x - x0, y - y0) for x, y in xy]
+            else:
+                xy = (xy[0] - x0, xy[1] - y0, xy[2] - x0, xy[3] - y0)
+            getattr(d, op)(xy, **kw)
+        return overlay, (x0, y0)
+
+
+def composite(shapes):
+    """Copy of the source with the shapes' overlay composited on their window only."""
+    out = img.copy()
+    win = shapes.render(W, H)
+    if win is not None:
+        overlay, dest = win
+        out.alpha_composite(overlay, dest)
+    return out
+
+
 def make_layer(name, color_rgb, draw_fn):
     """
     Create output image: original + semi-transparent colored overlay on region.
-    Also saves a cropped tight version.
     """
-    base = img.copy()
-    overlay = Image.new("RGBA", (W, H), (0, 0, 0, 0))
-    d = ImageDraw.Draw(overlay)
-    draw_fn(d, color_rgb)
-    combined = Image.alpha_composite(base, overlay)
+    shapes = Shapes()
+    draw_fn(shapes, color_rgb)
     path = os.path.join(OUT, f"{name}.png")
-    combined.save(path)
+    composite(shapes).save(path)
     print(f"  ✓  {name}.png  →  {path}")
 
 # ── 1. Mây (clouds merged — 2 cloud blobs) ───────────────────────────────────
@@ -102,17 +162,15 @@ def draw_grass(d, c):
 make_layer("6_co_grass", (52, 211, 153), draw_grass)
 
 # ── Combined overview ─────────────────────────────────────────────────────────
-base = img.copy()
-overlay = Image.new("RGBA", (W, H), (0, 0, 0, 0))
-d = ImageDraw.Draw(overlay)
+# one overlay for all shapes (later shapes overwrite earlier ones, as before)
+d = Shapes()
 draw_clouds(d, (34, 211, 238))
 draw_wind(d, (6, 182, 212))
 draw_rain(d, (96, 165, 250))
 draw_trunk(d, (167, 139, 250))
 draw_roots(d, (251, 146, 60))
 draw_grass(d, (52, 211, 153))
-combined = Image.alpha_composite(base, overlay)
-combined.save(os.path.join(OUT, "0_ALL_LAYERS.png"))
+composite(d).save(os.path.join(OUT, "0_ALL_LAYERS.png"))
 print("  ✓  0_ALL_LAYERS.png (tổng hợp)")
 
 print("\nDone! Files saved to:", OUT)
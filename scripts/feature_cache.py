@@ -0,0 +1,89 @@
+"""
+feature_cache.py
+On-disk cache of keypoints + descriptors for align_sift.py.
+
+Entries are .npz files named <path key>_<content hash>_<params key>.npz:
+the path key is a hash of the image's absolute path (same-named files in
+different directories don't collide), the content hash changes when the file
+does, and the params key covers everything that changes the features
+(extraction params, OpenCV version), so an unchanged layer never goes
+through detectAndCompute twice.  Saving a new version of a file removes the
+entries of its older versions, matched on the exact path key:
+
+    cache = FeatureCache(CACHE_DIR, {"scale": SCALE, "sift": SIFT_PARAMS})
+    hit = cache.load(path)          # None, or dict(pts=..., des=..., shape=...)
+    cache.save(path, pts=pts, des=des, shape=np.array(img.shape))
+"""
+import os
+import glob
+import json
+import hashlib
+import tempfile
+import cv2
+import numpy as np
+
+from manifest import file_hash
+
+KEY_LEN = 16            # hex digits of the path key and of the content hash
+HEX = "[0-9a-f]" * KEY_LEN
+
+
+class FeatureCache:
+    def __init__(self, cache_dir, params):
+        self.cache_dir = cache_dir
+        blob = json.dumps({"params": params, "opencv": cv2.__version__}, sort_keys=True)
+        self.params_key = hashlib.sha1(blob.encode()).hexdigest()[:12]
+        self._hashes = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _hash(self, path):
+        st = os.stat(path)
+        k = (path, st.st_size, st.st_mtime_ns)
+        if k not in self._hashes:
+            self._hashes[k] = file_hash(path)[:KEY_LEN]
+        return self._hashes[k]
+
+    @staticmethod
+    def _path_key(path):
+        full = os.path.normcase(os.path.abspath(path))
+        return hashlib.sha1(full.encode("utf-8")).hexdigest()[:KEY_LEN]
+
+    def _entry(self, path):
+        return os.path.join(self.cache_dir,
+                            f"{self._path_key(path)}_{self._hash(path)}_{self.params_key}.npz")
+
+    def load(self, path):
+        """Cached arrays for `path`, or None when the file/params changed."""
+        entry = self._entry(path)
+        if not os.path.exists(entry):
+            return None
+        with np.load(entry) as z:
+            return {k: z[k] for k in z.files}
+
+    def save(self, path, **arrays):
+        """Write the entry via a temp file unique to this writer, then rename.
+        Parallel workers that miss the same key each write their own temp file;
+        the entry is the same content either way, so losing the rename race
+        (e.g. Windows refusing to replace a file another worker has open) just
+        means it is already cached."""
+        entry = self._entry(path)
+        fd, tmp = tempfile.mkstemp(dir=self.cache_dir, prefix=".tmp_", suffix=".npz")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(f, **arrays)
+            try:
+                os.replace(tmp, entry)
+            except OSError:
+                if not os.path.exists(entry):
+                    raise
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+        # drop entries of older versions of the same file (same params)
+        pattern = f"{self._path_key(path)}_{HEX}_{self.params_key}.npz"
+        for old in glob.glob(os.path.join(glob.escape(self.cache_dir), pattern)):
+            if old != entry:
+                try:
+                    os.remove(old)
+                except FileNotFoundError:   # another worker removed it first
+                    pass
@@ -0,0 +1,183 @@
+"""
+hit_index.py
+Raster hit-test index of the TreeCanvas zones → "hit_index" in
+scripts/pic_layers_report.json.
+
+Chạy sau crop_layers.py: python hit_index.py [--cell 16] [--threshold 64] [--grow 1]
+  Lưới cell×cell đơn vị viewBox (cùng hệ tọa độ với report: 0 0 W H).  Mỗi
+  entry của report được đặt đúng như LayerImg vẽ (x/y, width/height, flipX,
+  rotation, clip của layer bị cắt) và ô nào có alpha trung bình ≥ threshold
+  thì mang zone của layer đó; layer vẽ sau (zIndex cao hơn, nhánh sau env)
+  đè lên layer vẽ trước.  Nhánh A/B lấy hợp của mọi level (vùng hover không
+  đổi theo KPI), nhánh trang trí C–E và nền không có zone nên không che gì.
+  --grow nở mỗi zone thêm N ô để dễ trỏ chuột vào viền.
+
+  Report có thêm
+      "hit_index": {"cell", "cols", "rows", "zones": [...], "rle": base64}
+  rle = các cặp uint16 little-endian (giá trị, độ dài) theo hàng, giá trị
+  0 = không zone, k = zones[k-1].  TreeCanvas giải nén một lần thành
+  Uint8Array và tra pointer → zone bằng một phép chia, thay cho các <rect>
+  trong suốt chồng lên nhau.
+"""
+import os
+import re
+import sys
+import json
+import base64
+import argparse
+import numpy as np
+from PIL import Image, ImageFilter
+
+from paths import path
+
+Image.MAX_IMAGE_PIXELS = None
+
+OUT_DIR = path("pic_layers", r"d:\CRM WEB\team-progress-tracker\public\pic_layers")
+REPORT_DIR = path("report_dir", r"d:\CRM WEB\team-progress-tracker\scripts")
+REPORT_PATH = os.path.join(REPORT_DIR, "pic_layers_report.json")
+
+# Giống envZone() / classifyLayer() / GROUP_ZONE trong TreeCanvas.tsx
+ENV_ZONE = {"2.png": "mkt", "3.png": "hr", "4.png": "heaven", "5.png": "tech",
+            "6.png": "tech", "11.png": "partnerships", "12.png": "partnerships",
+            "13.png": "market", "14.png": "market"}
+GROUP_ZONE = {"A": "piano", "B": "assistant"}
+BRANCH_ID = re.compile(r"^branch_([A-E])_lv(\d)_")
+BRANCH_A_SOURCES = {"7.png", "8.png", "9.png", "10.png"}
+BG_SOURCE = "15.png"
+
+
+def layer_zone(l):
+    """(draw pass, zone or None): env layers are drawn before branch layers."""
+    m = BRANCH_ID.match(l["id"])
+    if m:
+        return 1, GROUP_ZONE.get(m.group(1))
+    if l.get("source") in BRANCH_A_SOURCES:
+        return 1, GROUP_ZONE["A"]
+    return 0, ENV_ZONE.get(l.get("source"))
+
+
+def draw_order(layers):
+    """Report entries in TreeCanvas paint order (env by zIndex, then branches)."""
+    def key(l):
+        branch, _ = layer_zone(l)
+        return branch, 0 if branch else l.get("zIndex", 0)
+    return sorted((l for l in layers if l.get("source") != BG_SOURCE), key=key)
+
+
+def layer_alpha(l):
+    """Alpha plane of the cropped PNG behind an entry, or None if missing."""
+    path = os.path.join(OUT_DIR, f"layer_{os.path.splitext(l['source'])[0]}.png")
+    if not os.path.exists(path):
+        return None
+    return Image.open(path).getchannel("A")
+
+
+def coverage_on_grid(l, alpha, cell, cols, rows):
+    """Mean alpha (0–255) of the entry as drawn, sampled at every cell centre."""
+    sliced = l.get("isSliced") is True
+    ry = (l.get("origY", l["y"]) if sliced and l.get("sliceType") == "bottom" else l["y"])
+    rh = l.get("origH", l["height"]) if sliced else l["height"]
+    w, h = l["width"], rh
+    if w <= 0 or h <= 0:
+        return None
+    # alpha area-resized to ~1 px per cell, so a centre sample = mean coverage
+    aw, ah = max(1, round(w / cell)), max(1, round(h / cell))
+    small = np.asarray(alpha.resize((aw, ah), Image.BOX))
+
+    # cell centres in viewBox units, back through transform="rotate(...) flip"
+    px = (np.arange(cols) + 0.5) * cell
+    py = (np.arange(rows) + 0.5) * cell
+    X, Y = np.meshgrid(px, py)
+    cx, cy = l["x"] + w / 2, ry + h / 2
+    rot = l.get("rotation") or 0
+    if rot:
+        t = np.deg2rad(-rot)
+        dx, dy = X - cx, Y - cy
+        X, Y = cx + dx * np.cos(t) - dy * np.sin(t), cy + dx * np.sin(t) + dy * np.cos(t)
+    if l.get("flipX"):
+        X = 2 * cx - X
+
+    inside = (X >= l["x"]) & (X < l["x"] + w) & (Y >= ry) & (Y < ry + h)
+    if sliced:    # clipPath = the slice's own x/y/width/height (same user space)
+        inside &= (Y >= l["y"]) & (Y < l["y"] + l["height"])
+    u = np.clip(((X - l["x"]) / w * aw).astype(np.int64), 0, aw - 1)
+    v = np.clip(((Y - ry) / h * ah).astype(np.int64), 0, ah - 1)
+    out = np.where(inside, small[v, u], 0).astype(np.float64)
+    return out * float(l.get("opacity", 1))
+
+
+def build_labels(layers, W, H, cell, threshold, grow):
+    """uint8 label raster (rows × cols) and the zone list its values index."""
+    cols, rows = -(-W // cell), -(-H // cell)
+    labels = np.zeros((rows, cols), dtype=np.uint8)
+    zones = []
+    alphas = {}
+    for l in draw_order(layers):
+        _, zone = layer_zone(l)
+        if zone is None:
+            continue
+        src = l["source"]
+        if src not in alphas:
+            alphas[src] = layer_alpha(l)
+        if alphas[src] is None:
+            print(f"[{l['id']}] thiếu layer_{os.path.splitext(src)[0]}.png, bỏ qua.")
+            continue
+        cov = coverage_on_grid(l, alphas[src], cell, cols, rows)
+        if cov is None:
+            continue
+        hit = cov >= threshold
+        if grow:
+            hit = np.asarray(Image.fromarray(hit.astype(np.uint8) * 255)
+                             .filter(ImageFilter.MaxFilter(2 * grow + 1))) > 0
+        if zone not in zones:
+            zones.append(zone)
+        labels[hit] = zones.index(zone) + 1
+        print(f"[{l['id']:20s}] → {zone:13s} {int(hit.sum()):6d} ô")
+    return labels, zones
+
+
+def rle_encode(labels):
+    """Row-major runs → base64 of uint16 LE (value, length) pairs."""
+    flat = labels.ravel()
+    starts = np.flatnonzero(np.r_[True, flat[1:] != flat[:-1]])
+    lengths = np.diff(np.r_[starts, flat.size])
+    pairs = []
+    for value, n in zip(flat[starts], lengths):
+        while n > 0:                      # uint16 lengths: split very long runs
+            k = min(int(n), 0xFFFF)
+            pairs += [int(value), k]
+            n -= k
+    return base64.b64encode(np.array(pairs, dtype="<u2").tobytes()).decode("ascii"), len(pairs) // 2
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--cell", type=int, default=16, help="cell size in viewBox units")
+    ap.add_argument("--threshold", type=int, default=64,
+                    help="mean alpha (0-255) for a cell to belong to a layer")
+    ap.add_argument("--grow", type=int, default=1, help="dilate each zone by N cells")
+    args = ap.parse_args()
+
+    if not os.path.exists(REPORT_PATH):
+        print(f"Không tìm thấy {REPORT_PATH} (chạy crop_layers.py trước)")
+        return 1
+    with open(REPORT_PATH, encoding="utf-8") as f:
+        report = json.load(f)
+    W, H = report["original_size"]["width"], report["original_size"]["height"]
+
+    labels, zones = build_labels(report["layers"], W, H, args.cell, args.threshold, args.grow)
+    rle, runs = rle_encode(labels)
+    rows, cols = labels.shape
+    report["hit_index"] = {"cell": args.cell, "cols": cols, "rows": rows,
+                           "zones": zones, "rle": rle}
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    print(f"\n✅ hit_index {cols}x{rows} ô ({args.cell} đv/ô), {len(zones)} zone, "
+          f"{runs} run, {len(rle)} ký tự base64")
+    print(f"✅ Báo cáo tọa độ lưu tại: {REPORT_PATH}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
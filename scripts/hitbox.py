@@ -0,0 +1,61 @@
+"""
+hitbox.py
+SVG hitbox paths for the segmented layers (refine_layers.py).
+
+mask_polygons() traces the layer alpha instead of per-row extents: the mask
+is area-resized to SVG scale, every outer boundary and hole is taken from
+cv2.findContours (RETR_CCOMP), and each ring is simplified with
+Douglas–Peucker (cv2.approxPolyDP) at `tolerance` SVG units.  If the rings
+still hold more than `max_points` vertices the tolerance grows ×1.5 until
+they fit, so concave shapes (roots) and split parts (clouds) stay separate
+without blowing up the path size.  polygons_path() writes them as one
+multi-polygon `d`; holes are plain sub-paths, so draw / hit-test it with
+fill-rule="evenodd".
+"""
+import cv2
+import numpy as np
+
+DEFAULT_TOLERANCE  = 1.0    # SVG units (900-wide viewBox)
+DEFAULT_MAX_POINTS = 200    # per layer, all rings together
+MIN_AREA = 4.0              # SVG units² — smaller rings are dropped
+
+
+def _rings(mask, scale):
+    """Outer boundaries + holes of a 0/255 mask resized by scale, as int32
+    contours (CHAIN_APPROX_SIMPLE) with their |area|."""
+    h, w = mask.shape
+    sw, sh = max(1, round(w * scale)), max(1, round(h * scale))
+    small = cv2.resize(mask, (sw, sh), interpolation=cv2.INTER_AREA)
+    small = np.where(small >= 128, 255, 0).astype(np.uint8)
+    contours, _ = cv2.findContours(small, cv2.RETR_CCOMP, cv2.CHAIN_APPROX_SIMPLE)
+    return [(c, abs(cv2.contourArea(c))) for c in contours]
+
+
+def mask_polygons(mask, scale, tolerance=DEFAULT_TOLERANCE,
+                  max_points=DEFAULT_MAX_POINTS, min_area=MIN_AREA):
+    """Simplified polygons [[(x, y), ...], ...] of a mask in SVG units.
+
+    Rings under min_area are dropped, then every ring is Douglas–Peucker
+    simplified at `tolerance`; the tolerance is raised ×1.5 until the total
+    vertex count fits `max_points` (None = no budget).  Largest rings first.
+    """
+    rings = [(c, a) for c, a in _rings(mask, scale) if a >= min_area]
+    rings.sort(key=lambda r: -r[1])
+    eps = tolerance
+    while True:
+        polys = [cv2.approxPolyDP(c, eps, True).reshape(-1, 2) for c, _ in rings]
+        polys = [p for p in polys if len(p) >= 3]
+        if max_points is None or sum(map(len, polys)) <= max_points or not polys:
+            break
+        if eps > max(mask.shape) * scale:    # can't get smaller: keep the biggest rings
+            while len(polys) > 1 and sum(map(len, polys)) > max_points:
+                polys.pop()
+            break
+        eps *= 1.5
+    return [[(int(x), int(y)) for x, y in p] for p in polys]
+
+
+def polygons_path(polys):
+    """Multi-polygon SVG path d ("M x,y L ... Z M ... Z"); None if empty."""
+    if not polys: return None
+    return " ".join("M" + " L".join(f"{x},{y}" for x, y in p) + " Z" for p in polys)
@@ -0,0 +1,96 @@
+"""
+hsv_engine.py
+Shared RGB→HSV conversion for analyze_tree.py, refine_layers.py and
+visualize_layers.py.
+
+H is in degrees [0-360), S and V in [0-1] — the same convention (and the same
+branch order for ties: blue > green > red, grey → 240°) as the old per-script
+rgb2hsv, so every threshold in the layer rules keeps its meaning.
+
+Differences from the old copies:
+  * uint8 planes go in directly, no up-front float64 cast of R/G/B.
+  * every intermediate lands in a preallocated buffer instead of a fresh
+    full-frame temporary.
+  * hue branches are merged with np.copyto(where=...) instead of boolean
+    fancy-index gather/scatter.
+  * rgba_to_hsv() works through the frame in row tiles, so the scratch
+    memory is bounded by the tile size, not the image size.
+"""
+import numpy as np
+
+DEFAULT_TILE_ROWS = 256
+
+
+def rgb2hsv(r, g, b, out=None, dtype=np.float64):
+    """Vectorised RGB→HSV on uint8 (0-255) planes.
+
+    Returns H[0-360], S[0-1], V[0-1] as a (3, ...) array; pass `out` to
+    write into an existing buffer (it may be a view, e.g. a tile of a larger
+    frame-sized result).
+
+    float64 (default) reproduces the old masks bit for bit.  float32 halves
+    the output again; it only disagrees on colours that sit exactly on a
+    threshold (e.g. S == 0.40), which is fine for previews.
+    """
+    shape = np.shape(r)
+    if out is None:
+        out = np.empty((3,) + shape, dtype=dtype)
+    dtype = out.dtype
+    h, s, v = out[0], out[1], out[2]
+
+    # Scaled channels — same r/255 rounding as the old float code
+    rf = np.divide(r, 255.0, dtype=dtype)
+    gf = np.divide(g, 255.0, dtype=dtype)
+    bf = np.divide(b, 255.0, dtype=dtype)
+
+    np.maximum(rf, gf, out=v)
+    np.maximum(v, bf, out=v)                 # V = cmax
+    delta = np.minimum(rf, gf)
+    np.minimum(delta, bf, out=delta)
+    np.subtract(v, delta, out=delta)
+    delta += dtype.type(1e-10)
+
+    # S = delta / cmax  (0 where cmax == 0)
+    np.divide(delta, v, out=s, where=v > 0)
+    s[v == 0] = 0
+
+    tmp  = np.empty_like(delta)
+    hit  = np.empty(shape, dtype=bool)
+
+    # red is max (default branch)
+    np.subtract(gf, bf, out=h)
+    np.divide(h, delta, out=h)
+    np.multiply(h, 60, out=h)
+    np.mod(h, 360, out=h)
+    # green is max
+    np.subtract(bf, rf, out=tmp)
+    np.divide(tmp, delta, out=tmp)
+    np.multiply(tmp, 60, out=tmp)
+    tmp += 120
+    np.equal(v, gf, out=hit)
+    np.copyto(h, tmp, where=hit)
+    # blue is max (wins ties, like the old scatter order)
+    np.subtract(rf, gf, out=tmp)
+    np.divide(tmp, delta, out=tmp)
+    np.multiply(tmp, 60, out=tmp)
+    tmp += 240
+    np.equal(v, bf, out=hit)
+    np.copyto(h, tmp, where=hit)
+    return out
+
+
+def rgba_to_hsv(arr, tile_rows=DEFAULT_TILE_ROWS, out=None, dtype=np.float64):
+    """HSV planes for an (H, W, 3|4) uint8 image, computed tile by tile.
+
+    Returns a (3, H, W) array (H_ch, S_ch, V_ch = rgba_to_hsv(arr)).
+    `tile_rows=None` converts the whole frame in one call.
+    """
+    rows, cols = arr.shape[:2]
+    if out is None:
+        out = np.empty((3, rows, cols), dtype=dtype)
+    step = rows if not tile_rows else tile_rows
+    for y0 in range(0, rows, step):
+        y1 = min(rows, y0 + step)
+        band = arr[y0:y1]
+        rgb2hsv(band[:, :, 0], band[:, :, 1], band[:, :, 2], out=out[:, y0:y1])
+    return out
@@ -0,0 +1,152 @@
+"""
+hsv_index.py
+Precomputed HSV histogram index of one image (layer_tuner.py,
+refine_layers.py).
+
+The image is cut into a grid of zone cells; every cell gets a 3-D H×S×V
+histogram, and the whole 5-D (cell_y, cell_x, H, S, V) array is turned into
+a summed-volume table.  Then, for any H/S/V box restricted to any zone
+rectangle,
+
+    count = Σ ± table[corner]          (inclusion–exclusion, 2^5 corners)
+
+is a handful of lookups instead of a pass over the frame.  Box edges that
+fall inside a bin / cell are linearly interpolated (pixels assumed uniform
+inside a bin), so the answer is exact on bin/cell edges and close otherwise.
+Percentiles come from the cumulative histogram of one channel inside a zone,
+interpolated within the crossing bin, instead of sorting the pixels.
+
+    idx = HSVIndex.build(bands, H, W, CV_RANGES)   # bands: (y0, h, s, v) planes
+    idx.coverage(h=(10, 45), s=(60, 256), zone=(0.4, 0.84, 0.44, 0.56))   # %
+    idx.percentiles("s", [5, 50, 95], zone=(0.5, 0.9, 0.4, 0.6))
+
+Ranges are half-open [lo, hi) in channel units; zones are fractional
+(y0, y1, x0, x1) like the "zone" of layer_rules.json.  Built indexes are
+cached per source file (content hash + params) via FeatureCache.
+"""
+import os
+import numpy as np
+
+from feature_cache import FeatureCache
+
+CV_RANGES  = ((0, 180), (0, 256), (0, 256))   # cv2 COLOR_BGR2HSV, uint8
+HSV_RANGES = ((0, 360), (0, 1), (0, 1))       # hsv_engine: degrees, [0-1]
+DEFAULT_BINS = (36, 24, 24)
+DEFAULT_GRID = (20, 20)                       # 5 % cells: zones in the rules sit on them
+CHANNELS = "hsv"
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "hsv_index")
+
+
+def _axis_terms(t0, t1, n):
+    """Prefix-table indices and signed weights for the fractional range
+    [t0, t1) on an axis of n bins: P(t1) − P(t0), each P linearly interpolated."""
+    idx, w = [], []
+    for t, sign in ((t1, 1.0), (t0, -1.0)):
+        t = min(max(t, 0.0), n)
+        i = min(int(t), n - 1)
+        f = t - i
+        idx += [i, i + 1]
+        w += [sign * (1 - f), sign * f]
+    return np.array(idx), np.array(w)
+
+
+def _bin(plane, rng, n):
+    """Bin index (int64) of each value of plane in range rng split into n bins."""
+    r0, r1 = rng
+    b = ((plane - r0) * (n / (r1 - r0))).astype(np.int64)
+    return np.clip(b, 0, n - 1, out=b)         # V == 1.0 etc. → last bin
+
+
+class HSVIndex:
+    def __init__(self, table, ranges, shape):
+        self.table = table                  # (gy+1, gx+1, hb+1, sb+1, vb+1) prefix sums
+        self.ranges = tuple(tuple(r) for r in ranges)
+        self.shape = tuple(shape)           # (H, W) of the source image
+        self.grid = tuple(n - 1 for n in table.shape[:2])
+        self.bins = tuple(n - 1 for n in table.shape[2:])
+
+    # ── Build ────────────────────────────────────────────────────────────────
+    @classmethod
+    def build(cls, bands, H, W, ranges, bins=DEFAULT_BINS, grid=DEFAULT_GRID):
+        """Index from (y0, h, s, v) plane bands covering an H×W image."""
+        gy, gx = grid
+        hb, sb, vb = bins
+        cell_size = hb * sb * vb
+        hist = np.zeros(gy * gx * cell_size, dtype=np.int64)
+        cx = np.arange(W, dtype=np.int64) * gx // W
+        for y0, *planes in bands:
+            rows = planes[0].shape[0]
+            cy = np.arange(y0, y0 + rows, dtype=np.int64) * gy // H
+            hbin, sbin, vbin = (_bin(p, r, n) for p, r, n in zip(planes, ranges, bins))
+            flat = (((cy[:, None] * gx + cx) * hb + hbin) * sb + sbin) * vb + vbin
+            # only the cell rows this band touches
+            lo, hi = int(cy[0]) * gx * cell_size, (int(cy[-1]) + 1) * gx * cell_size
+            hist[lo:hi] += np.bincount(flat.ravel() - lo, minlength=hi - lo)
+        table = hist.reshape(gy, gx, hb, sb, vb)
+        for ax in range(5):
+            table = np.cumsum(table, axis=ax)
+        table = np.pad(table, [(1, 0)] * 5).astype(np.uint32)
+        return cls(table, ranges, (H, W))
+
+    @classmethod
+    def cached(cls, src_path, bands_fn, H, W, ranges, bins=DEFAULT_BINS,
+               grid=DEFAULT_GRID, cache_dir=CACHE_DIR):
+        """Load the index of src_path from the cache, or build it with
+        bands_fn() (an iterator of (y0, h, s, v)) and store it."""
+        cache = FeatureCache(cache_dir, {"ranges": ranges, "bins": bins, "grid": grid})
+        hit = cache.load(src_path)
+        if hit is not None:
+            return cls(hit["table"], hit["ranges"], hit["shape"])
+        idx = cls.build(bands_fn(), H, W, ranges, bins, grid)
+        cache.save(src_path, table=idx.table, ranges=np.array(ranges, dtype=np.float64),
+                   shape=np.array(idx.shape))
+        return idx
+
+    # ── Queries ──────────────────────────────────────────────────────────────
+    def _terms(self, h, s, v, zone):
+        y0, y1, x0, x1 = zone or (0, 1, 0, 1)
+        terms = [_axis_terms(y0 * self.grid[0], y1 * self.grid[0], self.grid[0]),
+                 _axis_terms(x0 * self.grid[1], x1 * self.grid[1], self.grid[1])]
+        for rng, (r0, r1), n in zip((h, s, v), self.ranges, self.bins):
+            lo, hi = rng if rng is not None else (r0, r1)
+            k = n / (r1 - r0)
+            terms.append(_axis_terms((lo - r0) * k, (hi - r0) * k, n))
+        return terms
+
+    def count(self, h=None, s=None, v=None, zone=None):
+        """≈ number of pixels with H in h, S in s, V in v inside zone."""
+        terms = self._terms(h, s, v, zone)
+        block = self.table[np.ix_(*(i for i, _ in terms))].astype(np.float64)
+        return float(np.einsum("abcde,a,b,c,d,e->", block, *(w for _, w in terms)))
+
+    def coverage(self, h=None, s=None, v=None, zone=None):
+        """count() as % of the whole frame (like mask.sum() / (H*W) * 100)."""
+        return self.count(h, s, v, zone) / (self.shape[0] * self.shape[1]) * 100
+
+    def cumulative(self, ch, zone=None):
+        """(bin edges, cumulative pixel counts at those edges) of one channel in zone."""
+        k = 2 + CHANNELS.index(ch)
+        terms = self._terms(None, None, None, zone)
+        terms[k] = (np.arange(self.bins[k - 2] + 1), None)
+        block = self.table[np.ix_(*(i for i, _ in terms))].astype(np.float64)
+        for ax in reversed(range(5)):          # contract every other axis
+            if ax != k:
+                block = np.tensordot(block, terms[ax][1], axes=([ax], [0]))
+        r0, r1 = self.ranges[k - 2]
+        return np.linspace(r0, r1, self.bins[k - 2] + 1), block
+
+    def percentiles(self, ch, qs, zone=None):
+        """Approximate np.percentile(channel[zone], qs) from the cumulative histogram."""
+        edges, cum = self.cumulative(ch, zone)
+        total = cum[-1]
+        if total <= 0:
+            return [float("nan")] * len(qs)
+        out = []
+        for q in qs:
+            target = q / 100 * total
+            i = int(np.searchsorted(cum, target, side="right" if target <= 0 else "left"))
+            i = min(max(i, 1), len(cum) - 1)
+            span = cum[i] - cum[i - 1]
+            f = (target - cum[i - 1]) / span if span > 0 else 0.0
+            out.append(float(edges[i - 1] + f * (edges[i] - edges[i - 1])))
+        return out
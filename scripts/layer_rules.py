@@ -0,0 +1,220 @@
+"""
+layer_rules.py
+Compiler for the declarative layer rules in layer_rules.json.
+
+Every rule set is compiled into two lookup stages, so all layers are
+evaluated in one pass with no per-rule boolean temporaries:
+
+  1. colour LUT  — one uint16 per colour holding the truth value of every
+     distinct HSV clause ("atom").  space 'hsv' is indexed by packed RGB
+     (2^24 entries, exact: it is built with the same float64 hsv_engine the
+     scripts used before); space 'cv' by packed OpenCV H/S/V (180*256*256).
+  2. atom table  — per zone combination, atom bits → layer bits.  Zones are
+     rectangles, so the frame splits into a handful of cells in which every
+     zone is simply on or off; references (`trunk`, `!sky`) and `exclude`
+     are folded into this table.
+
+The result is a single label map where bit i is set when the pixel belongs
+to layers[i] (layers may overlap, e.g. roots ⊂ trunk).  The colour LUT is
+cached on disk under scripts/.cache, keyed by the atoms it encodes.
+
+    rules = compile_rules("refined")
+    label = rules.label_rgb(band, y0, H, W)
+    roots = rules.mask(label, "roots")
+"""
+import os, re, json, hashlib
+import numpy as np
+
+from hsv_engine import rgb2hsv
+from segment import zone_rect
+
+HERE       = os.path.dirname(os.path.abspath(__file__))
+RULES_PATH = os.path.join(HERE, "layer_rules.json")
+CACHE_DIR  = os.path.join(HERE, ".cache")
+
+MAX_ATOMS = 16
+_TERM = re.compile(r"^([HSV])\s*(<=|>=|<|>)\s*(-?[\d.]+)$")
+_OPS  = {"<": np.less, "<=": np.less_equal, ">": np.greater, ">=": np.greater_equal}
+
+
+# ── Parsing ──────────────────────────────────────────────────────────────────
+def parse_terms(text):
+    """Channel comparisons of a clause: 'H >= 85 & S <= 85' → [("H", ">=", 85.0), ...]."""
+    return [(m.group(1), m.group(2), float(m.group(3)))
+            for m in (_TERM.match(t.strip()) for t in text.split("&")) if m]
+
+
+def _parse_clause(text, known):
+    """'H >= 190 & S < 0.5 & !sky' → (sorted channel terms, [(ref, negated)])."""
+    terms, refs = parse_terms(text), []
+    for raw in text.split("&"):
+        t = raw.strip()
+        if _TERM.match(t):
+            continue
+        neg = t.startswith("!")
+        ref = t[1:].strip() if neg else t
+        if ref not in known:
+            raise ValueError(f"clause {text!r}: {ref!r} is not an earlier layer")
+        refs.append((ref, neg))
+    return tuple(sorted(terms)), refs
+
+
+def load_rules(name, path=RULES_PATH):
+    """Raw rule set `name` from the JSON spec."""
+    with open(path, encoding="utf-8") as f:
+        spec = json.load(f)
+    if name not in spec:
+        raise KeyError(f"no rule set {name!r} in {path}")
+    return spec[name]
+
+
+# ── Compiled rule set ────────────────────────────────────────────────────────
+class LayerRules:
+    def __init__(self, ruleset, cache_dir=CACHE_DIR):
+        self.space  = ruleset.get("space", "hsv")
+        if self.space not in ("hsv", "cv"):
+            raise ValueError(f"unknown colour space {self.space!r}")
+        self.layers = ruleset["layers"]
+        self.names  = [L["name"] for L in self.layers]
+        self.notes  = {L["name"]: L.get("note", "") for L in self.layers}
+        if len(self.names) > 32:
+            raise ValueError("at most 32 layers per rule set")
+        self.dtype  = np.uint16 if len(self.names) <= 16 else np.uint32
+
+        atoms, zones, known = [], [], set()
+        self._compiled = []          # (zone index|None, [(atom|None, refs)], excludes)
+        for L in self.layers:
+            clauses = []
+            for text in L["any"]:
+                terms, refs = _parse_clause(text, known)
+                atom = None
+                if terms:
+                    if terms not in atoms:
+                        atoms.append(terms)
+                    atom = atoms.index(terms)
+                clauses.append((atom, refs))
+            for ex in L.get("exclude", []):
+                if ex not in known:
+                    raise ValueError(f"{L['name']}: exclude {ex!r} is not an earlier layer")
+            zi = None
+            if "zone" in L:
+                z = tuple(L["zone"])
+                if z not in zones:
+                    zones.append(z)
+                zi = zones.index(z)
+            self._compiled.append((zi, clauses, L.get("exclude", [])))
+            known.add(L["name"])
+        if len(atoms) > MAX_ATOMS:
+            raise ValueError(f"{len(atoms)} colour clauses; the LUT holds {MAX_ATOMS}")
+        self.atoms, self.zones = atoms, zones
+        self._tables = {}
+        self.lut = self._load_lut(cache_dir)
+
+    # ── stage 1: colour → atom bits ─────────────────────────────────────────
+    def _atom_bits(self, Hc, Sc, Vc):
+        planes = {"H": Hc, "S": Sc, "V": Vc}
+        bits = np.zeros(Hc.shape, dtype=np.uint16)
+        hit  = np.empty(Hc.shape, dtype=bool)
+        tmp  = np.empty(Hc.shape, dtype=bool)
+        for i, terms in enumerate(self.atoms):
+            hit[...] = True
+            for ch, op, val in terms:
+                _OPS[op](planes[ch], val, out=tmp)
+                hit &= tmp
+            bits[hit] |= np.uint16(1 << i)
+        return bits
+
+    def _build_lut(self):
+        if self.space == "cv":
+            Hc, Sc, Vc = np.meshgrid(np.arange(180), np.arange(256), np.arange(256),
+                                     indexing="ij")
+            return self._atom_bits(Hc, Sc, Vc).ravel()
+        lut = np.empty(1 << 24, dtype=np.uint16)
+        g, b = np.meshgrid(np.arange(256, dtype=np.uint8), np.arange(256, dtype=np.uint8),
+                           indexing="ij")
+        hsv = np.empty((3, 256, 256))
+        for r in range(256):
+            rgb2hsv(np.full_like(g, r), g, b, out=hsv)
+            lut[r << 16:(r + 1) << 16] = self._atom_bits(*hsv).ravel()
+        return lut
+
+    def _load_lut(self, cache_dir):
+        key = hashlib.sha1(json.dumps([self.space, self.atoms]).encode()).hexdigest()[:16]
+        path = os.path.join(cache_dir, f"lut_{self.space}_{key}.npy") if cache_dir else None
+        if path and os.path.exists(path):
+            return np.load(path)
+        lut = self._build_lut()
+        if path:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.save(path, lut)
+        return lut
+
+    # ── stage 2: atom bits → layer bits, per zone combination ───────────────
+    def _table(self, sig):
+        if sig in self._tables:
+            return self._tables[sig]
+        combos = np.arange(1 << len(self.atoms), dtype=np.uint32)
+        atom_on = [(combos >> i) & 1 == 1 for i in range(len(self.atoms))]
+        vals, table = {}, np.zeros(len(combos), dtype=self.dtype)
+        for i, (zi, clauses, excludes) in enumerate(self._compiled):
+            v = np.zeros(len(combos), dtype=bool)
+            if zi is None or sig[zi]:
+                for atom, refs in clauses:
+                    c = np.ones(len(combos), dtype=bool) if atom is None else atom_on[atom].copy()
+                    for ref, neg in refs:
+                        c &= ~vals[ref] if neg else vals[ref]
+                    v |= c
+                for ex in excludes:
+                    v &= ~vals[ex]
+            vals[self.names[i]] = v
+            table[v] |= self.dtype(1 << i)
+        self._tables[sig] = table
+        return table
+
+    def _cells(self, y0, y1, H, W):
+        """Yield (ya, yb, xa, xb, sig) rectangles of the band with one zone state."""
+        rects = [zone_rect(z, H, W) for z in self.zones]
+        ys = sorted({y0, y1} | {y for r in rects for y in r[:2] if y0 < y < y1})
+        xs = sorted({0, W} | {x for r in rects for x in r[2:] if 0 < x < W})
+        for ya, yb in zip(ys, ys[1:]):
+            for xa, xb in zip(xs, xs[1:]):
+                sig = tuple(r[0] <= ya and yb <= r[1] and r[2] <= xa and xb <= r[3]
+                            for r in rects)
+                yield ya, yb, xa, xb, sig
+
+    def _label(self, bits, y0, H, W):
+        label = np.empty(bits.shape, dtype=self.dtype)
+        for ya, yb, xa, xb, sig in self._cells(y0, y0 + bits.shape[0], H, W):
+            table = self._table(sig)
+            label[ya - y0:yb - y0, xa:xb] = table[bits[ya - y0:yb - y0, xa:xb]]
+        return label
+
+    # ── public ──────────────────────────────────────────────────────────────
+    def label_rgb(self, band, y0, H, W):
+        """Label map for an (rows, W, 3|4) uint8 RGB(A) band starting at y0."""
+        if self.space != "hsv":
+            raise ValueError("label_rgb needs an 'hsv' rule set; use label_hsv")
+        idx = band[:, :, 0].astype(np.uint32) << 16
+        idx |= band[:, :, 1].astype(np.uint32) << 8
+        idx |= band[:, :, 2]
+        return self._label(self.lut[idx], y0, H, W)
+
+    def label_hsv(self, hsv, y0, H, W):
+        """Label map for an (rows, W, 3) OpenCV uint8 HSV band starting at y0."""
+        if self.space != "cv":
+            raise ValueError("label_hsv needs a 'cv' rule set; use label_rgb")
+        idx = hsv[:, :, 0].astype(np.uint32) << 16
+        idx |= hsv[:, :, 1].astype(np.uint32) << 8
+        idx |= hsv[:, :, 2]
+        return self._label(self.lut[idx], y0, H, W)
+
+    def bit(self, name):
+        return self.dtype(1 << self.names.index(name))
+
+    def mask(self, label, name):
+        """Bool mask of one layer out of a label map."""
+        return (label & self.bit(name)) != 0
+
+
+def compile_rules(name, path=RULES_PATH, cache_dir=CACHE_DIR):
+    return LayerRules(load_rules(name, path), cache_dir=cache_dir)
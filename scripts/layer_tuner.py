@@ -3,14 +3,26 @@ Interactive Layer Tuner - kéo slider để chỉnh HSV + vùng x/y
 Phím: S = lưu | N = layer tiếp | Q = thoát
 Chạy: python layer_tuner.py [1|2|3|4]
   1 = Mây   2 = Thân   3 = Rễ   4 = Cỏ
+
+Preview chạy trên bản HSV thu nhỏ cỡ cửa sổ (proxy) và chỉ tính lại khi
+slider đổi; Coverage và % từng kênh lấy từ HSV histogram index (hsv_index.py,
+cache theo ảnh nguồn) nên là số của ảnh full-res.  Mask full-res chỉ được
+tính khi bấm S.
 """
 import cv2
 import numpy as np
 import os, sys
 
-SRC = r"D:\CRM WEB\team-progress-tracker\background.png"
-OUT = r"D:\CRM WEB\team-progress-tracker\scripts\layers_out"
+from blend import apply_lut, lut, tint_into
+from hsv_index import CV_RANGES, HSVIndex
+from layer_rules import load_rules, parse_terms
+from paths import path
+from morphology import morph
+
+SRC = path("background", r"D:\CRM WEB\team-progress-tracker\background.png")
+OUT = path("layers_out", r"D:\CRM WEB\team-progress-tracker\scripts\layers_out")
 os.makedirs(OUT, exist_ok=True)
+MORPH = "exact"    # close/dilate strategy khi lưu: exact | separable (morphology.py)
 
 orig = cv2.imread(SRC, cv2.IMREAD_UNCHANGED)
 bgr  = orig[:, :, :3].copy()
@@ -22,29 +34,28 @@ Hc, Sc, Vc = hsv[:,:,0], hsv[:,:,1], hsv[:,:,2]
 DW = 1280
 DH = int(IH * DW / IW)
 bgr_d = cv2.resize(bgr, (DW, DH))
-
-LAYERS = [
-    {
-        "name": "1_may_clouds", "color": (200, 230, 255),
-        "H_min":85,"H_max":115,"S_min":0, "S_max":85,
-        "V_min":220,"V_max":255,"y_min":0,"y_max":22,"x_min":0,"x_max":100,
-    },
-    {
-        "name": "2_than_cay_trunk", "color": (140, 100, 200),
-        "H_min":18,"H_max":44,"S_min":55,"S_max":110,
-        "V_min":115,"V_max":220,"y_min":40,"y_max":84,"x_min":44,"x_max":56,
-    },
-    {
-        "name": "3_re_cay_roots", "color": (40, 120, 255),
-        "H_min":30,"H_max":46,"S_min":145,"S_max":225,
-        "V_min":100,"V_max":158,"y_min":84,"y_max":97,"x_min":22,"x_max":78,
-    },
-    {
-        "name": "4_co_grass", "color": (50, 220, 80),
-        "H_min":35,"H_max":62,"S_min":148,"S_max":255,
-        "V_min":95,"V_max":255,"y_min":55,"y_max":100,"x_min":0,"x_max":100,
-    },
-]
+# Proxy planes for the preview: nearest keeps real HSV values (no hue averaging)
+hsv_d = cv2.resize(hsv, (DW, DH), interpolation=cv2.INTER_NEAREST)
+Hd, Sd, Vd = hsv_d[:,:,0], hsv_d[:,:,1], hsv_d[:,:,2]
+
+# Full-res H×S×V × zone-cell histogram index (built once per source image)
+IDX = HSVIndex.cached(SRC, lambda: ((y, Hc[y:y+512], Sc[y:y+512], Vc[y:y+512])
+                                    for y in range(0, IH, 512)), IH, IW, CV_RANGES)
+# 1-D histograms, only for drawing the HUD strips
+HIST = {ch: np.bincount(plane.ravel(), minlength=256)[:256]
+        for ch, plane in (("H", Hc), ("S", Sc), ("V", Vc))}
+
+def tuner_layer(L):
+    """layer_rules.json entry → slider params (H/S/V bounds, y/x zone in %)."""
+    p = {"name": L["name"], "color": tuple(L["color"])}
+    for ch, op, val in parse_terms(L["any"][0]):
+        p[f"{ch}_{'min' if op.startswith('>') else 'max'}"] = int(val)
+    y0, y1, x0, x1 = L.get("zone", (0, 1, 0, 1))
+    p.update(y_min=round(y0*100), y_max=round(y1*100), x_min=round(x0*100), x_max=round(x1*100))
+    return p
+
+# Default params live in layer_rules.json ("tuner" set)
+LAYERS = [tuner_layer(L) for L in load_rules("tuner")["layers"]]
 
 SLIDERS = [
     ("H_min", 0, 179), ("H_max", 0, 179),
@@ -56,48 +67,97 @@ SLIDERS = [
 
 def nothing(_): pass
 
-def build_mask(p):
+def build_mask(p, H=Hc, S=Sc, V=Vc):
+    """HSV box + zone mask on the given planes (full res by default, or Hd/Sd/Vd)."""
     m = (
-        (Hc >= p["H_min"]) & (Hc <= p["H_max"]) &
-        (Sc >= p["S_min"]) & (Sc <= p["S_max"]) &
-        (Vc >= p["V_min"]) & (Vc <= p["V_max"])
+        (H >= p["H_min"]) & (H <= p["H_max"]) &
+        (S >= p["S_min"]) & (S <= p["S_max"]) &
+        (V >= p["V_min"]) & (V <= p["V_max"])
     ).astype(np.uint8) * 255
-    y0 = int(IH * p["y_min"] / 100)
-    y1 = int(IH * p["y_max"] / 100)
-    x0 = int(IW * p["x_min"] / 100)
-    x1 = int(IW * p["x_max"] / 100)
+    h, w = m.shape
+    y0 = int(h * p["y_min"] / 100)
+    y1 = int(h * p["y_max"] / 100)
+    x0 = int(w * p["x_min"] / 100)
+    x1 = int(w * p["x_max"] / 100)
     out = np.zeros_like(m)
     out[y0:y1, x0:x1] = m[y0:y1, x0:x1]
     return out
 
-def render_frame(mask, color, p, name):
+def box(p):
+    """Slider values → HSVIndex query (inclusive sliders → half-open ranges)."""
+    return dict(h=(p["H_min"], p["H_max"] + 1), s=(p["S_min"], p["S_max"] + 1),
+                v=(p["V_min"], p["V_max"] + 1),
+                zone=(p["y_min"] / 100, p["y_max"] / 100, p["x_min"] / 100, p["x_max"] / 100))
+
+def coverage(p):
+    """Full-res % of pixels inside the slider box + zone (≈ mask.sum() / frame)."""
+    if (p["y_max"] <= p["y_min"] or p["x_max"] <= p["x_min"]
+            or any(p[f"{c}_max"] < p[f"{c}_min"] for c in "HSV")):
+        return 0.0
+    return IDX.coverage(**box(p))
+
+def channel_pct(ch, lo, hi):
+    """% of all pixels whose channel value lies in [lo, hi]."""
+    if hi < lo:
+        return 0.0
+    return IDX.coverage(**{ch.lower(): (lo, hi + 1)})
+
+# ── HUD histograms: drawn once, only the selected range is re-shaded ─────────
+HIST_W, HIST_H = 180, 44
+
+def hist_strip(ch):
+    """Grey log-histogram of one channel, HIST_W x HIST_H (BGR)."""
+    h = HIST[ch][:180] if ch == "H" else HIST[ch]
+    bins = np.add.reduceat(h, np.linspace(0, len(h), HIST_W, endpoint=False).astype(int))
+    hs = np.log1p(bins) / max(np.log1p(bins).max(), 1e-9)
+    img = np.zeros((HIST_H, HIST_W, 3), np.uint8)
+    for x, v in enumerate(hs):
+        img[HIST_H - int(v * (HIST_H - 1)) - 1:, x] = 110
+    return img
+
+STRIPS = {ch: hist_strip(ch) for ch in ("H", "S", "V")}
+
+def draw_hist(d, ch, lo, hi, x, y):
+    top = 179 if ch == "H" else 255
+    strip = STRIPS[ch].copy()
+    a, b = int(lo / (top + 1) * HIST_W), int((hi + 1) / (top + 1) * HIST_W)
+    sel = strip[:, a:b]
+    sel[sel[:, :, 0] > 0] = (0, 200, 255)
+    d[y:y + HIST_H, x:x + HIST_W] = strip
+    cv2.putText(d, f"{ch} {channel_pct(ch, lo, hi):.0f}%", (x + 2, y + 12),
+                cv2.FONT_HERSHEY_SIMPLEX, 0.4, (255, 255, 255), 1)
+
+def tint(color):
+    """bgr_d blended toward `color` once per layer (uint8 LUT, no per-frame float math)."""
+    return apply_lut(bgr_d, lut(color, 0.65))
+
+def render_frame(mask_d, tinted, p, name):
+    """Preview frame from a display-sized mask."""
     d = bgr_d.copy()
-    ms = cv2.resize(mask, (DW, DH), interpolation=cv2.INTER_NEAREST)
-    m = ms > 0
-    d[m] = np.clip(bgr_d[m].astype(int) * 0.35 + np.array(color) * 0.65, 0, 255).astype(np.uint8)
+    np.copyto(d, tinted, where=(mask_d > 0)[:, :, None])
     # boundary box
     y0 = int(DH * p["y_min"] / 100)
     y1 = int(DH * p["y_max"] / 100)
     x0 = int(DW * p["x_min"] / 100)
     x1 = int(DW * p["x_max"] / 100)
     cv2.rectangle(d, (x0, y0), (x1, y1), (0, 255, 255), 2)
-    pct = mask.sum() / 255 / (IH * IW) * 100
+    pct = coverage(p)
     # HUD text
     cv2.rectangle(d, (0, 0), (DW, 70), (0, 0, 0), -1)
-    cv2.putText(d, f"Layer: {name}   Coverage: {pct:.1f}%", (10, 28),
+    cv2.putText(d, f"Layer: {name}   Coverage: ~{pct:.1f}%", (10, 28),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.85, (0, 255, 255), 2)
     cv2.putText(d, "[ S ] Save    [ N ] Next layer    [ Q ] Quit", (10, 58),
                 cv2.FONT_HERSHEY_SIMPLEX, 0.75, (255, 255, 255), 2)
+    for k, ch in enumerate(("H", "S", "V")):
+        draw_hist(d, ch, p[f"{ch}_min"], p[f"{ch}_max"],
+                  DW - 3 * (HIST_W + 8) + k * (HIST_W + 8), 13)
     return d
 
 def save_layer(mask, color, name):
-    k30 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (30, 30))
-    k18 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (18, 18))
-    m2 = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, k30)
-    m2 = cv2.morphologyEx(m2, cv2.MORPH_DILATE, k18)
+    m2 = morph(mask, "close", 30, MORPH)
+    m2 = morph(m2, "dilate", 18, MORPH)
     result = bgr.copy()
-    mm = m2 > 0
-    result[mm] = np.clip(bgr[mm].astype(int) * 0.35 + np.array(color) * 0.65, 0, 255).astype(np.uint8)
+    tint_into(result, m2, lut(color, 0.65))
     path = os.path.join(OUT, f"{name}.png")
     cv2.imwrite(path, result)
     pct = m2.sum() / 255 / (IH * IW) * 100
@@ -108,6 +168,7 @@ def run(layer_idx):
     name  = layer["name"]
     color = layer["color"]
     p = {k: layer[k] for k in layer if k not in ("name","color")}
+    tinted = tint(color)
 
     WIN = f"Tuner [{layer_idx+1}/4]: {name}"
     cv2.namedWindow(WIN, cv2.WINDOW_NORMAL)
@@ -124,6 +185,7 @@ def run(layer_idx):
     print(f"\n>>> Layer {layer_idx+1}: {name}")
     print("    S=Save  N=Next layer  Q=Quit\n")
 
+    last = None   # slider values of the frame on screen
     while True:
         # Closed by X button?
         try:
@@ -139,9 +201,12 @@ def run(layer_idx):
             except:
                 break
 
-        mask  = build_mask(p)
-        frame = render_frame(mask, color, p, name)
-        cv2.imshow(WIN, frame)
+        # Dirty tracking: rebuild the proxy mask + frame only when a slider moved
+        state = tuple(p[sl] for sl, _, _ in SLIDERS)
+        if state != last:
+            last = state
+            mask_d = build_mask(p, Hd, Sd, Vd)
+            cv2.imshow(WIN, render_frame(mask_d, tinted, p, name))
 
         key = cv2.waitKey(30) & 0xFF
         if key in (ord('q'), ord('Q'), 27):   # Q or ESC
@@ -151,7 +216,7 @@ def run(layer_idx):
             cv2.destroyWindow(WIN)
             break
         elif key in (ord('s'), ord('S')):
-            save_layer(mask, color, name)
+            save_layer(build_mask(p), color, name)   # full res only here
         elif key in (ord('n'), ord('N')):
             cv2.destroyWindow(WIN)
             cv2.waitKey(100)
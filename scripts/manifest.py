@@ -0,0 +1,51 @@
+"""
+manifest.py
+Content-hash manifest for incremental asset builds (crop_layers.py).
+
+Each entry records what a source produced last time — its hash, the crop
+bbox and the hash of the written output — so a rebuild can tell an
+unchanged layer (skip), a changed one (redo + patch the report) and a
+vanished one (delete its output) apart without decoding anything.
+"""
+import os
+import json
+import hashlib
+
+CHUNK = 1 << 20
+
+
+def file_hash(path):
+    """sha1 of the file content, read in 1 MB chunks."""
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(CHUNK), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+class Manifest:
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.entries = json.load(f).get("entries", {})
+
+    def get(self, key):
+        return self.entries.get(key)
+
+    def put(self, key, **info):
+        self.entries[key] = info
+
+    def drop(self, key):
+        return self.entries.pop(key, None)
+
+    def up_to_date(self, key, src_hash, out_path):
+        """True when `key` was built from this exact source and its output is intact."""
+        e = self.entries.get(key)
+        return (e is not None and e.get("source_hash") == src_hash
+                and os.path.exists(out_path) and file_hash(out_path) == e.get("output_hash"))
+
+    def save(self):
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"version": 1, "entries": self.entries}, f, indent=2, sort_keys=True)
@@ -0,0 +1,133 @@
+"""
+morphology.py
+Close / dilate / erode / open with large elliptical kernels (split_layers.py,
+layer_tuner.py), with two strategies:
+
+    exact      cv2.morphologyEx with the full ellipse — the reference.
+    separable  ellipse ≈ octagon = square ⊕ diamond.  The square is a
+               rectangle kernel (OpenCV runs it as separate row/column
+               passes), the diamond is a few 3x3-cross iterations, so the
+               cost no longer grows with the kernel area.
+
+accuracy() measures a strategy against the exact result; running this file
+prints time + accuracy of each strategy on a mask:
+
+    python morphology.py [mask.png] [--op close] [--size 50]
+"""
+import sys
+import time
+import argparse
+import cv2
+import numpy as np
+
+STRATEGIES = ("exact", "separable")
+OPS = {"close": cv2.MORPH_CLOSE, "open": cv2.MORPH_OPEN,
+       "dilate": cv2.MORPH_DILATE, "erode": cv2.MORPH_ERODE}
+CROSS = cv2.getStructuringElement(cv2.MORPH_CROSS, (3, 3))
+
+
+def ellipse(size):
+    return cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (size, size))
+
+
+def morph(mask, op, size, strategy="exact"):
+    """Apply `op` ("close", "open", "dilate", "erode") with a size×size
+    elliptical kernel to a 0/255 uint8 mask using `strategy`."""
+    if strategy == "exact" or size < 3:
+        return cv2.morphologyEx(mask, OPS[op], ellipse(size))
+    if strategy == "separable":
+        return _separable(mask, op, size)
+    raise ValueError(f"unknown morphology strategy: {strategy}")
+
+
+# ── Separable (octagon) ──────────────────────────────────────────────────────
+def _octagon(size):
+    """(square half-side a, diamond radius b) whose sum best fits the ellipse.
+
+    An octagon square(a) ⊕ diamond(b) reaches a + b along the axes and
+    (a + b/2)·√2 along the diagonals; a ≈ (√2 − 1)·r makes both ≈ r.
+    """
+    r = (size - 1) / 2
+    a = int(round(r * (np.sqrt(2) - 1)))
+    return a, max(0, int(round(r)) - a)
+
+
+def _minmax(mask, a, b, fn):
+    out = fn(mask, cv2.getStructuringElement(cv2.MORPH_RECT, (2 * a + 1, 2 * a + 1)))
+    return fn(out, CROSS, iterations=b) if b else out
+
+
+def _separable(mask, op, size):
+    a, b = _octagon(size)
+    dil = lambda m: _minmax(m, a, b, cv2.dilate)
+    ero = lambda m: _minmax(m, a, b, cv2.erode)
+    return {"dilate": dil, "erode": ero,
+            "close": lambda m: ero(dil(m)), "open": lambda m: dil(ero(m))}[op](mask)
+
+
+# ── Accuracy ─────────────────────────────────────────────────────────────────
+def accuracy(approx, exact):
+    """How far `approx` is from `exact` (both 0/255 masks).
+
+    iou        |A ∩ E| / |A ∪ E| of the foreground (1.0 = identical)
+    wrong_px   pixels that differ;  wrong_pct  as % of the frame
+    max_err    farthest a wrong pixel lies from the exact boundary (px)
+    """
+    a, e = approx > 0, exact > 0
+    diff = a != e
+    union = np.count_nonzero(a | e)
+    wrong = int(np.count_nonzero(diff))
+    max_err = 0.0
+    if wrong:
+        # distance of each pixel to the other side of the exact mask
+        inside = cv2.distanceTransform(e.astype(np.uint8), cv2.DIST_L2, 5)
+        outside = cv2.distanceTransform((~e).astype(np.uint8), cv2.DIST_L2, 5)
+        max_err = float(np.maximum(inside, outside)[diff].max())
+    return {
+        "iou": 1.0 if not union else np.count_nonzero(a & e) / union,
+        "wrong_px": wrong,
+        "wrong_pct": wrong / diff.size * 100,
+        "max_err": max_err,
+    }
+
+
+# ── CLI: compare the strategies ──────────────────────────────────────────────
+def _demo_mask(W=2816, H=1536, seed=0):
+    """Blobby 0/255 mask with holes and specks, background.png-sized."""
+    rng = np.random.default_rng(seed)
+    noise = cv2.GaussianBlur(rng.random((H // 8, W // 8)).astype(np.float32), (0, 0), 2)
+    noise = cv2.resize(noise, (W, H), interpolation=cv2.INTER_CUBIC)
+    speck = rng.random((H, W)) < 0.002
+    return np.where((noise > noise.mean()) ^ speck, 255, 0).astype(np.uint8)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("mask", nargs="?", help="mask image (non-zero = foreground); default: synthetic")
+    ap.add_argument("--op", choices=list(OPS), default="close")
+    ap.add_argument("--size", type=int, default=50)
+    args = ap.parse_args()
+
+    if args.mask:
+        mask = cv2.imread(args.mask, cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            print(f"Cannot load {args.mask}")
+            return 1
+        mask = np.where(mask > 0, 255, 0).astype(np.uint8)
+    else:
+        mask = _demo_mask()
+    print(f"mask {mask.shape[1]}x{mask.shape[0]}  {args.op} ellipse {args.size}px\n")
+
+    results = {}
+    for s in STRATEGIES:
+        t0 = time.perf_counter()
+        results[s] = morph(mask, args.op, args.size, s)
+        dt = time.perf_counter() - t0
+        acc = accuracy(results[s], results["exact"])
+        print(f"  {s:10s} {dt * 1000:8.1f} ms   IoU {acc['iou']:.5f}   "
+              f"wrong {acc['wrong_px']:8d} px ({acc['wrong_pct']:.3f}%)   max err {acc['max_err']:.1f} px")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,180 @@
+"""
+pack_atlas.py
+Gộp các layer nhánh (branch A–E, lv1..lv4) đã crop thành một vài atlas
+→ public/pic_layers/atlas/atlas_K.png, và ghi tọa độ vào pic_layers_report.json.
+
+Chạy sau crop_layers.py: python pack_atlas.py [--max-size 4096] [--padding 2]
+                                              [--sources 7.png 8.png ...]
+                                              [--profile fast|release|palette]
+  Mỗi ảnh nguồn chỉ được xếp một lần (các entry branch_B..E_* dùng chung
+  layer_7..10.png).  Xếp bằng MaxRects (best short side fit), ảnh lớn trước;
+  hết chỗ thì mở atlas mới.  Mỗi entry được thêm
+      "atlas": {"index": K, "x": .., "y": .., "w": .., "h": ..}
+  và report có thêm "atlases": [{"src": "atlas/atlas_K.png", "width", "height"}].
+  TreeCanvas vẽ entry có "atlas" bằng một <svg viewBox> cắt đúng vùng đó.
+  --profile: cách nén PNG của atlas (encode.py, như crop_layers.py), mặc định
+  release; các atlas được encode song song trên thread pool.
+"""
+import os
+import re
+import sys
+import glob
+import json
+import argparse
+from PIL import Image
+
+from encode import DEFAULT_PROFILE, PROFILES, Encoder
+from paths import path
+
+Image.MAX_IMAGE_PIXELS = None
+
+OUT_DIR = path("pic_layers", r"d:\CRM WEB\team-progress-tracker\public\pic_layers")
+REPORT_DIR = path("report_dir", r"d:\CRM WEB\team-progress-tracker\scripts")
+REPORT_PATH = os.path.join(REPORT_DIR, "pic_layers_report.json")
+ATLAS_SUBDIR = "atlas"
+
+# Giống classifyLayer() trong TreeCanvas.tsx
+BRANCH_ID = re.compile(r"^branch_([A-E])_lv(\d)_")
+BRANCH_A_SOURCES = {"7.png", "8.png", "9.png", "10.png"}
+
+
+def is_branch(l):
+    return bool(BRANCH_ID.match(l["id"])) or l.get("source") in BRANCH_A_SOURCES
+
+
+# ── MaxRects ──────────────────────────────────────────────────────────────────
+class MaxRects:
+    """One bin; free space kept as maximal (possibly overlapping) rectangles."""
+
+    def __init__(self, width, height):
+        self.width, self.height = width, height
+        self.free = [(0, 0, width, height)]
+        self.used_w = self.used_h = 0
+
+    def insert(self, w, h):
+        """Place a w×h rect (best short side fit) → (x, y), or None if it doesn't fit."""
+        best, best_key = None, None
+        for fx, fy, fw, fh in self.free:
+            if w <= fw and h <= fh:
+                key = (min(fw - w, fh - h), max(fw - w, fh - h))
+                if best_key is None or key < best_key:
+                    best, best_key = (fx, fy), key
+        if best is None:
+            return None
+        self._place(best[0], best[1], w, h)
+        self.used_w = max(self.used_w, best[0] + w)
+        self.used_h = max(self.used_h, best[1] + h)
+        return best
+
+    def _place(self, x, y, w, h):
+        new_free = []
+        for fx, fy, fw, fh in self.free:
+            if x >= fx + fw or x + w <= fx or y >= fy + fh or y + h <= fy:
+                new_free.append((fx, fy, fw, fh))
+                continue
+            # split the overlapped free rect into up to 4 maximal pieces
+            if x > fx:
+                new_free.append((fx, fy, x - fx, fh))
+            if x + w < fx + fw:
+                new_free.append((x + w, fy, fx + fw - x - w, fh))
+            if y > fy:
+                new_free.append((fx, fy, fw, y - fy))
+            if y + h < fy + fh:
+                new_free.append((fx, y + h, fw, fy + fh - y - h))
+        # prune rects contained in another one
+        self.free = [a for i, a in enumerate(new_free)
+                     if not any(i != j and _contains(b, a) and (a != b or j < i)
+                                for j, b in enumerate(new_free))]
+
+
+def _contains(a, b):
+    """True when rect a fully contains rect b."""
+    return (a[0] <= b[0] and a[1] <= b[1]
+            and a[0] + a[2] >= b[0] + b[2] and a[1] + a[3] >= b[1] + b[3])
+
+
+def pack(sizes, max_size, padding):
+    """sizes: {key: (w, h)} → ({key: (bin, x, y)}, [(used_w, used_h)] per bin)."""
+    bins, placed = [], {}
+    order = sorted(sizes, key=lambda k: (max(sizes[k]), min(sizes[k])), reverse=True)
+    for k in order:
+        w, h = sizes[k][0] + padding, sizes[k][1] + padding
+        if w > max_size or h > max_size:
+            raise ValueError(f"{k} ({sizes[k][0]}x{sizes[k][1]}) lớn hơn atlas {max_size}px")
+        for b, mr in enumerate(bins):
+            pos = mr.insert(w, h)
+            if pos is not None:
+                break
+        else:
+            bins.append(MaxRects(max_size, max_size))
+            b, pos = len(bins) - 1, bins[-1].insert(w, h)
+        placed[k] = (b, pos[0], pos[1])
+    return placed, [(mr.used_w, mr.used_h) for mr in bins]
+
+
+# ── Main ──────────────────────────────────────────────────────────────────────
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--max-size", type=int, default=4096,
+                    help="max atlas width/height in px")
+    ap.add_argument("--padding", type=int, default=2,
+                    help="transparent gap between packed layers (avoids filtering bleed)")
+    ap.add_argument("--sources", nargs="+",
+                    help="pack these sources instead of the branch layers")
+    ap.add_argument("--profile", choices=list(PROFILES), default=DEFAULT_PROFILE,
+                    help="PNG compression profile of the atlas sheets (encode.py)")
+    args = ap.parse_args()
+
+    with open(REPORT_PATH, encoding="utf-8") as f:
+        report = json.load(f)
+    layers = report["layers"]
+    for l in layers:
+        l.pop("atlas", None)
+
+    wanted = set(args.sources) if args.sources else {l["source"] for l in layers if is_branch(l)}
+    images = {}
+    for src in sorted(wanted, key=lambda s: int(s.split(".")[0])):
+        path = os.path.join(OUT_DIR, f"layer_{src}")
+        if not os.path.exists(path):
+            print(f"[{src}] không có layer_{src}, bỏ qua.")
+            continue
+        images[src] = Image.open(path)
+
+    atlas_dir = os.path.join(OUT_DIR, ATLAS_SUBDIR)
+    os.makedirs(atlas_dir, exist_ok=True)
+    for old in glob.glob(os.path.join(atlas_dir, "atlas_*.png")):
+        os.remove(old)
+
+    placed, used = pack({s: im.size for s, im in images.items()}, args.max_size, args.padding)
+
+    atlases = []
+    with Encoder(args.profile) as encoder:      # the report is written once every sheet is
+        for b, (w, h) in enumerate(used):
+            # padding sits right/below each rect, so the last one's gap can be trimmed
+            sheet = Image.new("RGBA", (w - args.padding, h - args.padding), (0, 0, 0, 0))
+            for src, (sb, x, y) in placed.items():
+                if sb == b:
+                    sheet.paste(images[src].convert("RGBA"), (x, y))
+            name = f"atlas_{b}.png"
+            encoder.save(sheet, os.path.join(atlas_dir, name))
+            atlases.append({"src": f"{ATLAS_SUBDIR}/{name}", "width": sheet.width, "height": sheet.height})
+            n = sum(1 for sb, _, _ in placed.values() if sb == b)
+            print(f"{name}: {sheet.width}x{sheet.height}, {n} layer")
+
+    for l in layers:
+        if l.get("source") in placed:
+            b, x, y = placed[l["source"]]
+            w, h = images[l["source"]].size
+            l["atlas"] = {"index": b, "x": x, "y": y, "w": w, "h": h}
+    report["atlases"] = atlases
+
+    with open(REPORT_PATH, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+
+    n_entries = sum(1 for l in layers if "atlas" in l)
+    print(f"\n✅ {len(placed)} ảnh nguồn ({n_entries} entry) → {len(atlases)} atlas tại: {atlas_dir}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,60 @@
+"""
+paths.py
+Paths of the asset pipeline, taken from the "paths" block of pipeline.json.
+
+Values may reference other keys ("{root}\\public"); they are expanded
+recursively.  The config is $PIPELINE_CONFIG when set (pipeline.py sets it
+for the stages it runs), else scripts/pipeline.json.  Each script keeps its
+old hard-coded path as the default, so it still runs when the key or the
+whole file is missing.
+
+    SRC_DIR = path("pic_tree", r"D:\\CRM WEB\\PIC-TREE")
+"""
+import os
+import re
+import json
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+CONFIG_ENV = "PIPELINE_CONFIG"
+DEFAULT_CONFIG = os.path.join(HERE, "pipeline.json")
+_REF = re.compile(r"\{(\w+)\}")
+
+_config = None
+
+
+def config_path():
+    return os.environ.get(CONFIG_ENV) or DEFAULT_CONFIG
+
+
+def load_config(path=None):
+    """The whole pipeline config ({} when the file doesn't exist)."""
+    path = path or config_path()
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def expand(text, paths, _seen=()):
+    """Replace every {key} in text with the (expanded) value of paths[key]."""
+    def sub(m):
+        key = m.group(1)
+        if key not in paths:
+            raise KeyError(f"unknown path key {{{key}}} in {text!r}")
+        if key in _seen:
+            raise ValueError(f"circular path key {{{key}}}")
+        return expand(paths[key], paths, _seen + (key,))
+    return _REF.sub(sub, text)
+
+
+def resolve(paths):
+    """{key: fully expanded path} for a "paths" block."""
+    return {k: expand(v, paths, (k,)) for k, v in paths.items()}
+
+
+def path(key, default):
+    """Configured path for key, or default."""
+    global _config
+    if _config is None:
+        _config = resolve(load_config().get("paths", {}))
+    return _config.get(key, default)
@@ -0,0 +1,304 @@
+"""
+pipeline.py
+Một lệnh chạy toàn bộ pipeline ảnh theo pipeline.json.
+
+Chạy: python pipeline.py [stage ...] [--config pipeline.json] [--jobs 4]
+                         [--force] [--dry-run] [--list]
+  Mỗi stage là một script trong scripts/ với inputs / outputs / updates khai
+  báo (glob, có thể dùng {key} của block "paths"):
+      outputs  file stage tạo ra — mỗi file chỉ một stage được khai báo
+               (trùng là lỗi khi nạp config)
+      updates  file stage sửa tại chỗ (vd. hit_index, pack_atlas sửa
+               pic_layers_report.json); phải là output của một stage trước
+  Hai pattern "trùng" nhau khi một pattern khớp pattern kia như một đường
+  dẫn (vd. {layers_out}/*.png và {layers_out}/layer_*.png) hoặc khi chúng
+  khớp chung một file đang có trên đĩa.  Stage B phụ thuộc stage A đứng
+  TRƯỚC nó khi input/updates của B trùng outputs/updates của A, hoặc khi B
+  ghi "after": ["A"]; input trùng output của một stage đứng SAU là lỗi.
+  Input không stage nào tạo ra là file nguồn: không khớp file nào thì stage
+  lỗi luôn.  Các stage độc lập chạy song song (--jobs process con); stage lỗi
+  thì các stage phía sau nó bị bỏ qua.
+
+  Cache (scripts/.cache/pipeline.json): key của stage = sha1 của mã nguồn
+  script + các module scripts/ nó import, args, và hash nội dung mọi input.
+  Key khớp lần chạy trước và outputs còn đủ → bỏ qua.  Hash file được nhớ
+  theo (size, mtime), nên một lần build không đổi gì chỉ stat file.  Sau khi
+  chạy xong, key của mọi stage thành công được tính lại trên trạng thái cuối,
+  nên các stage sửa file tại chỗ (hit_index, pack_atlas) không tự kích hoạt
+  lại nhau ở lần sau.
+
+  Tên stage trên dòng lệnh = chỉ chạy các stage đó cùng các stage chúng phụ
+  thuộc.  Script nhận đường dẫn qua paths.py (biến môi trường
+  PIPELINE_CONFIG trỏ tới config đang dùng).  Log từng stage ở
+  scripts/.cache/pipeline_logs/<stage>.log.
+"""
+import os
+import re
+import sys
+import glob
+import json
+import fnmatch
+import time
+import hashlib
+import argparse
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from manifest import file_hash
+from paths import CONFIG_ENV, DEFAULT_CONFIG, HERE, expand, load_config, resolve
+
+CACHE_DIR = os.path.join(HERE, ".cache")
+CACHE_PATH = os.path.join(CACHE_DIR, "pipeline.json")
+LOG_DIR = os.path.join(CACHE_DIR, "pipeline_logs")
+_IMPORT = re.compile(r"^\s*(?:from\s+(\w+)\s+import|import\s+([\w, ]+))", re.M)
+
+
+# ── Config ───────────────────────────────────────────────────────────────────
+class Stage:
+    def __init__(self, spec, paths):
+        self.name = spec["name"]
+        self.script = spec["script"]
+        self.args = [expand(a, paths) for a in spec.get("args", [])]
+        self.inputs = [self._path(p, paths) for p in spec.get("inputs", [])]
+        self.outputs = [self._path(p, paths) for p in spec.get("outputs", [])]
+        self.updates = [self._path(p, paths) for p in spec.get("updates", [])]
+        self.after = list(spec.get("after", []))
+        self.deps = set()
+        self.sources = []       # inputs no earlier stage writes: must exist on disk
+
+    @staticmethod
+    def _path(pattern, paths):
+        p = os.path.normpath(expand(pattern, paths))
+        return p if os.path.isabs(p) else os.path.join(HERE, p)
+
+
+def overlap(a, b):
+    """True when glob patterns a and b can name the same file: one matches the
+    other taken as a path, or both match a file that exists now."""
+    a, b = os.path.normcase(a), os.path.normcase(b)
+    if a == b or fnmatch.fnmatchcase(a, b) or fnmatch.fnmatchcase(b, a):
+        return True
+    return bool({os.path.normcase(p) for p in glob.glob(a)}
+                & {os.path.normcase(p) for p in glob.glob(b)})
+
+
+def _hits(patterns, others):
+    return [(p, q) for p in patterns for q in others if overlap(p, q)]
+
+
+def load_stages(config):
+    """Stages in config order with .deps / .sources filled (deps only ever on
+    earlier stages); ValueError on duplicate outputs or a bad graph."""
+    paths = resolve(config.get("paths", {}))
+    stages = [Stage(s, paths) for s in config.get("stages", [])]
+    names = [s.name for s in stages]
+    if len(set(names)) != len(names):
+        raise ValueError("pipeline.json: stage names must be unique")
+    for i, s in enumerate(stages):
+        for a in s.after:
+            if a not in names[:i]:
+                raise ValueError(f"{s.name}: 'after' {a!r} is not an earlier stage")
+            s.deps.add(a)
+        for prev in stages[:i]:
+            dup = _hits(s.outputs, prev.outputs)
+            if dup:
+                raise ValueError(f"{prev.name} and {s.name} both write {dup[0][1]} "
+                                 "(give each a distinct path, or declare it in 'updates')")
+            if _hits(s.inputs + s.updates, prev.outputs + prev.updates):
+                s.deps.add(prev.name)
+        for later in stages[i + 1:]:
+            fwd = _hits(s.inputs + s.updates, later.outputs)
+            if fwd:
+                raise ValueError(f"{s.name} reads {fwd[0][0]}, which the later stage "
+                                 f"{later.name} writes; move {later.name} before it")
+        earlier = [q for prev in stages[:i] for q in prev.outputs + prev.updates]
+        for p in s.updates:
+            if not any(overlap(p, q) for q in earlier):
+                raise ValueError(f"{s.name}: updates {p}, which no earlier stage outputs")
+        s.sources = [p for p in s.inputs if not any(overlap(p, q) for q in earlier)]
+    return stages
+
+
+def select(stages, targets):
+    """Targets + everything they depend on, in config order."""
+    by_name = {s.name: s for s in stages}
+    unknown = [t for t in targets if t not in by_name]
+    if unknown:
+        raise ValueError(f"unknown stage(s): {', '.join(unknown)}")
+    keep, todo = set(), list(targets)
+    while todo:
+        n = todo.pop()
+        if n not in keep:
+            keep.add(n)
+            todo.extend(by_name[n].deps)
+    return [s for s in stages if s.name in keep]
+
+
+# ── Hashing ──────────────────────────────────────────────────────────────────
+class HashCache:
+    """file_hash() memoised on (size, mtime_ns); thread-safe."""
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.lock = threading.Lock()
+
+    def __call__(self, path):
+        st = os.stat(path)
+        stamp = [st.st_size, st.st_mtime_ns]
+        with self.lock:
+            e = self.entries.get(path)
+        if e and e[:2] == stamp:
+            return e[2]
+        h = file_hash(path)
+        with self.lock:
+            self.entries[path] = stamp + [h]
+        return h
+
+
+def code_files(script):
+    """The script plus every scripts/ module it imports, transitively."""
+    seen, todo = [], [script]
+    while todo:
+        name = todo.pop()
+        path = os.path.join(HERE, name)
+        if name in seen or not os.path.exists(path):
+            continue
+        seen.append(name)
+        with open(path, encoding="utf-8") as f:
+            for a, b in _IMPORT.findall(f.read()):
+                for mod in ([a] if a else [m.strip() for m in b.split(",")]):
+                    todo.append(f"{mod}.py")
+    return sorted(seen)
+
+
+def expand_inputs(stage):
+    files = []
+    for pattern in stage.inputs + stage.updates:
+        files += sorted(p for p in glob.glob(pattern) if os.path.isfile(p))
+    return files
+
+
+def stage_key(stage, hasher):
+    h = hashlib.sha1()
+    h.update(json.dumps({"script": stage.script, "args": stage.args,
+                         "outputs": stage.outputs}).encode())
+    for name in code_files(stage.script):
+        h.update(f"code {name} {hasher(os.path.join(HERE, name))}\n".encode())
+    for path in expand_inputs(stage):
+        h.update(f"in {path} {hasher(path)}\n".encode())
+    return h.hexdigest()
+
+
+def outputs_present(stage):
+    return all(glob.glob(p) for p in stage.outputs)
+
+
+# ── Run ──────────────────────────────────────────────────────────────────────
+def run_stage(stage, config_path, hasher, cached_key, force, dry_run):
+    """→ (status, seconds, detail); status in ran | cached | failed | would-run."""
+    t0 = time.perf_counter()
+    missing = [p for p in stage.sources if not glob.glob(p)]
+    if missing:
+        return "failed", time.perf_counter() - t0, "input không khớp file nào: " + ", ".join(missing)
+    key = stage_key(stage, hasher)
+    if not force and key == cached_key and outputs_present(stage):
+        return "cached", time.perf_counter() - t0, ""
+    if dry_run:
+        return "would-run", time.perf_counter() - t0, ""
+    env = dict(os.environ, **{CONFIG_ENV: config_path, "PYTHONIOENCODING": "utf-8"})
+    log_path = os.path.join(LOG_DIR, f"{stage.name}.log")
+    with open(log_path, "w", encoding="utf-8") as log:
+        rc = subprocess.run([sys.executable, stage.script, *stage.args], cwd=HERE,
+                            env=env, stdout=log, stderr=subprocess.STDOUT).returncode
+    if rc != 0:
+        with open(log_path, encoding="utf-8", errors="replace") as f:
+            tail = "".join(f.readlines()[-15:])
+        return "failed", time.perf_counter() - t0, f"exit {rc}, log {log_path}\n{tail}"
+    return "ran", time.perf_counter() - t0, ""
+
+
+def run(stages, config_path, jobs, force=False, dry_run=False):
+    os.makedirs(LOG_DIR, exist_ok=True)
+    cache = {"files": {}, "stages": {}}
+    if os.path.exists(CACHE_PATH):
+        with open(CACHE_PATH, encoding="utf-8") as f:
+            cache.update(json.load(f))
+    hasher = HashCache(cache["files"])
+
+    by_name = {s.name: s for s in stages}
+    status = {}
+    pending = list(stages)
+    running = {}
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as pool:
+        while pending or running:
+            for s in list(pending):
+                if any(status.get(d) in ("failed", "blocked") for d in s.deps):
+                    status[s.name] = "blocked"
+                    pending.remove(s)
+                    print(f"  –  {s.name:18s} bỏ qua (stage phụ thuộc lỗi)")
+                elif all(d in status for d in s.deps):
+                    # dry run: an upstream stage that would rewrite files makes this one stale
+                    stale = dry_run and any(status[d] == "would-run"
+                                            and (by_name[d].outputs or by_name[d].updates)
+                                            for d in s.deps)
+                    pending.remove(s)
+                    running[pool.submit(run_stage, s, config_path, hasher,
+                                        cache["stages"].get(s.name), force or stale, dry_run)] = s
+            if not running:
+                continue
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for fut in done:
+                s = running.pop(fut)
+                st, secs, detail = fut.result()
+                status[s.name] = st
+                mark = {"ran": "✓", "cached": "=", "failed": "✗", "would-run": "?"}[st]
+                print(f"  {mark}  {s.name:18s} {st:9s} {secs:7.2f}s")
+                if detail:
+                    print("     " + detail.replace("\n", "\n     "))
+
+    if not dry_run:
+        # keys from the final state: in-place updaters don't invalidate each other
+        for s in stages:
+            if status.get(s.name) in ("ran", "cached"):
+                cache["stages"][s.name] = stage_key(s, hasher)
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(CACHE_PATH, "w", encoding="utf-8") as f:
+            json.dump(cache, f, indent=1, sort_keys=True)
+    return status
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("stages", nargs="*", help="stages to build (default: all)")
+    ap.add_argument("--config", default=os.environ.get(CONFIG_ENV) or DEFAULT_CONFIG)
+    ap.add_argument("--jobs", type=int, default=min(4, os.cpu_count() or 1),
+                    help="stages running at the same time")
+    ap.add_argument("--force", action="store_true", help="ignore the cache")
+    ap.add_argument("--dry-run", action="store_true", help="only show what would run")
+    ap.add_argument("--list", action="store_true", help="print the stage graph and exit")
+    args = ap.parse_args()
+
+    config_path = os.path.abspath(args.config)
+    stages = load_stages(load_config(config_path))
+    if args.list:
+        for s in stages:
+            deps = ", ".join(sorted(s.deps)) or "-"
+            print(f"  {s.name:18s} ← {deps}")
+        return 0
+    stages = select(stages, args.stages) if args.stages else stages
+
+    print(f"Pipeline: {len(stages)} stage, {args.jobs} song song, config {config_path}\n")
+    t0 = time.perf_counter()
+    status = run(stages, config_path, args.jobs, args.force, args.dry_run)
+    counts = {k: list(status.values()).count(k)
+              for k in ("ran", "would-run", "cached", "failed", "blocked")}
+    ran = f"{counts['would-run']} sẽ chạy" if args.dry_run else f"{counts['ran']} chạy"
+    print(f"\n{'✅' if not counts['failed'] else '⚠'} {time.perf_counter() - t0:.2f}s — "
+          f"{ran}, {counts['cached']} cache, "
+          f"{counts['failed']} lỗi, {counts['blocked']} bỏ qua")
+    return 1 if counts["failed"] or counts["blocked"] else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,92 @@
+"""
+png_meta.py
+Header-only PNG metadata: size, bit depth, colour type, alpha — without
+decoding (or even reading) the image data.
+
+The PNG signature is followed by the IHDR chunk (width, height, bit depth,
+colour type), so the first 33 bytes are enough for everything but tRNS.
+Alpha is known from the colour type (4 = gray+alpha, 6 = RGBA); for the
+others the chunk headers before the first IDAT are walked with seek() to
+look for a tRNS chunk, which only costs a few 8-byte reads.  Directory
+scans run the files on a thread pool, so network shares are bound by
+latency, not by the size of the art.
+
+    info = read_png("1.png")       # {"width", "height", "bit_depth", ...}
+    infos = scan_dir(r"D:\\CRM WEB\\PIC-TREE")
+"""
+import os
+import struct
+from concurrent.futures import ThreadPoolExecutor
+
+PNG_SIG = b"\x89PNG\r\n\x1a\n"
+COLOR_TYPES = {0: "gray", 2: "rgb", 3: "palette", 4: "gray+alpha", 6: "rgba"}
+ALPHA_TYPES = {4, 6}
+MAX_PRE_IDAT_CHUNKS = 64        # give up looking for tRNS after this many chunks
+
+
+def read_png(path):
+    """IHDR fields of a PNG file; raises ValueError for anything that isn't one."""
+    with open(path, "rb") as f:
+        head = f.read(33)
+        if len(head) < 33 or head[:8] != PNG_SIG or head[12:16] != b"IHDR":
+            raise ValueError(f"{path}: không phải PNG (thiếu chữ ký / IHDR)")
+        w, h, depth, ctype, _, _, interlace = struct.unpack(">IIBBBBB", head[16:29])
+        if ctype not in COLOR_TYPES:
+            raise ValueError(f"{path}: color type {ctype} không hợp lệ")
+        trns = False
+        if ctype not in ALPHA_TYPES:
+            for _ in range(MAX_PRE_IDAT_CHUNKS):
+                hdr = f.read(8)
+                if len(hdr) < 8:
+                    break
+                length, kind = struct.unpack(">I4s", hdr)
+                if kind in (b"tRNS", b"IDAT", b"IEND"):
+                    trns = kind == b"tRNS"
+                    break
+                f.seek(length + 4, os.SEEK_CUR)      # data + CRC
+    return {
+        "path": path,
+        "width": w, "height": h,
+        "bit_depth": depth,
+        "color_type": COLOR_TYPES[ctype],
+        "alpha": ctype in ALPHA_TYPES or trns,
+        "interlaced": bool(interlace),
+    }
+
+
+def png_size(path):
+    """(width, height) from the IHDR only."""
+    info = read_png(path)
+    return info["width"], info["height"]
+
+
+def _read(path):
+    try:
+        return read_png(path)
+    except (OSError, ValueError) as e:
+        return {"path": path, "error": str(e)}
+
+
+def scan(paths, workers=8):
+    """read_png over paths on a thread pool, in input order; unreadable files
+    give {"path", "error"} instead of raising."""
+    paths = list(paths)
+    if len(paths) <= 1 or workers <= 1:
+        return [_read(p) for p in paths]
+    with ThreadPoolExecutor(max_workers=min(workers, len(paths))) as pool:
+        return list(pool.map(_read, paths))
+
+
+def scan_dir(directory, workers=8):
+    """Every *.png directly in directory, sorted by name (numerically when the
+    stem is a number: 2.png before 10.png)."""
+    names = [n for n in os.listdir(directory) if n.lower().endswith(".png")]
+    stem = lambda n: os.path.splitext(n)[0]
+    names.sort(key=lambda n: (0, int(stem(n)), n) if stem(n).isdigit() else (1, 0, n))
+    return scan((os.path.join(directory, n) for n in names), workers)
+
+
+def size_mismatches(infos, ref):
+    """Entries of infos whose (width, height) differ from ref's."""
+    size = (ref["width"], ref["height"])
+    return [i for i in infos if "error" not in i and (i["width"], i["height"]) != size]
@@ -0,0 +1,95 @@
+"""
+pyramid.py
+Multi-resolution copies of a cropped layer for the frontend (crop_layers.py).
+
+The 1x level is the lossless cropped PNG itself (layer_N.png), so full-zoom
+rendering shows the original pixels.  Each smaller level halves the previous
+one with a 2x2 box filter on premultiplied alpha (so transparent pixels don't
+bleed dark fringes into the edges) and is encoded lossy:
+
+    layer_N.png      1x     layer_N@4.webp   1/4
+    layer_N@2.webp   1/2    layer_N@8.webp   1/8
+
+AVIF is used when Pillow can write it, WebP otherwise.  build_pyramid()
+returns the level list that goes into pic_layers_report.json, largest
+first, so TreeCanvas can pick the smallest level that still covers its
+on-screen size.
+"""
+import os
+import glob
+from PIL import features
+
+LEVELS = (1, 2, 4, 8)
+SUBDIR = "pyramid"
+QUALITY = 80
+
+
+def pyramid_format():
+    return "avif" if features.check("avif") else "webp"
+
+
+def level_files(stem, fmt, levels=LEVELS):
+    """Files of the reduced levels (every level but 1x)."""
+    return [os.path.join(SUBDIR, f"{stem}@{d}.{fmt}") for d in levels if d > 1]
+
+
+def _in_subdir(level):
+    return level["src"].startswith(SUBDIR + "/")
+
+
+def _save(img, path, **params):
+    img.save(path, **params)
+
+
+def build_pyramid(img, out_dir, stem, full_src, fmt=None, levels=LEVELS, quality=QUALITY,
+                  save=_save):
+    """Write the reduced levels of `img` under out_dir/pyramid/ → list of
+    level dicts.  full_src is img's own lossless file, relative to out_dir
+    (crop_layers' layer_N.png); it is the 1x level and is not re-encoded.
+
+    save(img, path, **params) writes one level; pass Encoder.save to encode
+    the levels on a thread pool (the files exist once the encoder is waited on)."""
+    fmt = fmt or pyramid_format()
+    os.makedirs(os.path.join(out_dir, SUBDIR), exist_ok=True)
+
+    result = [{"src": full_src, "scale": 1, "width": img.width, "height": img.height}]
+    cur, cur_div = img.convert("RGBa"), 1
+    for div, rel in zip([d for d in levels if d > 1], level_files(stem, fmt, levels)):
+        while cur_div < div and min(cur.size) > 1:
+            cur, cur_div = cur.reduce(2), cur_div * 2
+        save(cur.convert("RGBA"), os.path.join(out_dir, rel), quality=quality)
+        result.append({
+            "src": rel.replace(os.sep, "/"),
+            "scale": 1 / div,
+            "width": cur.width,
+            "height": cur.height
+        })
+
+    # Level files of an older build in another format / level set
+    keep = {os.path.normpath(os.path.join(out_dir, l["src"])) for l in result}
+    for old in glob.glob(os.path.join(out_dir, SUBDIR, f"{stem}@*")):
+        if os.path.normpath(old) not in keep:
+            os.remove(old)
+    return result
+
+
+def remove_pyramid(out_dir, levels):
+    """Delete the reduced level files (never the 1x source PNG)."""
+    for l in levels or []:
+        if not _in_subdir(l):
+            continue
+        path = os.path.join(out_dir, l["src"])
+        if os.path.exists(path):
+            os.remove(path)
+
+
+def pyramid_intact(out_dir, levels, full_src, fmt=None):
+    """True when the 1x level is full_src and every reduced level exists in
+    the current format (an older build with an encoded 1x level is not)."""
+    fmt = fmt or pyramid_format()
+    reduced = [l for l in levels or [] if l["scale"] != 1]
+    return (any(l["scale"] == 1 and l["src"] == full_src for l in levels or [])
+            and bool(reduced) and all(
+                _in_subdir(l) and l["src"].endswith("." + fmt)
+                and os.path.exists(os.path.join(out_dir, l["src"]))
+                for l in reduced))
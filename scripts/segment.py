@@ -0,0 +1,152 @@
+"""
+segment.py
+Strip-streaming helpers for the segmentation scripts (analyze_tree.py,
+refine_layers.py).
+
+Instead of building every mask at full size, the scripts walk the image in
+row bands and label each band with the compiled layer rules:
+
+    with LayerWriters(paths, W, H) as out:
+        for y0, band in iter_bands(img, BAND_ROWS):
+            label = RULES.label_rgb(band, y0, H, W)
+            mask = RULES.mask(label, name)
+            stats[name].update(y0, mask)
+            out.write(name, band, mask)
+
+Zones (root_zone, rain_zone, ...) are fractional rectangles rather than
+full-frame bool arrays, so they cost nothing per band.  LayerStats merges the
+pixel count, bbox and per-row left/right extents band by band, and every
+layer PNG is encoded band by band (encode.PngStream) as the pass goes; see
+"Layer export" for what is still frame-sized.
+"""
+import numpy as np
+from PIL import Image
+
+from encode import PngStream
+
+DEFAULT_BAND_ROWS = 512
+
+
+# ── Zones ────────────────────────────────────────────────────────────────────
+def zone_rect(zone, H, W):
+    """Fractional zone (y0, y1, x0, x1) → pixel rect, rounded like the old
+    `zone[int(H*0.55):, :] = True` slicing."""
+    fy0, fy1, fx0, fx1 = zone
+    return int(H * fy0), int(H * fy1), int(W * fx0), int(W * fx1)
+
+
+# ── Band reader ──────────────────────────────────────────────────────────────
+def iter_bands(img, band_rows=DEFAULT_BAND_ROWS):
+    """Yield (y0, RGBA uint8 band) over a PIL image, top to bottom.
+
+    The source keeps its native mode; only the current band is converted to
+    RGBA and copied into numpy.  `band_rows` of 0/None yields one full band.
+    """
+    W, H = img.size
+    step = band_rows or H
+    for y0 in range(0, H, step):
+        y1 = min(H, y0 + step)
+        yield y0, np.asarray(img.crop((0, y0, W, y1)).convert("RGBA"))
+
+
+# ── Incremental layer statistics ─────────────────────────────────────────────
+class LayerStats:
+    """Pixel count + per-row [first, last] column of a mask, fed band by band.
+
+    Per layer this holds 2 × H int32, never a frame-sized array.
+    """
+
+    def __init__(self, H, W):
+        self.H, self.W = H, W
+        self.count = 0
+        self.row_min = np.full(H, -1, dtype=np.int32)
+        self.row_max = np.full(H, -1, dtype=np.int32)
+
+    def update(self, y0, mask):
+        rows = mask.shape[0]
+        self.count += int(np.count_nonzero(mask))
+        hit = mask.any(axis=1)
+        if not hit.any():
+            return
+        first = mask.argmax(axis=1)
+        last  = self.W - 1 - mask[:, ::-1].argmax(axis=1)
+        self.row_min[y0:y0 + rows] = np.where(hit, first, -1)
+        self.row_max[y0:y0 + rows] = np.where(hit, last, -1)
+
+    def pct(self):
+        return round(self.count / (self.H * self.W) * 100, 1)
+
+    def rows(self):
+        """Indices of rows containing at least one pixel."""
+        return np.flatnonzero(self.row_min >= 0)
+
+    def bbox(self):
+        """([ymin, ymax], [xmin, xmax]), or ([0, 0], [0, 0]) when empty."""
+        rows = self.rows()
+        if not len(rows):
+            return [0, 0], [0, 0]
+        xs = self.row_min[rows], self.row_max[rows]
+        return ([int(rows[0]), int(rows[-1])],
+                [int(xs[0].min()), int(xs[1].max())])
+
+
+# ── Layer export ─────────────────────────────────────────────────────────────
+# Frame-sized state of a segmentation script:
+#   decoded source  PIL decodes a PNG as a whole, so the source image stays
+#                   in memory in its native mode (Image.open + first crop)
+#   label plane     H × W × label dtype (2 B/px for <= 16 layers), only in
+#                   refine_layers, for the hitbox contours of STEP 3
+#   layer_alpha     H × W × 1 B, one hitbox layer at a time
+# Everything else — the RGBA band, label map, masks and each layer's PNG
+# output — is one band (band_rows × W) per layer at most.
+class LayerWriters:
+    """One band-by-band RGBA PNG per layer: the source band with the layer's
+    mask as alpha (0 / 255), as the old full-frame putalpha + save wrote."""
+
+    def __init__(self, paths, W, H):
+        self.png = {}
+        try:
+            for name, path in paths.items():
+                self.png[name] = PngStream(path, W, H, "RGBA")
+        except BaseException:
+            self.close()
+            raise
+        self._buf = None
+
+    def write(self, name, band, mask):
+        if self._buf is None or self._buf.shape != band.shape:
+            self._buf = np.empty_like(band)
+        self._buf[:, :, :3] = band[:, :, :3]
+        np.multiply(mask, 255, out=self._buf[:, :, 3], casting="unsafe")
+        self.png[name].write(self._buf)
+
+    def close(self):
+        for png in self.png.values():
+            png.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def new_labels(H, W, dtype):
+    """Frame-sized label plane that band label maps are stored into."""
+    return np.empty((H, W), dtype=dtype)
+
+
+def store_band(labels, y0, label):
+    labels[y0:y0 + label.shape[0]] = label
+
+
+def layer_alpha(labels, bit, band_rows=DEFAULT_BAND_ROWS):
+    """8-bit alpha (0 / 255) of the layer with label bit `bit`, built band by
+    band so the only temporary is one band of the label plane."""
+    H, W = labels.shape
+    alpha = np.empty((H, W), dtype=np.uint8)
+    step = band_rows or H
+    for y0 in range(0, H, step):
+        np.not_equal(labels[y0:y0 + step] & bit, 0, out=alpha[y0:y0 + step].view(bool))
+    alpha *= 255
+    return Image.fromarray(alpha, "L")
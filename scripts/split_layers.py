@@ -6,15 +6,29 @@ Color analysis results:
   Trunk:   H_ocv ~20-38, S 60-110, V 100-200
   Roots:   H_ocv ~20-45, S 80-150, V 80-180
   Grass:   H_ocv ~38-58, S > 150, V > 100
+
+Chạy: python split_layers.py [--morph exact|separable]
 """
 import cv2
 import numpy as np
 import os
+import argparse
+
+from blend import apply_labels, lut, mask_labels, stack_luts, tint_into
+from blobs import keep_blobs
+from morphology import STRATEGIES, morph
+from paths import path
 
-SRC = r"D:\CRM WEB\team-progress-tracker\background.png"
-OUT = r"D:\CRM WEB\team-progress-tracker\scripts\layers_out"
+SRC = path("background", r"D:\CRM WEB\team-progress-tracker\background.png")
+OUT = path("layers_out", r"D:\CRM WEB\team-progress-tracker\scripts\layers_out")
 os.makedirs(OUT, exist_ok=True)
 
+ap = argparse.ArgumentParser()
+ap.add_argument("--morph", choices=STRATEGIES, default="exact",
+                help="close/dilate strategy (morphology.py): exact = full-res ellipse (default); "
+                     "separable = ~10x faster octagon, up to ~170 px off at corners")
+args = ap.parse_args()
+
 # Load image
 orig = cv2.imread(SRC, cv2.IMREAD_UNCHANGED)
 bgr = orig[:, :, :3].copy()
@@ -24,27 +38,10 @@ H, S, V = hsv[:,:,0], hsv[:,:,1], hsv[:,:,2]
 
 print(f"Image: {w}x{h}")
 
-def keep_blobs(mask, n=1, min_area=500):
-    """Keep n largest blobs."""
-    nb, labels, stats, _ = cv2.connectedComponentsWithStats(mask.astype(np.uint8), connectivity=8)
-    if nb <= 1:
-        return mask
-    sizes = stats[1:, cv2.CC_STAT_AREA]
-    idx = np.argsort(sizes)[::-1]
-    out = np.zeros_like(mask)
-    for i in idx[:n]:
-        if sizes[i] >= min_area:
-            out[labels == i+1] = 255
-    return out
-
 def save_layer(name, mask, color_bgr, idx):
     """Save a colored layer overlay on original."""
-    vis = bgr.copy()
-    result = vis.copy()
-    m = mask > 0
-    result[m] = np.clip(
-        bgr[m].astype(int) * 0.45 + np.array(color_bgr) * 0.55, 0, 255
-    ).astype(np.uint8)
+    result = bgr.copy()
+    tint_into(result, mask, lut(color_bgr, 0.55))
     pct = mask.sum() / 255 / (h * w) * 100
     print(f"  Layer {idx} {name}: {pct:.1f}% pixels")
     path = os.path.join(OUT, f"{idx}_{name}.png")
@@ -62,10 +59,8 @@ may_mask = (
 # Restrict strictly to top 22% where the 2 big clouds are
 may_mask[int(h*0.22):, :] = 0
 # Close gaps within each cloud, modest dilate
-k50 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (50, 50))
-k25 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (25, 25))
-may_mask = cv2.morphologyEx(may_mask, cv2.MORPH_CLOSE, k50)
-may_mask = cv2.morphologyEx(may_mask, cv2.MORPH_DILATE, k25)
+may_mask = morph(may_mask, "close", 50, args.morph)
+may_mask = morph(may_mask, "dilate", 25, args.morph)
 # Keep only the 2 largest cloud blobs
 may_mask = keep_blobs(may_mask, n=2, min_area=20000)
 save_layer("may_clouds", may_mask, (200, 230, 255), 1)
@@ -85,10 +80,8 @@ than_mask[:, int(w*0.56):] = 0
 than_mask[:int(h*0.40), :] = 0    # cut canopy (above 40%)
 than_mask[int(h*0.84):, :] = 0    # cut at exact trunk/root boundary
 than_mask[grass_excl > 0] = 0
-k20 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (20, 20))
-k12 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (12, 12))
-than_mask = cv2.morphologyEx(than_mask, cv2.MORPH_CLOSE, k20)
-than_mask = cv2.morphologyEx(than_mask, cv2.MORPH_DILATE, k12)
+than_mask = morph(than_mask, "close", 20, args.morph)
+than_mask = morph(than_mask, "dilate", 12, args.morph)
 than_mask = keep_blobs(than_mask, n=1, min_area=2000)
 save_layer("than_cay_trunk", than_mask, (140, 100, 200), 2)
 
@@ -107,10 +100,8 @@ re_mask[:, int(w*0.78):] = 0
 # Exclude only CLEARLY green grass (H>=48 is definitely grass, not root orange)
 grass_only = ((H >= 48) & (S > 148)).astype(np.uint8) * 255
 re_mask[grass_only > 0] = 0
-k30 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (30, 30))
-k18 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (18, 18))
-re_mask = cv2.morphologyEx(re_mask, cv2.MORPH_CLOSE, k30)
-re_mask = cv2.morphologyEx(re_mask, cv2.MORPH_DILATE, k18)
+re_mask = morph(re_mask, "close", 30, args.morph)
+re_mask = morph(re_mask, "dilate", 18, args.morph)
 re_mask = keep_blobs(re_mask, n=8, min_area=1500)
 save_layer("re_cay_roots", re_mask, (60, 130, 255), 3)
 
@@ -122,10 +113,8 @@ co_mask = (
     (V > 95)
 ).astype(np.uint8) * 255
 co_mask[:int(h*0.55), :] = 0
-k50 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (50, 50))
-k30 = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (30, 30))
-co_mask = cv2.morphologyEx(co_mask, cv2.MORPH_CLOSE, k50)
-co_mask = cv2.morphologyEx(co_mask, cv2.MORPH_DILATE, k30)
+co_mask = morph(co_mask, "close", 50, args.morph)
+co_mask = morph(co_mask, "dilate", 30, args.morph)
 save_layer("co_grass", co_mask, (50, 220, 80), 4)
 
 # ─── ALL LAYERS COMPOSITE ─────────────────────────────────────────────────────
@@ -135,12 +124,10 @@ layers = [
     (re_mask,   ( 60, 130, 255)),
     (co_mask,   ( 50, 220,  80)),
 ]
-composite = bgr.copy().astype(float)
-for mask, col in layers:
-    m = mask > 0
-    overlay = np.zeros_like(bgr, dtype=float)
-    overlay[m] = col
-    composite[m] = composite[m] * 0.5 + overlay[m] * 0.5
+# one label map (bit per layer) + composed LUTs: overlaps blend in list order
+composite = bgr.copy()
+apply_labels(composite, mask_labels([m for m, _ in layers]),
+             stack_luts([lut(col, 0.5) for _, col in layers]))
 
-cv2.imwrite(os.path.join(OUT, "0_ALL_LAYERS.png"), composite.astype(np.uint8))
+cv2.imwrite(os.path.join(OUT, "0_ALL_LAYERS.png"), composite)
 print("\nSaved to:", OUT)
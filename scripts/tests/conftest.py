@@ -0,0 +1,7 @@
+"""Make the flat scripts/ modules importable from the tests."""
+import os
+import sys
+
+SCRIPTS = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if SCRIPTS not in sys.path:
+    sys.path.insert(0, SCRIPTS)
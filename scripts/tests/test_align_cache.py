@@ -0,0 +1,91 @@
+"""
+Cold feature cache shared by concurrent processes (feature_cache.py,
+align_sift.py --mode pyramid).  Each align run uses a throwaway copy of
+scripts/ so its .cache starts empty, and gets its paths via PIPELINE_CONFIG.
+"""
+import os
+import sys
+import json
+import shutil
+import subprocess
+
+import numpy as np
+
+from conftest import SCRIPTS
+from feature_cache import FeatureCache
+
+WIDTH = 1024        # 1/8 scale is only 128 px: pyramid falls back to SCALE
+
+
+def _copy_scripts(tmp_path):
+    dst = tmp_path / "scripts"
+    shutil.copytree(SCRIPTS, dst, ignore=shutil.ignore_patterns(".cache", "__pycache__", "tests"))
+    return dst
+
+
+def _run_parallel(cmds, cwd, envs):
+    procs = [subprocess.Popen(c, cwd=cwd, env=e, stdout=subprocess.PIPE,
+                              stderr=subprocess.STDOUT, text=True, encoding="utf-8")
+             for c, e in zip(cmds, envs)]
+    return [(p.wait(timeout=600), p.stdout.read()) for p in procs]
+
+
+def test_feature_cache_keys_on_full_path(tmp_path):
+    cache = FeatureCache(str(tmp_path / "cache"), {"test": 1})
+    files = [tmp_path / "layer_1.png", tmp_path / "layer_1_x.png", tmp_path / "b" / "layer_1.png"]
+    files[2].parent.mkdir()
+    for i, f in enumerate(files):
+        f.write_bytes(b"v1 %d" % i)
+        cache.save(str(f), pts=np.array([i]))
+    files[0].write_bytes(b"v2")                        # new version: replaces only its own entry
+    cache.save(str(files[0]), pts=np.array([9]))
+    assert [int(cache.load(str(f))["pts"][0]) for f in files] == [9, 1, 2]
+    assert len(os.listdir(tmp_path / "cache")) == 3
+
+
+def test_feature_cache_parallel_writers(tmp_path):
+    scripts = _copy_scripts(tmp_path)
+    src = tmp_path / "layer.png"
+    src.write_bytes(b"not really a png" * 64)
+    code = (
+        "import sys, numpy as np\n"
+        "from feature_cache import FeatureCache\n"
+        "cache = FeatureCache(sys.argv[1], {'test': 1})\n"
+        "for _ in range(40):\n"
+        "    cache.save(sys.argv[2], pts=np.arange(5000, dtype=np.float32))\n"
+        "print(cache.load(sys.argv[2])['pts'].sum())\n"
+    )
+    cmd = [sys.executable, "-c", code, str(tmp_path / "cache"), str(src)]
+    results = _run_parallel([cmd, cmd], scripts, [dict(os.environ)] * 2)
+    for rc, out in results:
+        assert rc == 0, out
+    entries = sorted(os.listdir(tmp_path / "cache"))
+    assert len(entries) == 1 and entries[0].endswith(".npz"), entries   # no temp files left
+
+
+def test_align_pyramid_two_processes_cold_cache(tmp_path):
+    from bench_pipeline import make_inputs
+    scripts = _copy_scripts(tmp_path)
+    src = make_inputs(WIDTH, str(tmp_path / "in"))
+    shutil.copy(os.path.join(src, "2.png"), os.path.join(src, "3.png"))
+
+    envs = []
+    for k in range(2):
+        cfg = tmp_path / f"pipeline_{k}.json"
+        cfg.write_text(json.dumps({"paths": {
+            "pic_tree": src,
+            "pic_aligned": str(tmp_path / f"aligned_{k}"),
+            "report_dir": str(tmp_path / f"report_{k}"),
+        }}), encoding="utf-8")
+        os.makedirs(tmp_path / f"report_{k}")
+        envs.append(dict(os.environ, PIPELINE_CONFIG=str(cfg), PYTHONIOENCODING="utf-8"))
+
+    cmd = [sys.executable, "align_sift.py", "--mode", "pyramid", "--workers", "2", "--compare"]
+    results = _run_parallel([cmd, cmd], scripts, envs)
+    for k, (rc, out) in enumerate(results):
+        assert rc == 0, out
+        assert "Traceback" not in out, out
+        with open(tmp_path / f"report_{k}" / "pic_aligned_report.json", encoding="utf-8") as f:
+            report = json.load(f)
+        assert [l["source"] for l in report["layers"]] == ["2.png", "3.png"]
+    assert not [n for n in os.listdir(scripts / ".cache" / "features") if n.startswith(".tmp_")]
@@ -0,0 +1,85 @@
+"""
+crop_layers.py --incremental keeps hand-tuned report entries: x/y move with
+the crop origin, width/height scale with the crop size.
+"""
+import os
+import sys
+import json
+import subprocess
+
+from PIL import Image
+
+from conftest import SCRIPTS
+from crop_layers import patch_report
+
+
+def _info(x, y, w, h, source="11.png"):
+    return {"id": "layer_11.png", "x": x, "y": y, "width": w, "height": h, "source": source}
+
+
+def test_patch_keeps_hand_tuned_size_when_crop_size_unchanged():
+    layers = [{"id": "layer_11.png", "x": 7, "y": 0, "width": 5122, "height": 3365,
+               "source": "11.png", "zIndex": 3}]
+    old = {"bbox": [0, 0, 5120, 3365]}
+    patch_report(layers, _info(10, 4, 5120, 3365), old)
+    assert layers[0] == {"id": "layer_11.png", "x": 17, "y": 4, "width": 5122, "height": 3365,
+                         "source": "11.png", "zIndex": 3}
+
+
+def test_patch_scales_hand_tuned_size_with_crop():
+    layers = [{"x": 7, "y": 0, "width": 5130, "height": 1000, "source": "11.png"}]
+    patch_report(layers, _info(0, 0, 2560, 500), {"bbox": [0, 0, 5120, 1000]})
+    assert (layers[0]["width"], layers[0]["height"]) == (2565, 500)
+
+
+def test_patch_sliced_entry_scales_orig_height():
+    layers = [{"x": 0, "y": 300, "width": 800, "height": 200, "source": "11.png",
+               "isSliced": True, "sliceType": "bottom", "origY": 100, "origH": 410}]
+    patch_report(layers, _info(0, 10, 800, 800), {"bbox": [0, 0, 800, 400]})
+    l = layers[0]
+    assert (l["origY"], l["origH"], l["width"], l["height"]) == (110, 820, 800, 200)
+
+
+def test_patch_without_manifest_keeps_sizes():
+    layers = [{"x": 7, "y": 0, "width": 5122, "height": 3365, "source": "11.png"}]
+    patch_report(layers, _info(3, 3, 100, 100), None)
+    assert (layers[0]["x"], layers[0]["width"], layers[0]["height"]) == (7, 5122, 3365)
+
+
+def test_incremental_run_keeps_hand_edited_entry(tmp_path):
+    src, out, rep = tmp_path / "pic", tmp_path / "out", tmp_path / "rep"
+    for d in (src, out, rep):
+        d.mkdir()
+    Image.new("RGB", (400, 300), (10, 20, 30)).save(src / "1.png")
+
+    def layer(box):
+        im = Image.new("RGBA", (400, 300), (0, 0, 0, 0))
+        im.paste((200, 100, 50, 255), box)
+        im.save(src / "11.png")
+
+    cfg = tmp_path / "pipeline.json"
+    cfg.write_text(json.dumps({"paths": {"pic_tree": str(src), "pic_layers": str(out),
+                                         "report_dir": str(rep)}}), encoding="utf-8")
+    env = dict(os.environ, PIPELINE_CONFIG=str(cfg), PYTHONIOENCODING="utf-8")
+
+    def crop():
+        r = subprocess.run([sys.executable, "crop_layers.py", "--incremental", "--no-pyramid"],
+                           cwd=SCRIPTS, env=env, capture_output=True, text=True, encoding="utf-8")
+        assert r.returncode == 0, r.stdout + r.stderr
+        with open(rep / "pic_layers_report.json", encoding="utf-8") as f:
+            return json.load(f)
+
+    layer((50, 40, 250, 140))                  # crop 200x100 at (50, 40)
+    report = crop()
+    (entry,) = report["layers"]
+    assert (entry["x"], entry["y"], entry["width"], entry["height"]) == (50, 40, 200, 100)
+
+    entry.update(x=57, width=202, zIndex=5)    # hand-tuned placement
+    with open(rep / "pic_layers_report.json", "w", encoding="utf-8") as f:
+        json.dump(report, f)
+
+    layer((60, 40, 460, 140))                  # crop grows to 340x100 at (60, 40)
+    (entry,) = crop()["layers"]
+    assert entry["x"] == 67 and entry["y"] == 40
+    assert (entry["width"], entry["height"]) == (round(202 * 340 / 200), 100)
+    assert entry["zIndex"] == 5
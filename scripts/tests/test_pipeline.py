@@ -0,0 +1,91 @@
+"""
+pipeline.py graph checks: one producer per output, dependencies by path
+overlap (not by identical pattern strings), sources that must exist.
+"""
+import os
+import json
+
+import pytest
+
+from conftest import SCRIPTS
+from pipeline import load_stages, outputs_present, run_stage, HashCache
+
+
+def _config(*stages, **paths):
+    return {"paths": paths, "stages": list(stages)}
+
+
+def _stage(name, inputs=(), outputs=(), **extra):
+    return {"name": name, "script": "check_sizes.py", "inputs": list(inputs),
+            "outputs": list(outputs), **extra}
+
+
+def test_shipped_config_loads():
+    with open(os.path.join(SCRIPTS, "pipeline.json"), encoding="utf-8") as f:
+        stages = {s.name: s for s in load_stages(json.load(f))}
+    assert stages["pack_atlas"].deps == {"crop_layers", "hit_index"}
+    assert stages["export_layers"].deps == set()
+
+
+def test_duplicate_output_is_rejected():
+    cfg = _config(_stage("a", outputs=["{out}/0_ALL.png"]),
+                  _stage("b", outputs=["{out}/[1-6]_*.png", "{out}/0_ALL.png"]),
+                  out="/x")
+    with pytest.raises(ValueError, match="a and b both write"):
+        load_stages(cfg)
+
+
+def test_output_patterns_that_can_name_the_same_file_are_rejected():
+    cfg = _config(_stage("a", outputs=["/x/*.png"]), _stage("b", outputs=["/x/layer_1.png"]))
+    with pytest.raises(ValueError, match="both write"):
+        load_stages(cfg)
+
+
+def test_dependency_matches_paths_not_pattern_strings(tmp_path):
+    (tmp_path / "layer_3.png").write_bytes(b"")
+    cfg = _config(_stage("a", outputs=[f"{tmp_path}/layer_*.png"]),
+                  _stage("b", inputs=[f"{tmp_path}/layer_3.png"]),
+                  _stage("c", inputs=[f"{tmp_path}/*.png"]),
+                  _stage("d", inputs=[f"{tmp_path}/other.json"]))
+    stages = {s.name: s for s in load_stages(cfg)}
+    assert stages["b"].deps == {"a"} and stages["b"].sources == []
+    assert stages["c"].deps == {"a"}
+    assert stages["d"].deps == set() and stages["d"].sources == [f"{tmp_path}/other.json"]
+
+
+def test_updates_serialise_in_config_order_and_need_a_producer():
+    cfg = _config(_stage("a", outputs=["/x/report.json"]),
+                  _stage("b", updates=["/x/report.json"]),
+                  _stage("c", updates=["/x/report.json"]))
+    stages = {s.name: s for s in load_stages(cfg)}
+    assert stages["c"].deps == {"a", "b"}
+    with pytest.raises(ValueError, match="no earlier stage outputs"):
+        load_stages(_config(_stage("b", updates=["/x/report.json"])))
+
+
+def test_input_written_by_a_later_stage_is_rejected():
+    cfg = _config(_stage("a", inputs=["/x/*.png"]), _stage("b", outputs=["/x/1.png"]))
+    with pytest.raises(ValueError, match="later stage b"):
+        load_stages(cfg)
+
+
+def test_unmatched_source_fails_the_stage(tmp_path):
+    (stage,) = load_stages(_config(_stage("a", inputs=[f"{tmp_path}/*.png"])))
+    status, _, detail = run_stage(stage, str(tmp_path / "cfg.json"), HashCache({}), None,
+                                  force=True, dry_run=False)
+    assert status == "failed" and "*.png" in detail
+
+
+def test_crop_layers_outputs_include_the_pyramid(tmp_path):
+    with open(os.path.join(SCRIPTS, "pipeline.json"), encoding="utf-8") as f:
+        cfg = json.load(f)
+    cfg["paths"].update(pic_tree=str(tmp_path / "tree"), pic_layers=str(tmp_path / "layers"),
+                        report_dir=str(tmp_path))
+    crop = next(s for s in load_stages(cfg) if s.name == "crop_layers")
+    (tmp_path / "layers" / "pyramid").mkdir(parents=True)
+    for name in ("layers/layer_2.png", "layers/pyramid/layer_2@2.webp",
+                 "pic_layers_report.json", "pic_layers_manifest.json"):
+        (tmp_path / name).write_bytes(b"")
+    assert outputs_present(crop)
+    (tmp_path / "layers" / "pyramid" / "layer_2@2.webp").unlink()
+    assert not outputs_present(crop)
@@ -0,0 +1,37 @@
+"""
+encode.PngStream writes the same pixels as a whole-image save, band by band.
+"""
+import numpy as np
+import pytest
+from PIL import Image
+
+from encode import PngStream
+
+
+@pytest.mark.parametrize("mode,channels", [("RGBA", 4), ("RGB", 3), ("L", 1)])
+@pytest.mark.parametrize("profile", [None, "fast", "release"])
+def test_bands_round_trip(tmp_path, mode, channels, profile):
+    rng = np.random.default_rng(0)
+    shape = (70, 33) if channels == 1 else (70, 33, channels)
+    px = (rng.integers(0, 256, shape) // 51 * 51).astype(np.uint8)   # flat runs + edges
+    path = tmp_path / "out.png"
+    with PngStream(path, 33, 70, mode, profile) as png:
+        for y0 in range(0, 70, 32):
+            png.write(px[y0:y0 + 32])
+    with Image.open(path) as img:
+        assert img.mode == mode
+        assert np.array_equal(np.asarray(img), px)
+
+
+def test_missing_rows_raise(tmp_path):
+    png = PngStream(tmp_path / "out.png", 4, 4, "L")
+    png.write(np.zeros((2, 4), np.uint8))
+    with pytest.raises(ValueError, match="2 rows missing"):
+        png.close()
+
+
+def test_wrong_width_raises(tmp_path):
+    with PngStream(tmp_path / "out.png", 4, 1, "RGBA") as png:
+        with pytest.raises(ValueError):
+            png.write(np.zeros((1, 5, 4), np.uint8))
+        png.write(np.zeros((1, 4, 4), np.uint8))
@@ -2,89 +2,191 @@
 visualize_layers.py
 Tạo 1 ảnh composite hiển thị tất cả layers với màu overlay khác nhau,
 để dễ kiểm tra vị trí các vùng đã tách.
+
+Chạy: python visualize_layers.py [nearest|mode]
+  Label map (bit i = layer i của bộ luật "refined") được tính theo từng dải
+  hàng như refine_layers.py và không bao giờ giữ cả khung: mỗi dải góp vào
+  bản thu nhỏ (nearest = như trước, mode = giá trị chiếm đa số trong mỗi
+  khối, đếm bằng bincount theo dải), moment để đặt nhãn ở trọng tâm thật, và
+  OR theo hàng/cột để lấy bbox.  Bản thu nhỏ được tô màu bằng bảng palette
+  RGBA theo giá trị label (các layer chồng nhau đã được alpha_composite sẵn).
 """
 
 import os
+import sys
 from PIL import Image, ImageDraw, ImageFont
 import numpy as np
 
-SRC  = r"d:\CRM WEB\team-progress-tracker\public\tree-crm.png"
-OUT  = r"d:\CRM WEB\team-progress-tracker\scripts\layers"
-PUB  = r"d:\CRM WEB\team-progress-tracker\public"
-
-img  = Image.open(SRC).convert("RGBA")
-arr  = np.array(img)
-H, W = arr.shape[:2]
-R,G,B,A = arr[:,:,0],arr[:,:,1],arr[:,:,2],arr[:,:,3]
+from layer_rules import compile_rules
+from paths import path
+from segment import DEFAULT_BAND_ROWS, iter_bands
 
-def rgb2hsv(rr,gg,bb):
-    r,g,b=rr/255.,gg/255.,bb/255.
-    cmax=np.maximum(np.maximum(r,g),b); cmin=np.minimum(np.minimum(r,g),b)
-    delta=cmax-cmin+1e-10
-    h=np.zeros_like(r); s=np.where(cmax==0,0,delta/cmax); v=cmax
-    mr=(cmax==r)&(delta>0); mg=(cmax==g)&(delta>0); mb=(cmax==b)&(delta>0)
-    h[mr]=(60*((g[mr]-b[mr])/delta[mr]))%360
-    h[mg]=60*((b[mg]-r[mg])/delta[mg])+120
-    h[mb]=60*((r[mb]-g[mb])/delta[mb])+240
-    return h,s,v
+SRC  = path("tree_png", r"d:\CRM WEB\team-progress-tracker\public\tree-crm.png")
+OUT  = path("layers_dir", r"d:\CRM WEB\team-progress-tracker\scripts\layers")
+PUB  = path("public", r"d:\CRM WEB\team-progress-tracker\public")
+DOWNSAMPLE = sys.argv[1] if len(sys.argv) > 1 else "nearest"   # nearest | mode
 
-Hc,Sc,Vc=rgb2hsv(R.astype(float),G.astype(float),B.astype(float))
+img  = Image.open(SRC)
+W, H = img.size
 
 # ── Define layers + overlay colors ───────────────────────────────────────────
-sky     =(((Hc>=190)&(Hc<=230)&(Sc<0.55)&(Vc>0.60))|((Sc<0.10)&(Vc>0.85)))
-clouds  =((Sc<0.28)&(Vc>0.78))|((Hc>=175)&(Hc<=215)&(Sc<0.40)&(Vc>0.70)); clouds&=~sky
-rzone   =np.zeros((H,W),bool); rzone[:int(H*.40),int(W*.45):]=True
-rain    =rzone&(Hc>=190)&(Hc<=240)&(Sc>=0.05)&(Sc<=0.45)&(Vc>=0.55)&(Vc<=0.95)
-wzone   =np.zeros((H,W),bool); wzone[:int(H*.50),:int(W*.40)]=True
-wind    =wzone&(Hc>=150)&(Hc<=210)&(Sc>=0.05)&(Sc<=0.55)&(Vc>=0.50); wind&=~clouds&~sky
-canopy  =(Hc>=50)&(Hc<=165)&(Sc>=0.18)&(Vc>=0.12)&(Vc<=0.88)
-branches=(Hc>=12)&(Hc<=42)&(Sc>=0.22)&(Sc<=0.82)&(Vc>=0.22)&(Vc<=0.72)&~canopy
-trunk   =(Hc>=8)&(Hc<=50)&(Sc>=0.12)&(Sc<=0.80)&(Vc>=0.08)&(Vc<=0.50)&~canopy
-rtz     =np.zeros((H,W),bool); rtz[int(H*.55):,:]=True
-roots   =trunk&rtz
-gz      =np.zeros((H,W),bool); gz[int(H*.58):,:]=True
-grass   =gz&(((Hc>=60)&(Hc<=135)&(Sc>=0.15)&(Vc<0.55))|((Hc>=18)&(Hc<=65)&(Sc>=0.18)&(Vc<0.45)))
+RULES = compile_rules("refined")        # same rules as refine_layers.py; bit i = RULES.names[i]
 
 layers_vis = [
-    ("Sky",      sky,      (135, 206, 250, 100)),   # light blue
-    ("Clouds",   clouds,   (255, 255, 255, 120)),   # white
-    ("Rain",     rain,     ( 30, 144, 255, 200)),   # blue
-    ("Wind",     wind,     (  0, 255, 220, 200)),   # cyan
-    ("Canopy",   canopy,   ( 34, 139,  34, 120)),   # green
-    ("Branches", branches, (139,  90,  43, 180)),   # brown
-    ("Trunk",    trunk,    ( 80,  40,  10, 200)),   # dark brown
-    ("Roots",    roots,    (180, 100,   0, 220)),   # amber
-    ("Grass",    grass,    ( 0,  80,   0, 180)),    # dark green
+    ("Sky",      "sky",      (135, 206, 250, 100)),   # light blue
+    ("Clouds",   "clouds",   (255, 255, 255, 120)),   # white
+    ("Rain",     "rain",     ( 30, 144, 255, 200)),   # blue
+    ("Wind",     "wind",     (  0, 255, 220, 200)),   # cyan
+    ("Canopy",   "canopy",   ( 34, 139,  34, 120)),   # green
+    ("Branches", "branches", (139,  90,  43, 180)),   # brown
+    ("Trunk",    "trunk",    ( 80,  40,  10, 200)),   # dark brown
+    ("Roots",    "roots",    (180, 100,   0, 220)),   # amber
+    ("Grass",    "grass",    ( 0,  80,   0, 180)),    # dark green
 ]
+BITS = [RULES.names.index(rule) for _, rule, _ in layers_vis]
+
+
+# ── Label map → overlay, centroids, bboxes (band by band) ──────────────────
+def palette(bits, colors, n):
+    """RGBA per label value (n = 2^bits): the colours of its set bits stacked
+    with alpha_composite in list order, exactly like compositing the layers."""
+    values = np.arange(n)
+    pal = Image.new("RGBA", (n, 1), (0, 0, 0, 0))
+    for b, rgba in zip(bits, colors):
+        part = np.zeros((1, n, 4), dtype=np.uint8)
+        part[0, (values >> b) & 1 == 1] = rgba
+        pal = Image.alpha_composite(pal, Image.fromarray(part, "RGBA"))
+    return np.array(pal)[0]
+
+
+def nearest_index(n_in, n_out):
+    """Source index PIL's NEAREST resize samples for each of n_out outputs."""
+    idx = Image.fromarray(np.arange(n_in, dtype=np.int32)[:, None], "I")
+    return np.array(idx.resize((1, n_out), Image.NEAREST))[:, 0]
+
+
+class Downsample:
+    """Label map at out_w×out_h, fed band by band.  nearest: one sample per
+    output pixel (what resizing each mask with NEAREST gave); mode: most
+    frequent label value of the source block (ties → larger value).
+
+    mode counts with one bincount per chunk over (output cell, value id);
+    value ids are handed out as values first appear, so the counts are
+    rows × out_w × (distinct values seen), only for the output rows a
+    MODE_ROWS chunk of the band touches plus the last one, which may continue
+    into the next chunk."""
+    MODE_ROWS = 64
+
+    def __init__(self, h, w, out_w, out_h, n, dtype, method="nearest"):
+        self.h, self.out_w, self.method = h, out_w, method
+        self.out = np.zeros((out_h, out_w), dtype=dtype)
+        if method == "nearest":
+            self.rows, self.cols = nearest_index(h, out_h), nearest_index(w, out_w)
+            return
+        self.oy = np.arange(h) * out_h // h         # source row → output row
+        self.ox = np.arange(w) * out_w // w
+        self.ids = np.full(n, -1, dtype=np.int64)   # label value → id
+        self.values = []                            # id → label value
+        self.r0 = 0                                 # output row of counts[0]
+        self.counts = np.zeros((0, out_w, 0), dtype=np.int64)
+
+    def update(self, y0, label):
+        y1 = y0 + len(label)
+        if self.method == "nearest":
+            sel = (self.rows >= y0) & (self.rows < y1)
+            self.out[sel] = label[self.rows[sel] - y0][:, self.cols]
+            return
+        for y in range(0, len(label), self.MODE_ROWS):
+            self._count(y0 + y, label[y:y + self.MODE_ROWS])
+
+    def _count(self, y0, label):
+        y1 = y0 + len(label)
+        for v in np.unique(label[self.ids[label] < 0]):
+            self.ids[v] = len(self.values)
+            self.values.append(v)
+        k = len(self.values)
+        rows = self.oy[y0:y1] - self.r0
+        cell = rows[:, None] * self.out_w + self.ox[None, :]
+        n_rows = int(rows[-1]) + 1
+        counts = np.bincount((cell * k + self.ids[label]).ravel(),
+                             minlength=n_rows * self.out_w * k).reshape(n_rows, self.out_w, k)
+        prev = self.counts
+        counts[:len(prev), :, :prev.shape[2]] += prev
+        done = n_rows if y1 == self.h else n_rows - 1
+        order = np.argsort(self.values)[::-1]       # larger value first: wins ties
+        best = counts[:done][:, :, order].argmax(axis=2)
+        self.out[self.r0:self.r0 + done] = np.asarray(self.values)[order][best]
+        self.counts, self.r0 = counts[done:], self.r0 + done
+
+
+def add_moments(m, y0, label):
+    """Add a band's zeroth/first moments per label value to m = (m00, m10,
+    m01): a count and an x-weighted bincount per row, the row's counts times
+    y for m01, so temporaries stay one row wide."""
+    m00, m10, m01 = m
+    n = len(m00)
+    xs = np.arange(label.shape[1], dtype=np.float64)
+    for y, row in enumerate(label, y0):
+        cnt = np.bincount(row, minlength=n)
+        m00 += cnt
+        m01 += y * cnt
+        m10 += np.bincount(row, weights=xs, minlength=n)
+
+
+def moments(m, bits):
+    """Per bit: (pixel count, centroid x, centroid y) from add_moments sums."""
+    m00, m10, m01 = m
+    values = np.arange(len(m00))
+    out = []
+    for b in bits:
+        sel = (values >> b) & 1 == 1
+        c = m00[sel].sum()
+        out.append((c, m10[sel].sum() / c, m01[sel].sum() / c) if c else (0, None, None))
+    return out
+
+
+def bboxes(rows, cols, bits):
+    """Per bit: (x0, y0, x1, y1) exclusive, or None — from the OR of every row / column."""
+    out = []
+    for b in bits:
+        ys = np.flatnonzero((rows >> b) & 1)
+        xs = np.flatnonzero((cols >> b) & 1)
+        out.append((xs[0], ys[0], xs[-1] + 1, ys[-1] + 1) if len(ys) else None)
+    return out
+
 
 # Scale down to 900 wide for output
 scale = 900/W
 out_w = 900
 out_h = round(H * scale)
-base  = img.resize((out_w, out_h), Image.LANCZOS)
-overlay = Image.new("RGBA", (out_w, out_h), (0,0,0,0))
-draw    = ImageDraw.Draw(overlay)
-
-for name, mask, rgba in layers_vis:
-    # Downscale mask
-    mask_img = Image.fromarray((mask*255).astype(np.uint8), "L").resize((out_w,out_h), Image.NEAREST)
-    mask_arr = np.array(mask_img) > 128
-    color_layer = np.zeros((out_h, out_w, 4), dtype=np.uint8)
-    color_layer[mask_arr] = rgba
-    overlay_part = Image.fromarray(color_layer, "RGBA")
-    overlay = Image.alpha_composite(overlay, overlay_part)
-
-    # Draw label at centroid
-    rows = np.where(np.any(mask_arr, axis=1))[0]
-    cols = np.where(np.any(mask_arr, axis=0))[0]
-    if rows.any() and cols.any():
-        cy = int(rows.mean()); cx = int(cols.mean())
-        draw.ellipse([cx-4,cy-4,cx+4,cy+4], fill=(255,255,255,255))
-        draw.text((cx+7, cy-8), name, fill=(255,255,255,255))
+base  = (img if img.mode in ("RGB", "RGBA") else img.convert("RGBA")).resize((out_w, out_h), Image.LANCZOS)
+
+n_values = 1 << len(RULES.names)
+small = Downsample(H, W, out_w, out_h, n_values, RULES.dtype, DOWNSAMPLE)
+sums = tuple(np.zeros(n_values) for _ in range(3))
+rows_or = np.zeros(H, dtype=RULES.dtype)
+cols_or = np.zeros(W, dtype=RULES.dtype)
+for y0, band in iter_bands(img, DEFAULT_BAND_ROWS):
+    label = RULES.label_rgb(band, y0, H, W)
+    small.update(y0, label)
+    add_moments(sums, y0, label)
+    rows_or[y0:y0 + len(label)] = np.bitwise_or.reduce(label, axis=1)
+    cols_or |= np.bitwise_or.reduce(label, axis=0)
+
+PAL = palette(BITS, [rgba for _, _, rgba in layers_vis], n_values)
+overlay = Image.fromarray(PAL[small.out], "RGBA")
 
 # Composite: base + overlay
 result = Image.alpha_composite(base.convert("RGBA"), overlay)
 
+# Draw labels at the true (full-res) centroids
+draw = ImageDraw.Draw(result)
+for (name, _, _), (count, mx, my) in zip(layers_vis, moments(sums, BITS)):
+    if count:
+        cx, cy = int(mx * scale), int(my * scale)
+        draw.ellipse([cx-4,cy-4,cx+4,cy+4], fill=(255,255,255,255))
+        draw.text((cx+7, cy-8), name, fill=(255,255,255,255))
+
 # Save for inspection
 vis_path = os.path.join(OUT, "layer_visualization.png")
 result.save(vis_path)
@@ -102,11 +204,10 @@ sx = 900/W
 print(f"\n📐 SVG ViewBox: 0 0 900 {round(900*H/W)}")
 print(f"   Scale: px × {sx:.4f} = SVG unit\n")
 
-for name, mask, _ in layers_vis:
-    rows = np.any(mask, axis=1); cols = np.any(mask, axis=0)
-    if rows.any() and cols.any():
-        ry=[int(np.where(rows)[0].min()),int(np.where(rows)[0].max())]
-        rx=[int(np.where(cols)[0].min()),int(np.where(cols)[0].max())]
+for (name, _, _), box in zip(layers_vis, bboxes(rows_or, cols_or, BITS)):
+    if box:
+        ry=[box[1],box[3]-1]
+        rx=[box[0],box[2]-1]
         sy=[round(ry[0]*sx),round(ry[1]*sx)]
         sx2=[round(rx[0]*sx),round(rx[1]*sx)]
         print(f"  {name:10s}: svg x={sx2[0]}-{sx2[1]:3d}  y={sy[0]}-{sy[1]:3d}")